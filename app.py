@@ -4,34 +4,52 @@
 Веб-приложение для инвентаризации складских мест.
 """
 
-import asyncio
+import base64
+import hashlib
 import hmac
-import json
+import itertools
 import logging
+import math
 import os
 import random
 import re
 import secrets
 import sys
+import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
 load_dotenv()
 from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO
 from pathlib import Path
+from urllib.parse import quote
 
-from flask import Flask, g, jsonify, render_template, request, send_file, send_from_directory, redirect, session
+from flask import Flask, Response, g, jsonify, render_template, request, send_file, send_from_directory, redirect, session, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as XlImage
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+import orjson
+from PIL import Image as PILImage
 from werkzeug.exceptions import BadRequest
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding="utf-8")
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import NamedTupleCursor, RealDictCursor, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
-from core.db import safe_rollback, ensure_shift_start_table, ensure_warehouse_places_mx_status
-from core.places import get_place_handler
-from core.scans import complete_scan_handler
+from core.db import safe_rollback, ensure_shift_start_table, ensure_warehouse_places_mx_status, execute_cached, single_statement_commit
+from core.places import DIM_TRANSLATE, get_place_handler, normalize_mx_code
+from core.scans import PHOTO_POOL, complete_scan_handler
 
 # Настройка логирования
 logging.basicConfig(
@@ -40,8 +58,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def _orjson_default(obj):
+    # То, что orjson не умеет сам; Decimal (SUM/NUMERIC из БД) — строкой, как в стандартном провайдере Flask.
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ORJSONProvider(JSONProvider):
+    """JSON через orjson: быстрее stdlib json, datetime/date отдаёт в ISO 8601 без isoformat() в обработчиках."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Инициализация Flask
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config['JSON_AS_ASCII'] = False
 app.config["SECRET_KEY"] = os.environ.get("FLASK_SECRET_KEY") or os.environ.get("SECRET_KEY") or secrets.token_hex(32)
 app.config["SESSION_COOKIE_HTTPONLY"] = True
@@ -50,6 +89,15 @@ app.config["SESSION_COOKIE_SECURE"] = (os.environ.get("COOKIE_SECURE") or "").st
 
 ADMIN_BADGE = (os.environ.get("ADMIN_BADGE") or "ADMIN").strip()
 ADMIN_PASSWORD = (os.environ.get("ADMIN_PASSWORD") or "").strip()
+# Пароль сравниваем по дайджесту, посчитанному один раз при старте: compare_digest на str
+# падает с TypeError для не-ASCII ввода (кириллица), а на bytes одинаковой длины — постоянное время.
+_ADMIN_PASSWORD_DIGEST = hashlib.blake2b(ADMIN_PASSWORD.encode("utf-8"), digest_size=32).digest()
+
+
+def _admin_password_ok(password: str) -> bool:
+    digest = hashlib.blake2b(password.encode("utf-8"), digest_size=32).digest()
+    return hmac.compare_digest(digest, _ADMIN_PASSWORD_DIGEST)
+
 
 # Настройка CORS для Safari и других браузеров
 CORS(app, resources={
@@ -61,10 +109,15 @@ CORS(app, resources={
     }
 })
 
+# PgBouncer (pool_mode=transaction) перед Postgres: USE_POOLED_DB=1 + DB_BOUNCER_HOST/DB_BOUNCER_PORT.
+# В transaction-режиме нельзя полагаться на состояние сессии (SET, PREPARE) — только SET LOCAL.
+USE_POOLED_DB = (os.environ.get("USE_POOLED_DB") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
 # Конфигурация БД из переменных окружения
 class _DBConfig:
-    host = os.environ.get("DB_HOST", "31.207.77.167")
-    port = int(os.environ.get("DB_PORT", "5432"))
+    host = (USE_POOLED_DB and os.environ.get("DB_BOUNCER_HOST")) or os.environ.get("DB_HOST", "31.207.77.167")
+    port = int((USE_POOLED_DB and os.environ.get("DB_BOUNCER_PORT")) or os.environ.get("DB_PORT", "5432"))
     database = os.environ.get("DB_NAME", "botdb")
     user = os.environ.get("DB_USER", "aperepechkin")
     password = os.environ.get("DB_PASSWORD", "password")
@@ -73,12 +126,51 @@ class _DBConfig:
 DB_CONFIG = _DBConfig()
 
 IS_VERCEL = os.environ.get("VERCEL") == "1"
+
+# Пул соединений для долгоживущего процесса (gunicorn/flask run). На Vercel не используется.
+DB_POOL_MINCONN = int(os.environ.get("DB_POOL_MINCONN", "1"))
+DB_POOL_MAXCONN = int(os.environ.get("DB_POOL_MAXCONN", "20"))
+# Сколько соединений пула дашборд админки может занять сверх соединения самого запроса:
+# пул общий со сканерами, и его исчерпание означает PoolError (500) у них.
+ADMIN_DASHBOARD_EXTRA_CONNS = int(os.environ.get("ADMIN_DASHBOARD_EXTRA_CONNS", "3"))
+_db_pool = None
+_db_pool_lock = threading.Lock()
 CSRF_COOKIE_NAME = "csrf_token"
 CSRF_HEADER_NAME = "X-CSRF-Token"
 
 # Небольшой in-memory кэш для тяжёлых админских агрегатов (снижает нагрузку при частых refresh).
 ADMIN_CACHE_TTL_SECONDS = int(os.environ.get("ADMIN_CACHE_TTL_SECONDS", "45"))
 _admin_cache = {}
+_admin_compute_locks = {}
+_admin_compute_locks_guard = threading.Lock()
+
+# Короткий кэш занятых зон: при массовом входе сотрудники не гоняют SELECT DISTINCT
+# по active_tasks на каждый запрос задания. Сбрасывается при любом изменении заданий.
+OCCUPIED_ZONES_TTL_SECONDS = float(os.environ.get("OCCUPIED_ZONES_TTL_SECONDS", "3"))
+_occupied_zones_cache = {"ts": 0.0, "zones": None}
+
+# Список зон (первые 9 символов mx_code) справочника: меняется только при импорте,
+# поэтому случайная зона для задания выбирается в памяти, а не запросом к warehouse_places.
+ZONE_INDEX_TTL_SECONDS = float(os.environ.get("ZONE_INDEX_TTL_SECONDS", "600"))
+_zone_index_cache = {"ts": 0.0, "zones": None}
+# Попыток резерва зоны; повтор нужен только если кандидата перехватили между снимком и INSERT.
+RESERVE_ZONE_ATTEMPTS = 2
+
+# /api/sync: версия справочника (для ETag) пересчитывается не чаще раза в SYNC_VERSION_TTL_SECONDS,
+# готовые JSON-ответы последних запросов держим по ETag — повторная синхронизация не ходит в БД.
+# Ответ без limit — весь справочник склада, поэтому кэш ограничен и по числу, и по сумме байт;
+# ответ больше SYNC_PAYLOAD_CACHE_MAX_BYTES не кэшируется.
+SYNC_VERSION_TTL_SECONDS = float(os.environ.get("SYNC_VERSION_TTL_SECONDS", "30"))
+SYNC_PAYLOAD_CACHE_SIZE = int(os.environ.get("SYNC_PAYLOAD_CACHE_SIZE", "32"))
+SYNC_PAYLOAD_CACHE_MAX_BYTES = int(os.environ.get("SYNC_PAYLOAD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Строк за один FETCH с серверного курсора при выгрузке ошибок по складу в xlsx.
+EXPORT_FETCH_BATCH_SIZE = int(os.environ.get("EXPORT_FETCH_BATCH_SIZE", "1000"))
+# Строк за один FETCH с серверного курсора при сборке ответа /api/sync.
+SYNC_FETCH_BATCH_SIZE = int(os.environ.get("SYNC_FETCH_BATCH_SIZE", "5000"))
+_sync_version_cache = {"ts": 0.0, "version": None}
+_sync_payload_cache = OrderedDict()
+_sync_payload_bytes = 0
+_sync_payload_lock = threading.Lock()
 
 # Простой in-memory rate-limit для дорогих endpoint'ов.
 # Формат: key -> (window_start_ts, count)
@@ -171,6 +263,28 @@ def _is_authenticated_for_sync() -> bool:
     return _is_authenticated_session()
 
 
+# Готовые заголовки ответа на CORS preflight (те же правила, что в CORS(app, ...) выше).
+# Max-Age — браузер кэширует preflight и не повторяет OPTIONS перед каждой загрузкой.
+_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, X-CSRF-Token",
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Max-Age": "86400",
+    "Vary": "Origin",
+}
+
+
+@app.before_request
+def _short_circuit_cors_preflight():
+    """Preflight отвечаем сразу 204: без init БД, CSRF/admin-проверок и обработчика роута."""
+    if request.method != "OPTIONS" or "Access-Control-Request-Method" not in request.headers:
+        return None
+    headers = dict(_PREFLIGHT_HEADERS)
+    # origins="*" + supports_credentials: как и flask_cors, отражаем Origin запроса.
+    headers["Access-Control-Allow-Origin"] = request.headers.get("Origin") or "*"
+    return "", 204, headers
+
+
 @app.before_request
 def _init_db_once():
     """Создаёт таблицы и индексы один раз на весь процесс (или один раз на каждый cold-start на Vercel)."""
@@ -181,7 +295,8 @@ def _init_db_once():
     if now < _db_init_retry_after_ts:
         return
     try:
-        ensure_tasks_table()
+        if not ensure_tasks_table():
+            raise RuntimeError("инициализация схемы не выполнена")
         _db_initialized = True
     except Exception as exc:
         _db_init_retry_after_ts = now + max(5, _db_init_backoff_seconds)
@@ -226,12 +341,24 @@ def manifest_json():
     return send_from_directory(app.static_folder, 'manifest.json', mimetype='application/manifest+json')
 
 
+# sw.js браузер перезапрашивает на каждой загрузке страницы: тело и ETag читаем один раз при импорте,
+# дальше ответ — готовые bytes или 304. На Vercel /sw.js отдаёт CDN (см. vercel.json).
+with open(os.path.join(app.static_folder, 'sw.js'), 'rb') as _sw_file:
+    _SW_BODY = _sw_file.read()
+_SW_ETAG = hashlib.md5(_SW_BODY).hexdigest()
+
+
 @app.route('/sw.js')
 def service_worker():
     """Service Worker для PWA (scope / через Service-Worker-Allowed)."""
-    resp = send_from_directory(app.static_folder, 'sw.js', mimetype='application/javascript')
-    resp.headers['Service-Worker-Allowed'] = '/'
-    return resp
+    headers = {
+        'Service-Worker-Allowed': '/',
+        'ETag': f'"{_SW_ETAG}"',
+        'Cache-Control': 'max-age=0, must-revalidate',
+    }
+    if _SW_ETAG in request.if_none_match:
+        return Response(status=304, headers=headers)
+    return Response(_SW_BODY, mimetype='application/javascript', headers=headers)
 
 
 @app.after_request
@@ -243,7 +370,7 @@ def add_camera_permissions_policy(response):
         payload = response.get_json(silent=True)
         if isinstance(payload, dict) and "error" in payload:
             payload["error"] = "Внутренняя ошибка сервера"
-            response.set_data(json.dumps(payload, ensure_ascii=False))
+            response.set_data(app.json.dumps(payload))
     return response
 
 
@@ -253,312 +380,654 @@ def ping():
     return jsonify({'ok': True}), 200
 
 
+# Результат опроса БД живёт HEALTH_CACHE_TTL_SECONDS: частые пробы мониторинга и клиентов
+# дают не больше одного SELECT 1 в секунду на процесс.
+HEALTH_CACHE_TTL_SECONDS = 1.0
+_health_cache = {"ts": 0.0, "payload": None, "status": 200}
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Проверка с опросом БД (для мониторинга). При недоступности БД — 503."""
-    try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1")
-            cur.fetchone()
-        return jsonify({'ok': True}), 200
-    except Exception as exc:
-        logger.warning("Health-check failed: %s", exc)
-        err_msg = "Проблема соединения с сервером"
-        if IS_VERCEL:
-            err_msg = f"{err_msg} ({type(exc).__name__})"
-        return jsonify({'ok': False, 'error': err_msg}), 503
+    now = time.monotonic()
+    if _health_cache["payload"] is None or now - _health_cache["ts"] >= HEALTH_CACHE_TTL_SECONDS:
+        try:
+            conn = get_db()
+            with conn.cursor() as cur:
+                execute_cached(cur, _SQL_HEALTHCHECK)
+                cur.fetchone()
+            payload, status = {'ok': True}, 200
+        except Exception as exc:
+            logger.warning("Health-check failed: %s", exc)
+            err_msg = "Проблема соединения с сервером"
+            if IS_VERCEL:
+                err_msg = f"{err_msg} ({type(exc).__name__})"
+            payload, status = {'ok': False, 'error': err_msg}, 503
+        _health_cache.update(ts=now, payload=payload, status=status)
+    response = jsonify(_health_cache["payload"])
+    response.status_code = _health_cache["status"]
+    response.headers["Cache-Control"] = f"max-age={int(HEALTH_CACHE_TTL_SECONDS)}"
+    return response
 
 
-def get_db():
-    """Получить подключение к БД на текущий запрос (из g)."""
-    if getattr(g, "db_conn", None) is None or g.db_conn.closed:
-        stmt_timeout_ms = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "30000"))
-        connect_kw = {
-            "host": DB_CONFIG.host,
-            "port": DB_CONFIG.port,
-            "database": DB_CONFIG.database,
-            "user": DB_CONFIG.user,
-            "password": DB_CONFIG.password,
-            "cursor_factory": RealDictCursor,
-            "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", "15" if IS_VERCEL else "8")),
-            "options": f"-c statement_timeout={stmt_timeout_ms}",
-        }
+def _db_connect_kwargs() -> dict:
+    """Параметры psycopg2.connect (общие для пула и прямого подключения)."""
+    stmt_timeout_ms = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    connect_kw = {
+        "host": DB_CONFIG.host,
+        "port": DB_CONFIG.port,
+        "database": DB_CONFIG.database,
+        "user": DB_CONFIG.user,
+        "password": DB_CONFIG.password,
+        "cursor_factory": RealDictCursor,
+        "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", "15" if IS_VERCEL else "8")),
+        "application_name": os.environ.get("DB_APPLICATION_NAME", "inventarizacia"),
+        # TCP keepalive: «мёртвое» соединение (обрыв сети, заснувший контейнер) обнаруживается
+        # за ~1.5 мин, а не через системные часы по умолчанию — поток Flask не висит на recv().
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
+    }
+    if USE_POOLED_DB:
+        # PgBouncer не пропускает startup-параметр options: statement_timeout и jit задаются
+        # на роли (ALTER ROLE ... SET statement_timeout / SET jit = off) или в конфиге PgBouncer.
+        sslmode = os.environ.get("DB_SSLMODE", "require").strip().lower()
+    else:
+        # JIT на коротких OLTP-запросах стоит дороже, чем экономит.
+        connect_kw["options"] = f"-c statement_timeout={stmt_timeout_ms} -c jit=off"
         sslmode = os.environ.get("DB_SSLMODE", "").strip().lower()
-        if sslmode:
-            connect_kw["sslmode"] = sslmode
-        g.db_conn = psycopg2.connect(**connect_kw)
+    if sslmode:
+        connect_kw["sslmode"] = sslmode
+    return connect_kw
+
+
+def _get_db_pool() -> ThreadedConnectionPool:
+    """Пул соединений процесса (создаётся лениво, чтобы импорт app не падал без БД)."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ThreadedConnectionPool(DB_POOL_MINCONN, DB_POOL_MAXCONN, **_db_connect_kwargs())
+    return _db_pool
+
+
+def _release_db_conn(conn, pooled: bool):
+    """Возвращает соединение в пул (или закрывает, если пул не используется)."""
+    if not pooled:
+        if not conn.closed:
+            conn.close()
+        return
+    discard = bool(conn.closed)
+    if not discard:
+        try:
+            # Незакрытая транзакция (read-only запросы без commit) не должна утечь в следующий запрос.
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            discard = True
+    _get_db_pool().putconn(conn, close=discard)
+
+
+def get_db():
+    """Получить подключение к БД на текущий запрос (из g): из пула, на Vercel — прямое."""
+    conn = getattr(g, "db_conn", None)
+    if conn is None or conn.closed:
+        if conn is not None:
+            _release_db_conn(conn, getattr(g, "db_pooled", False))
+            g.db_conn = None
+        if IS_VERCEL:
+            # На serverless пул между вызовами не живёт — подключаемся напрямую.
+            g.db_conn = psycopg2.connect(**_db_connect_kwargs())
+            g.db_pooled = False
+        else:
+            g.db_conn = _get_db_pool().getconn()
+            g.db_pooled = True
     return g.db_conn
 
 
+# SQL горячих запросов — модульные константы: один и тот же объект str на каждый вызов
+# (ключ кэша prepared statements в execute_cached), и одинаковый текст в логах/pg_stat_statements.
+_SQL_HEALTHCHECK = "SELECT 1"
+
+_SQL_OCCUPIED_ZONES = """
+    SELECT DISTINCT zone_prefix
+    FROM active_tasks
+    WHERE status = 'active'
+        AND expires_at > CURRENT_TIMESTAMP
+"""
+
+_SQL_EXPIRE_TASKS = """
+    UPDATE active_tasks
+    SET status = 'expired'
+    WHERE expires_at < CURRENT_TIMESTAMP
+        AND status = 'active'
+"""
+
+_SQL_ZONE_PREFIXES = """
+    SELECT DISTINCT SUBSTRING(mx_code, 1, 9) AS zone_prefix
+    FROM warehouse_places
+    WHERE mx_code IS NOT NULL AND mx_code != ''
+"""
+
+_SQL_ZONE_PLACES = """
+    SELECT
+        w.mx_id as place_cod,
+        w.mx_code as place_name,
+        0 as qty_shk
+    FROM warehouse_places w
+    WHERE SUBSTRING(w.mx_code, 1, 9) = %s
+      AND w.mx_code IS NOT NULL AND w.mx_code != ''
+    ORDER BY w.mx_code
+    LIMIT %s
+"""
+
+# Резерв первой свободной зоны из списка кандидатов одним statement'ом.
+# Зона — не строка таблицы, поэтому вместо FOR UPDATE SKIP LOCKED берём
+# транзакционный advisory-lock на зону: занятые параллельным запросом зоны
+# пропускаются без ожидания. Порядок кандидатов сохраняется (function scan
+# unnest без сортировки), LIMIT 1 останавливает перебор на первой удаче.
+# Частичный уникальный индекс uq_active_tasks_zone_active остаётся
+# последней линией защиты. Просроченное, но ещё 'active' задание зоны не
+# переписывается: оно помечается expired, а задание вставляется новой строкой,
+# чтобы история старого (task_id, badge, assigned_at) сохранилась.
+_SQL_RESERVE_FREE_ZONE = """
+    WITH cand AS (
+        SELECT c.zone
+        FROM unnest(%s::text[]) AS c(zone)
+        WHERE NOT EXISTS (
+                SELECT 1 FROM active_tasks t
+                WHERE t.zone_prefix = c.zone
+                  AND t.status = 'active'
+                  AND t.expires_at > CURRENT_TIMESTAMP
+              )
+          AND pg_try_advisory_xact_lock(7302, hashtext(c.zone))
+        LIMIT 1
+    ),
+    expired AS (
+        UPDATE active_tasks t
+        SET status = 'expired'
+        FROM cand
+        WHERE t.zone_prefix = cand.zone
+          AND t.status = 'active'
+          AND t.expires_at <= CURRENT_TIMESTAMP
+        RETURNING 1
+    ),
+    ins AS (
+        -- Соединение с COUNT(*) по expired: вставка начинается только после UPDATE.
+        INSERT INTO active_tasks (zone_prefix, badge, expires_at)
+        SELECT cand.zone, %s, CURRENT_TIMESTAMP + (%s::int * INTERVAL '1 hour')
+        FROM cand, (SELECT COUNT(*) FROM expired) e
+        ON CONFLICT (zone_prefix) WHERE status = 'active' DO NOTHING
+        RETURNING zone_prefix
+    )
+    SELECT ins.zone_prefix
+    FROM ins
+"""
+
+# Вся статистика сотрудника одним запросом: общая, за сегодня/смену, 10 сессий, 5 последних сканов.
+# since — начало смены в мс (NULL — без фильтра); общая статистика считается без фильтра по смене.
+_SQL_USER_STATS = """
+    WITH p AS (
+        SELECT %s::varchar AS badge,
+               to_timestamp(%s::bigint / 1000.0) AS since
+    ),
+    overall AS (
+        SELECT COUNT(*) AS total_scanned,
+               COUNT(*) FILTER (WHERE ir.has_discrepancy) AS with_discrepancy,
+               COUNT(*) FILTER (WHERE NOT ir.has_discrepancy) AS no_discrepancy
+        FROM inventory_results ir, p
+        WHERE ir.badge = p.badge
+    ),
+    today AS (
+        SELECT COUNT(*) AS today_scanned,
+               COUNT(*) FILTER (WHERE ir.has_discrepancy) AS today_discrepancy
+        FROM inventory_results ir, p
+        WHERE ir.badge = p.badge
+          AND ir.created_at >= CURRENT_DATE
+          AND ir.created_at >= COALESCE(p.since, '-infinity')
+    ),
+    sessions AS (
+        SELECT us.session_id, us.login_time, us.logout_time, us.total_scanned,
+               us.with_discrepancy, us.no_discrepancy, us.session_duration, us.is_active
+        FROM user_sessions us, p
+        WHERE us.badge = p.badge
+        ORDER BY us.login_time DESC
+        LIMIT 10
+    ),
+    last AS (
+        SELECT ir.place_cod, ir.place_name, ir.status, ir.has_discrepancy,
+               COALESCE(ir.photo_filename, '') <> '' AS has_photo,
+               ir.created_at, ir.created_at AS updated_at
+        FROM inventory_results ir, p
+        WHERE ir.badge = p.badge
+          AND ir.created_at >= COALESCE(p.since, '-infinity')
+        ORDER BY ir.created_at DESC
+        LIMIT 5
+    )
+    SELECT (SELECT row_to_json(o) FROM overall o) AS overall,
+           (SELECT row_to_json(t) FROM today t) AS today,
+           (SELECT COALESCE(json_agg(s ORDER BY s.login_time DESC), '[]') FROM sessions s) AS sessions,
+           (SELECT COALESCE(json_agg(l ORDER BY l.created_at DESC), '[]') FROM last l) AS last_places
+"""
+
+_SQL_USER_DAILY = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'daily', COALESCE(json_agg(json_build_object(
+            'date', d.date,
+            'total', d.total,
+            'errors', d.errors,
+            'ok', d.ok
+        ) ORDER BY d.date), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT d AS date, total, errors, ok
+        FROM mv_daily_stats
+        WHERE badge = %s AND d >= CURRENT_DATE - 7 AND d < CURRENT_DATE
+        UNION ALL
+        SELECT
+            CURRENT_DATE,
+            COUNT(*),
+            COUNT(*) FILTER (WHERE has_discrepancy),
+            COUNT(*) FILTER (WHERE NOT has_discrepancy)
+        FROM inventory_results
+        WHERE badge = %s AND created_at >= CURRENT_DATE
+        HAVING COUNT(*) > 0
+    ) d
+"""
+
+# Тот же ответ без mv_daily_stats — на Vercel и пока представление ещё ни разу не наполнено.
+_SQL_USER_DAILY_LIVE = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'daily', COALESCE(json_agg(json_build_object(
+            'date', d.date,
+            'total', d.total,
+            'errors', d.errors,
+            'ok', d.ok
+        ) ORDER BY d.date), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT
+            DATE(created_at) as date,
+            COUNT(*) as total,
+            COUNT(*) FILTER (WHERE has_discrepancy) as errors,
+            COUNT(*) FILTER (WHERE NOT has_discrepancy) as ok
+        FROM inventory_results
+        WHERE badge = %s AND created_at >= CURRENT_DATE - INTERVAL '7 days'
+        GROUP BY DATE(created_at)
+    ) d
+"""
+
+
+# Общий фильтр «сканы сотрудника за период» для истории и её Excel-выгрузки. Плейсхолдеры есть
+# всегда (NULL — граница не задана): текст запроса не зависит от фильтров, и execute_cached
+# переиспользует один prepared statement. Параметры: (badge, date_from, date_to).
+_SQL_USER_SCANS_PERIOD_WHERE = """
+    WHERE ir.badge = %s
+      AND ir.created_at >= COALESCE(%s::timestamp, '-infinity')
+      AND ir.created_at < COALESCE(%s::date + INTERVAL '1 day', 'infinity')
+"""
+
+# Параметры: (badge, badge, date_from, date_to).
+_SQL_USER_HISTORY = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'badge', %s::text,
+        'history', COALESCE(json_agg(json_build_object(
+            'id', h.result_id,
+            'place_cod', h.place_cod,
+            'place_name', h.place_name,
+            'qty_db', h.qty_shk_db,
+            'qty_fact', h.qty_shk_fact,
+            'status', h.status,
+            'has_discrepancy', h.has_discrepancy,
+            'has_photo', COALESCE(h.photo_filename, '') <> '',
+            'created_at', h.created_at
+        ) ORDER BY h.created_at DESC), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT
+            ir.result_id,
+            ir.place_cod,
+            ir.place_name,
+            ir.qty_shk_db,
+            ir.qty_shk_fact,
+            ir.status,
+            ir.has_discrepancy,
+            ir.photo_filename,
+            ir.created_at
+        FROM inventory_results ir
+""" + _SQL_USER_SCANS_PERIOD_WHERE + """
+        ORDER BY ir.created_at DESC
+        LIMIT 500
+    ) h
+"""
+
+# Параметры: (badge, date_from, date_to). На Vercel лимит времени — ограничиваем выборку.
+_SQL_USER_HISTORY_NOT_OK = """
+    SELECT
+        ir.result_id,
+        COALESCE(to_char(ir.created_at, 'YYYY-MM-DD HH24:MI'), '') AS created_at,
+        ir.place_cod,
+        ir.place_name,
+        ir.qty_shk_db,
+        ir.qty_shk_fact,
+        ir.status,
+        ir.has_discrepancy,
+        ir.photo_filename,
+        ir.discrepancy_reason,
+        ir.comment,
+        ir.duplicate_floor_num,
+        ir.duplicate_row_num,
+        ir.duplicate_shelf_num,
+        wp.storage_type,
+        wp.box_type,
+        wp.category,
+        wp.dimensions,
+        COALESCE(wp.floor, wp2.floor, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.]([0-9]{1,9})(?![0-9])')::int) AS floor,
+        COALESCE(wp.row_num, wp2.row_num, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.][0-9]+[.]([0-9]{1,9})(?![0-9])')::int) AS row_num,
+        COALESCE(wp.section, wp2.section, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.][0-9]+[.][0-9]+[.]([0-9]{1,9})(?![0-9])')::int) AS section
+    FROM inventory_results ir
+    LEFT JOIN warehouse_places wp ON wp.mx_id = ir.place_cod
+    LEFT JOIN warehouse_places wp2 ON UPPER(TRIM(wp2.mx_code)) = UPPER(TRIM(ir.place_name))
+        AND ir.place_name IS NOT NULL AND ir.place_name != ''
+""" + _SQL_USER_SCANS_PERIOD_WHERE + """
+      AND (LOWER(COALESCE(ir.status, '')) <> 'ok' OR ir.has_discrepancy = TRUE)
+    ORDER BY ir.created_at DESC
+""" + (" LIMIT 3000" if IS_VERCEL else "")
+
+
 @app.teardown_appcontext
 def close_db_on_request_end(exception=None):
-    """Закрываем соединение с БД после каждого запроса."""
-    if getattr(g, "db_conn", None) is not None:
+    """Возвращаем соединение в пул (или закрываем на Vercel) после каждого запроса."""
+    conn = getattr(g, "db_conn", None)
+    if conn is not None:
         try:
-            if not g.db_conn.closed:
-                g.db_conn.close()
+            _release_db_conn(conn, getattr(g, "db_pooled", False))
         except Exception as e:
-            logger.warning("Ошибка при закрытии соединения: %s", e)
+            logger.warning("Ошибка при освобождении соединения: %s", e)
         g.db_conn = None
 
 
-def ensure_tasks_table():
-    """Создаёт таблицы active_tasks, inventory_results и связанные структуры."""
-    conn = None
-    try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            # Инициализация схемы не должна блокировать рабочие API-запросы надолго.
-            init_stmt_timeout_ms = int(os.environ.get("DB_INIT_STATEMENT_TIMEOUT_MS", "5000"))
-            init_lock_timeout_ms = int(os.environ.get("DB_INIT_LOCK_TIMEOUT_MS", "1500"))
-            cur.execute(f"SET LOCAL statement_timeout = {max(1000, init_stmt_timeout_ms)}")
-            cur.execute(f"SET LOCAL lock_timeout = {max(500, init_lock_timeout_ms)}")
-            # Таблица активных заданий
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS active_tasks (
-                    task_id SERIAL PRIMARY KEY,
-                    zone_prefix VARCHAR(50) NOT NULL,
-                    badge VARCHAR(100) NOT NULL,
-                    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL,
-                    status VARCHAR(20) DEFAULT 'active'
-                )
-            """)
-            
-            # Таблица результатов инвентаризации
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS inventory_results (
-                    result_id SERIAL PRIMARY KEY,
-                    badge VARCHAR(100) NOT NULL,
-                    place_cod BIGINT NOT NULL,
-                    place_name VARCHAR(255),
-                    plt_id VARCHAR(50),
-                    qty_shk_db INTEGER,
-                    qty_shk_fact INTEGER,
-                    status VARCHAR(50),
-                    has_discrepancy BOOLEAN DEFAULT FALSE,
-                    discrepancy_reason TEXT,
-                    comment TEXT,
-                    duplicate_floor_num INTEGER,
-                    duplicate_row_num INTEGER,
-                    duplicate_shelf_num INTEGER,
-                    photo_data BYTEA,
-                    photo_filename VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+# Версия схемы: увеличивать при каждом изменении _SCHEMA_DDL, иначе уже
+# инициализированные БД (schema_version >= SCHEMA_VERSION) миграцию пропустят.
+SCHEMA_VERSION = 8
+
+# Вся DDL-инициализация одним скриптом — один round-trip вместо ~40 отдельных execute.
+# Скрипт идёт одной транзакцией под таймаутами init и при неудаче повторяется в рабочем
+# запросе (DB_INIT_RETRY_SECONDS): одна долгая команда откатывает всю схему. Поэтому сюда —
+# только дешёвая DDL (таблицы, колонки, индексы по небольшим таблицам, mv WITH NO DATA).
+# Новые индексы по inventory_results/warehouse_places строятся CONCURRENTLY в db_cleanup.sql
+# и optimize_warehouse_places.sql; старые остаются здесь с IF NOT EXISTS и на рабочей БД
+# ничего не строят.
+_SCHEMA_DDL = f"""
+    -- Таблица активных заданий
+    CREATE TABLE IF NOT EXISTS active_tasks (
+        task_id SERIAL PRIMARY KEY,
+        zone_prefix VARCHAR(50) NOT NULL,
+        badge VARCHAR(100) NOT NULL,
+        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL,
+        status VARCHAR(20) DEFAULT 'active'
+    );
+
+    -- Таблица результатов инвентаризации
+    CREATE TABLE IF NOT EXISTS inventory_results (
+        result_id SERIAL PRIMARY KEY,
+        badge VARCHAR(100) NOT NULL,
+        place_cod BIGINT NOT NULL,
+        place_name VARCHAR(255),
+        plt_id VARCHAR(50),
+        qty_shk_db INTEGER,
+        qty_shk_fact INTEGER,
+        status VARCHAR(50),
+        has_discrepancy BOOLEAN DEFAULT FALSE,
+        discrepancy_reason TEXT,
+        comment TEXT,
+        duplicate_floor_num INTEGER,
+        duplicate_row_num INTEGER,
+        duplicate_shelf_num INTEGER,
+        photo_data BYTEA,
+        photo_filename VARCHAR(255),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Миграция: колонки, которые используются в core/scans.py и в аналитике.
+    ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS discrepancy_reason TEXT;
+    ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS comment TEXT;
+    ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_floor_num INTEGER;
+    ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_row_num INTEGER;
+    ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_shelf_num INTEGER;
+
+    -- Таблица дополнительных фото к результатам инвентаризации
+    CREATE TABLE IF NOT EXISTS inventory_result_photos (
+        photo_id INTEGER PRIMARY KEY,
+        result_id INTEGER NOT NULL REFERENCES inventory_results(result_id) ON DELETE CASCADE,
+        badge VARCHAR(100) NOT NULL,
+        place_cod BIGINT,
+        photo_data BYTEA NOT NULL,
+        photo_filename VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    -- Гарантируем наличие sequence и auto-increment для photo_id
+    CREATE SEQUENCE IF NOT EXISTS inventory_result_photos_photo_id_seq;
+    ALTER TABLE inventory_result_photos
+        ALTER COLUMN photo_id SET DEFAULT nextval('inventory_result_photos_photo_id_seq');
+    ALTER SEQUENCE inventory_result_photos_photo_id_seq
+        OWNED BY inventory_result_photos.photo_id;
+
+    -- Таблица сессий пользователей
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        session_id SERIAL PRIMARY KEY,
+        badge VARCHAR(100) NOT NULL,
+        login_time TIMESTAMP NOT NULL,
+        logout_time TIMESTAMP,
+        total_scanned INTEGER DEFAULT 0,
+        with_discrepancy INTEGER DEFAULT 0,
+        no_discrepancy INTEGER DEFAULT 0,
+        session_duration INTEGER,
+        is_active BOOLEAN DEFAULT TRUE
+    );
+
+    -- Таблица отчетов (для админ-панели)
+    CREATE TABLE IF NOT EXISTS reports (
+        report_id SERIAL PRIMARY KEY,
+        badge VARCHAR(100) NOT NULL,
+        file_data BYTEA NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        total_scanned INTEGER DEFAULT 0,
+        with_discrepancy INTEGER DEFAULT 0,
+        no_discrepancy INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        downloaded_at TIMESTAMP,
+        downloaded_by VARCHAR(100)
+    );
+
+    -- Таблица ревизий качества
+    CREATE TABLE IF NOT EXISTS quality_reviews (
+        review_id SERIAL PRIMARY KEY,
+        zone_prefix VARCHAR(50) NOT NULL,
+        reviewer VARCHAR(100),
+        status VARCHAR(30) DEFAULT 'planned',
+        summary TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Таблица тикетов/инцидентов
+    CREATE TABLE IF NOT EXISTS tickets (
+        ticket_id SERIAL PRIMARY KEY,
+        badge VARCHAR(100) NOT NULL,
+        place_cod BIGINT,
+        description TEXT NOT NULL,
+        priority VARCHAR(20) DEFAULT 'medium',
+        status VARCHAR(20) DEFAULT 'open',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        resolved_at TIMESTAMP,
+        resolver VARCHAR(100)
+    );
+    -- Починенные/в работе места по блоку (wh_id). status: 'repaired' (исключены из выгрузки), 'in_work'
+    CREATE TABLE IF NOT EXISTS repaired_places (
+        wh_id INTEGER NOT NULL,
+        place_cod BIGINT NOT NULL,
+        status VARCHAR(20) DEFAULT 'repaired',
+        marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (wh_id, place_cod)
+    );
+    -- Миграция: добавить status в существующие таблицы (для старых БД)
+    ALTER TABLE repaired_places ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'repaired';
+    -- Миграция: file_data в reports может быть NULL (файлы старше 30 дней обнуляются)
+    ALTER TABLE reports ALTER COLUMN file_data DROP NOT NULL;
+    -- Без сжатия в TOAST: substring() при потоковом скачивании читает только нужные чанки.
+    ALTER TABLE reports ALTER COLUMN file_data SET STORAGE EXTERNAL;
+
+    -- Индексы
+    CREATE INDEX IF NOT EXISTS idx_active_tasks_zone
+        ON active_tasks(zone_prefix, status);
+    CREATE INDEX IF NOT EXISTS idx_active_tasks_expires
+        ON active_tasks(expires_at);
+    -- Не больше одного активного задания на зону (reserve_free_zone полагается на ON CONFLICT).
+    -- Перед созданием закрываем просроченные и дубликаты, оставляя самое свежее задание.
+    UPDATE active_tasks SET status = 'expired'
+    WHERE status = 'active' AND expires_at <= CURRENT_TIMESTAMP;
+    UPDATE active_tasks t SET status = 'expired'
+    FROM active_tasks n
+    WHERE t.status = 'active' AND n.status = 'active'
+      AND n.zone_prefix = t.zone_prefix AND n.task_id > t.task_id;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_active_tasks_zone_active
+        ON active_tasks(zone_prefix) WHERE status = 'active';
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_date
+        ON inventory_results(created_at);
+    -- Индексы по сотруднику (покрывающий idx_ir_badge_created и idx_ir_badge_not_ok_created)
+    -- строятся CREATE INDEX CONCURRENTLY в db_cleanup.sql: полная сборка по inventory_results
+    -- не укладывается в statement_timeout миграции и держала бы блокировку таблицы.
+    -- Нужен для duplicate-check: WHERE badge=? AND place_cod=? AND created_at>=...
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_badge_place_created
+        ON inventory_results(badge, place_cod, created_at DESC);
+    -- Нужен для админ-выборок фото/последних сканов по месту.
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_place_photo_filename
+        ON inventory_results(place_cod, photo_filename);
+    -- Частичные индексы для "горячих" фильтров админки/экспортов.
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_not_ok_created
+        ON inventory_results(created_at DESC)
+        WHERE has_discrepancy = TRUE OR LOWER(COALESCE(status, '')) <> 'ok';
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_with_photo_created
+        ON inventory_results(created_at DESC)
+        WHERE photo_filename IS NOT NULL AND TRIM(photo_filename) <> '';
+    -- Ускоряет экспорт по блоку: фильтрация "не ok" + join/anti-join по place_cod.
+    CREATE INDEX IF NOT EXISTS idx_inventory_results_not_ok_place_created
+        ON inventory_results(place_cod, created_at DESC)
+        WHERE has_discrepancy = TRUE OR LOWER(COALESCE(status, '')) <> 'ok';
+    CREATE INDEX IF NOT EXISTS idx_inventory_result_photos_result
+        ON inventory_result_photos(result_id);
+    CREATE INDEX IF NOT EXISTS idx_inventory_result_photos_place
+        ON inventory_result_photos(place_cod);
+    -- Покрывающий индекс: суммарное время сессий сотрудника (админ-статистика)
+    -- считается index-only scan; поиск сессий по badge он обслуживает так же.
+    CREATE INDEX IF NOT EXISTS idx_user_sessions_badge_duration
+        ON user_sessions(badge) INCLUDE (session_duration);
+    DROP INDEX IF EXISTS idx_user_sessions_badge;
+    CREATE INDEX IF NOT EXISTS idx_user_sessions_active
+        ON user_sessions(is_active);
+    CREATE INDEX IF NOT EXISTS idx_reports_badge
+        ON reports(badge);
+    CREATE INDEX IF NOT EXISTS idx_reports_created
+        ON reports(created_at DESC);
+    -- Список тикетов в админке: ORDER BY status DESC, created_at DESC LIMIT 100 без сортировки.
+    CREATE INDEX IF NOT EXISTS idx_tickets_status_created
+        ON tickets(status DESC, created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_repaired_places_wh
+        ON repaired_places(wh_id);
+    -- Индексы под экспорт по wh_id и join с mx_code/mx_id.
+    CREATE INDEX IF NOT EXISTS idx_warehouse_places_wh_id_mx_id
+        ON warehouse_places(wh_id, mx_id);
+    CREATE INDEX IF NOT EXISTS idx_warehouse_places_wh_id_mx_code_norm
+        ON warehouse_places(wh_id, UPPER(TRIM(mx_code)));
+    -- Индекс под синхронизацию справочника по 2 условиям:
+    -- warehouse_name + floor, с пагинацией/сортировкой по mx_id.
+    CREATE INDEX IF NOT EXISTS idx_warehouse_places_sync_wh_floor_mx
+        ON warehouse_places(
+            UPPER(TRIM(warehouse_name)),
+            UPPER(TRIM(CAST(floor AS TEXT))),
+            mx_id
+        );
+
+    -- Дневные агрегаты сканов по сотрудникам для /api/user/daily-stats: прошлые дни берутся
+    -- отсюда (7 строк по индексу), текущий день считается вживую. Создаётся пустой —
+    -- первое наполнение делает _refresh_matview(), а не init схемы с его таймаутом.
+    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_daily_stats AS
+        SELECT badge,
+               DATE(created_at) AS d,
+               COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE has_discrepancy) AS errors,
+               COUNT(*) FILTER (WHERE NOT has_discrepancy) AS ok
+        FROM inventory_results
+        GROUP BY 1, 2
+    WITH NO DATA;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_mv_daily_stats_badge_d
+        ON mv_daily_stats(badge, d);
+
+    -- Агрегаты по зонам (первые 9 символов кода МХ) для ревизий качества в админке:
+    -- вместо GROUP BY по всей inventory_results на каждый запрос. Наполняется так же фоном.
+    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_zone_stats AS
+        SELECT SUBSTRING(place_name, 1, 9) AS zone_prefix,
+               COUNT(*) AS scan_count,
+               COUNT(*) FILTER (WHERE has_discrepancy) AS errors,
+               MAX(created_at) AS last_scan
+        FROM inventory_results
+        WHERE place_name IS NOT NULL
+        GROUP BY 1
+    WITH NO DATA;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_mv_zone_stats_zone
+        ON mv_zone_stats(zone_prefix);
+
+    -- Время последнего REFRESH каждого mv: интервал обновления общий для всех процессов,
+    -- а не отсчитывается в памяти каждого воркера.
+    CREATE TABLE IF NOT EXISTS matview_refresh (
+        name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ NOT NULL
+    );
+
+    -- Отметка о применённой версии схемы: следующие процессы/cold-start'ы
+    -- делают один SELECT вместо всей DDL.
+    CREATE TABLE IF NOT EXISTS schema_version (
+        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO schema_version (id, version) VALUES (1, {SCHEMA_VERSION})
+    ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, updated_at = CURRENT_TIMESTAMP;
+"""
 
-            # Миграция: колонки, которые используются в core/scans.py и в аналитике.
-            cur.execute("ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS discrepancy_reason TEXT")
-            cur.execute("ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS comment TEXT")
-            cur.execute("ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_floor_num INTEGER")
-            cur.execute("ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_row_num INTEGER")
-            cur.execute("ALTER TABLE inventory_results ADD COLUMN IF NOT EXISTS duplicate_shelf_num INTEGER")
 
-            # Таблица дополнительных фото к результатам инвентаризации
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS inventory_result_photos (
-                    photo_id INTEGER PRIMARY KEY,
-                    result_id INTEGER NOT NULL REFERENCES inventory_results(result_id) ON DELETE CASCADE,
-                    badge VARCHAR(100) NOT NULL,
-                    place_cod BIGINT,
-                    photo_data BYTEA NOT NULL,
-                    photo_filename VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            # Гарантируем наличие sequence и auto-increment для photo_id
-            cur.execute(
-                "CREATE SEQUENCE IF NOT EXISTS inventory_result_photos_photo_id_seq"
-            )
-            cur.execute(
-                """
-                ALTER TABLE inventory_result_photos
-                ALTER COLUMN photo_id SET DEFAULT nextval('inventory_result_photos_photo_id_seq')
-                """
-            )
-            cur.execute(
-                """
-                ALTER SEQUENCE inventory_result_photos_photo_id_seq
-                OWNED BY inventory_result_photos.photo_id
-                """
-            )
-            
-            # Таблица сессий пользователей
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    session_id SERIAL PRIMARY KEY,
-                    badge VARCHAR(100) NOT NULL,
-                    login_time TIMESTAMP NOT NULL,
-                    logout_time TIMESTAMP,
-                    total_scanned INTEGER DEFAULT 0,
-                    with_discrepancy INTEGER DEFAULT 0,
-                    no_discrepancy INTEGER DEFAULT 0,
-                    session_duration INTEGER,
-                    is_active BOOLEAN DEFAULT TRUE
-                )
-            """)
-            
-            # Таблица отчетов (для админ-панели)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS reports (
-                    report_id SERIAL PRIMARY KEY,
-                    badge VARCHAR(100) NOT NULL,
-                    file_data BYTEA NOT NULL,
-                    filename VARCHAR(255) NOT NULL,
-                    total_scanned INTEGER DEFAULT 0,
-                    with_discrepancy INTEGER DEFAULT 0,
-                    no_discrepancy INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    downloaded_at TIMESTAMP,
-                    downloaded_by VARCHAR(100)
-                )
-            """)
+def _schema_is_current(conn, cur) -> bool:
+    """Проверка schema_version одним SELECT (таблицы может ещё не быть)."""
+    try:
+        cur.execute("SELECT version FROM schema_version WHERE id = 1")
+        row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return False
+    return bool(row) and row["version"] >= SCHEMA_VERSION
 
-            # Таблица ревизий качества
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS quality_reviews (
-                    review_id SERIAL PRIMARY KEY,
-                    zone_prefix VARCHAR(50) NOT NULL,
-                    reviewer VARCHAR(100),
-                    status VARCHAR(30) DEFAULT 'planned',
-                    summary TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
 
-            # Таблица тикетов/инцидентов
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS tickets (
-                    ticket_id SERIAL PRIMARY KEY,
-                    badge VARCHAR(100) NOT NULL,
-                    place_cod BIGINT,
-                    description TEXT NOT NULL,
-                    priority VARCHAR(20) DEFAULT 'medium',
-                    status VARCHAR(20) DEFAULT 'open',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    resolved_at TIMESTAMP,
-                    resolver VARCHAR(100)
-                )
-            """)
-            # Починенные/в работе места по блоку (wh_id). status: 'repaired' (исключены из выгрузки), 'in_work'
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS repaired_places (
-                    wh_id INTEGER NOT NULL,
-                    place_cod BIGINT NOT NULL,
-                    status VARCHAR(20) DEFAULT 'repaired',
-                    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (wh_id, place_cod)
-                )
-            """)
-            # Миграция: добавить status в существующие таблицы (для старых БД)
-            cur.execute("ALTER TABLE repaired_places ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'repaired'")
-            # Миграция: file_data в reports может быть NULL (файлы старше 30 дней обнуляются)
-            cur.execute("ALTER TABLE reports ALTER COLUMN file_data DROP NOT NULL")
-            
-            # Индексы
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_active_tasks_zone 
-                ON active_tasks(zone_prefix, status)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_active_tasks_expires 
-                ON active_tasks(expires_at)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_badge 
-                ON inventory_results(badge)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_date 
-                ON inventory_results(created_at)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_discrepancy 
-                ON inventory_results(has_discrepancy)
-            """)
-            # Составной индекс: покрывает все запросы WHERE badge=? AND created_at>=?
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_badge_date
-                ON inventory_results(badge, created_at DESC)
-            """)
-            # Нужен для duplicate-check: WHERE badge=? AND place_cod=? AND created_at>=...
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_badge_place_created
-                ON inventory_results(badge, place_cod, created_at DESC)
-            """)
-            # Нужен для админ-выборок фото/последних сканов по месту.
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_place_photo_filename
-                ON inventory_results(place_cod, photo_filename)
-            """)
-            # Частичные индексы для "горячих" фильтров админки/экспортов.
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_not_ok_created
-                ON inventory_results(created_at DESC)
-                WHERE has_discrepancy = TRUE OR LOWER(COALESCE(status, '')) <> 'ok'
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_with_photo_created
-                ON inventory_results(created_at DESC)
-                WHERE photo_filename IS NOT NULL AND TRIM(photo_filename) <> ''
-            """)
-            # Ускоряет экспорт по блоку: фильтрация "не ok" + join/anti-join по place_cod.
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_results_not_ok_place_created
-                ON inventory_results(place_cod, created_at DESC)
-                WHERE has_discrepancy = TRUE OR LOWER(COALESCE(status, '')) <> 'ok'
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_result_photos_result 
-                ON inventory_result_photos(result_id)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_inventory_result_photos_place 
-                ON inventory_result_photos(place_cod)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_badge 
-                ON user_sessions(badge)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_active 
-                ON user_sessions(is_active)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_reports_badge 
-                ON reports(badge)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_reports_created 
-                ON reports(created_at DESC)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_repaired_places_wh 
-                ON repaired_places(wh_id)
-            """)
-            # Индексы под экспорт по wh_id и join с mx_code/mx_id.
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_warehouse_places_wh_id_mx_id
-                ON warehouse_places(wh_id, mx_id)
-            """)
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_warehouse_places_wh_id_mx_code_norm
-                ON warehouse_places(wh_id, UPPER(TRIM(mx_code)))
-            """)
-            # Индекс под синхронизацию справочника по 2 условиям:
-            # warehouse_name + floor, с пагинацией/сортировкой по mx_id.
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_warehouse_places_sync_wh_floor_mx
-                ON warehouse_places(
-                    UPPER(TRIM(warehouse_name)),
-                    UPPER(TRIM(CAST(floor AS TEXT))),
-                    mx_id
+def ensure_tasks_table() -> bool:
+    """Создаёт таблицы active_tasks, inventory_results и связанные структуры. Возвращает True при успехе."""
+    conn = None
+    try:
+        conn = get_db()
+        with conn.cursor() as cur:
+            if not _schema_is_current(conn, cur):
+                # Инициализация схемы не должна блокировать рабочие API-запросы надолго.
+                init_stmt_timeout_ms = int(os.environ.get("DB_INIT_STATEMENT_TIMEOUT_MS", "5000"))
+                init_lock_timeout_ms = int(os.environ.get("DB_INIT_LOCK_TIMEOUT_MS", "1500"))
+                cur.execute(
+                    f"SET LOCAL statement_timeout = {max(1000, init_stmt_timeout_ms)};"
+                    f"SET LOCAL lock_timeout = {max(500, init_lock_timeout_ms)};"
+                    + _SCHEMA_DDL
                 )
-            """)
+                logger.info("Схема БД обновлена до версии %d", SCHEMA_VERSION)
 
             # Автоочистка старых отчётов: файлы > 30 дней удаляем из reports.file_data,
             # но строку метаданных оставляем (чтобы история в админке не пропадала)
@@ -574,9 +1043,11 @@ def ensure_tasks_table():
 
             conn.commit()
             logger.info("✅ Таблицы БД инициализированы")
+            return True
     except Exception as e:
         safe_rollback(conn)
         logger.error("Ошибка создания таблиц: %s", e)
+        return False
 
 
 def save_report(badge, file_data, filename, total_scanned, with_discrepancy, no_discrepancy):
@@ -585,7 +1056,7 @@ def save_report(badge, file_data, filename, total_scanned, with_discrepancy, no_
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
+            execute_cached(cur, """
                 INSERT INTO reports 
                 (badge, file_data, filename, total_scanned, with_discrepancy, no_discrepancy)
                 VALUES (%s, %s, %s, %s, %s, %s)
@@ -594,6 +1065,8 @@ def save_report(badge, file_data, filename, total_scanned, with_discrepancy, no_
             
             report_id = cur.fetchone()['report_id']
             conn.commit()
+        # Новый отчёт должен сразу попасть в ленту событий админки.
+        _admin_cache_invalidate("admin:activity", "admin:reports")
             
         logger.info(f"Отчет сохранен: {filename} (ID: {report_id})")
         return report_id
@@ -610,77 +1083,71 @@ def cleanup_expired_tasks():
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE active_tasks 
-                SET status = 'expired' 
-                WHERE expires_at < CURRENT_TIMESTAMP 
-                    AND status = 'active'
-            """)
+            execute_cached(cur, _SQL_EXPIRE_TASKS)
             expired_count = cur.rowcount
             conn.commit()
             
             if expired_count > 0:
+                _invalidate_occupied_zones()
                 logger.info("Очищено просроченных заданий: %d", expired_count)
     except Exception as e:
         safe_rollback(conn)
         logger.error("Ошибка очистки просроченных заданий: %s", e)
 
 
-def reserve_zone(zone_prefix: str, badge: str, hours: int = 2) -> bool:
+def reserve_free_zone(candidates: list, badge: str, hours: int = 2):
     """
-    Резервирует зону для сотрудника.
+    Резервирует для сотрудника первую свободную зону из candidates.
     
     Returns:
-        True если зона зарезервирована, False если занята
+        префикс зарезервированной зоны или None, если все кандидаты заняты
     """
     conn = None
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            # Блокируем конкретную зону транзакционной advisory-lock, чтобы исключить гонку.
-            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (zone_prefix,))
-            cur.execute("""
-                INSERT INTO active_tasks (zone_prefix, badge, expires_at)
-                SELECT %s, %s, CURRENT_TIMESTAMP + (%s * INTERVAL '1 hour')
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM active_tasks
-                    WHERE zone_prefix = %s
-                      AND status = 'active'
-                      AND expires_at > CURRENT_TIMESTAMP
-                )
-                RETURNING task_id
-            """, (zone_prefix, badge, hours, zone_prefix))
-            inserted = cur.fetchone()
-            if not inserted:
-                logger.warning("Зона %s уже занята", zone_prefix)
-                conn.commit()
-                return False
+        # READ COMMITTED берёт снимок на каждый statement: если параллельный запрос
+        # успел закоммитить резерв кандидата после нашего снимка, INSERT упирается
+        # в ON CONFLICT и ничего не возвращает. Повтор видит свежий снимок и
+        # переходит к следующей свободной зоне — SERIALIZABLE для этого не нужен.
+        row = None
+        for _ in range(RESERVE_ZONE_ATTEMPTS):
+            with conn.cursor() as cur:
+                execute_cached(cur, _SQL_RESERVE_FREE_ZONE, (list(candidates), badge, hours))
+                row = cur.fetchone()
             conn.commit()
-            
-            logger.info("Зона %s зарезервирована для %s на %d часов", zone_prefix, badge, hours)
-            return True
+            if row:
+                break
+        if not row:
+            logger.warning("Свободных зон среди %d кандидатов нет", len(candidates))
+            return None
+        _invalidate_occupied_zones()
+        zone_prefix = row['zone_prefix']
+        logger.info("Зона %s зарезервирована для %s на %d часов", zone_prefix, badge, hours)
+        return zone_prefix
             
     except Exception as e:
         safe_rollback(conn)
         logger.error("Ошибка резервирования зоны: %s", e)
-        return False
+        return None
+
+
+def _invalidate_occupied_zones():
+    _occupied_zones_cache["zones"] = None
 
 
 def get_occupied_zones() -> set:
-    """Получает список занятых зон."""
+    """Получает список занятых зон (с кэшем на OCCUPIED_ZONES_TTL_SECONDS)."""
+    cached = _occupied_zones_cache["zones"]
+    if cached is not None and time.monotonic() - _occupied_zones_cache["ts"] < OCCUPIED_ZONES_TTL_SECONDS:
+        return set(cached)
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT DISTINCT zone_prefix 
-                FROM active_tasks 
-                WHERE status = 'active'
-                    AND expires_at > CURRENT_TIMESTAMP
-            """)
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_cached(cur, _SQL_OCCUPIED_ZONES)
             
-            zones = {row['zone_prefix'] for row in cur.fetchall()}
+            zones = {row.zone_prefix for row in cur.fetchall()}
             logger.info("Занятых зон: %d", len(zones))
+            _occupied_zones_cache.update(ts=time.monotonic(), zones=frozenset(zones))
             return zones
             
     except Exception as e:
@@ -688,6 +1155,20 @@ def get_occupied_zones() -> set:
         return set()
 
 
+def get_zone_index() -> tuple:
+    """Список зон справочника (с кэшем на ZONE_INDEX_TTL_SECONDS)."""
+    cached = _zone_index_cache["zones"]
+    if cached is not None and time.monotonic() - _zone_index_cache["ts"] < ZONE_INDEX_TTL_SECONDS:
+        return cached
+    conn = get_db()
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+        execute_cached(cur, _SQL_ZONE_PREFIXES)
+        zones = tuple(row.zone_prefix for row in cur.fetchall())
+    logger.info("Зон в справочнике: %d", len(zones))
+    _zone_index_cache.update(ts=time.monotonic(), zones=zones)
+    return zones
+
+
 @app.route('/')
 def index():
     """Главная страница - форма авторизации."""
@@ -763,7 +1244,7 @@ def auth():
             }), 200
         
         # Проверка пароля
-        if not hmac.compare_digest(password, ADMIN_PASSWORD):
+        if not _admin_password_ok(password):
             return jsonify({'error': 'Неверный пароль администратора'}), 401
         
         # Успешный вход администратора
@@ -776,7 +1257,7 @@ def auth():
             'is_admin': True,
             'badge': ADMIN_BADGE,
             'redirect': '/admin/dashboard',
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now()
         })
         _set_auth_cookie(response, 'admin_badge', ADMIN_BADGE, max_age=28800, httponly=True)
         _clear_cookie(response, 'employee_badge', httponly=True)
@@ -799,7 +1280,7 @@ def auth():
         'is_admin': False,
         'badge': badge,
         'redirect': '/work',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now()
     })
     _set_auth_cookie(response, 'employee_badge', badge, max_age=28800, httponly=True)
     _clear_cookie(response, 'admin_badge', httponly=True)
@@ -816,95 +1297,22 @@ def get_user_stats(badge):
         return auth_err
     try:
         since_ts = request.args.get('since', type=lambda x: int(x) if x and str(x).isdigit() else None)
-        since_sql = ""
-        since_arg = ()
-        if since_ts and since_ts > 0:
-            since_sql = " AND created_at >= to_timestamp(%s::double precision / 1000)"
-            since_arg = (since_ts,)
+        if not since_ts or since_ts <= 0:
+            since_ts = None
 
         conn = get_db()
         with conn.cursor() as cur:
-            # Общая статистика за все время (без фильтра по смене)
-            cur.execute("""
-                SELECT 
-                    COUNT(*) as total_scanned,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as with_discrepancy,
-                    SUM(CASE WHEN NOT has_discrepancy THEN 1 ELSE 0 END) as no_discrepancy
-                FROM inventory_results
-                WHERE badge = %s
-            """, (badge,))
-            overall = dict(cur.fetchone() or {})
-
-            # Статистика по сессиям
-            cur.execute("""
-                SELECT 
-                    session_id,
-                    login_time,
-                    logout_time,
-                    total_scanned,
-                    with_discrepancy,
-                    no_discrepancy,
-                    session_duration,
-                    is_active
-                FROM user_sessions
-                WHERE badge = %s
-                ORDER BY login_time DESC
-                LIMIT 10
-            """, (badge,))
-            sessions = []
-            for row in cur.fetchall():
-                sessions.append({
-                    'session_id': row['session_id'],
-                    'login_time': row['login_time'].isoformat() if row['login_time'] else None,
-                    'logout_time': row['logout_time'].isoformat() if row['logout_time'] else None,
-                    'total_scanned': row['total_scanned'],
-                    'with_discrepancy': row['with_discrepancy'],
-                    'no_discrepancy': row['no_discrepancy'],
-                    'session_duration': row['session_duration'],
-                    'is_active': row['is_active']
-                })
-
-            # Статистика за сегодня (или за смену, если передан since)
-            cur.execute("""
-                SELECT 
-                    COUNT(*) as today_scanned,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as today_discrepancy
-                FROM inventory_results
-                WHERE badge = %s 
-                AND created_at >= CURRENT_DATE
-                """ + since_sql,
-                (badge,) + since_arg
-            )
-            today = dict(cur.fetchone() or {})
-
-            # Последние 5 сканов (за смену, если передан since)
-            cur.execute("""
-                SELECT place_cod, place_name, status, has_discrepancy, photo_filename, created_at
-                FROM inventory_results
-                WHERE badge = %s
-                """ + (since_sql if since_sql else "") + """
-                ORDER BY created_at DESC
-                LIMIT 5
-            """, (badge,) + since_arg if since_sql else (badge,))
-            last_places = []
-            for row in cur.fetchall():
-                last_places.append({
-                    'place_cod': row['place_cod'],
-                    'place_name': row['place_name'],
-                    'status': row['status'],
-                    'has_discrepancy': row['has_discrepancy'],
-                    'has_photo': bool(row.get('photo_filename')),
-                    'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                    'updated_at': row['created_at'].isoformat() if row['created_at'] else None,
-                })
+            # json/json_agg psycopg2 разбирает сам — отдаём как есть, без поштучного isoformat().
+            execute_cached(cur, _SQL_USER_STATS, (badge, since_ts))
+            row = cur.fetchone()
 
         return jsonify({
             'success': True,
             'badge': badge,
-            'overall': overall,
-            'today': today,
-            'sessions': sessions,
-            'last_places': last_places
+            'overall': row['overall'],
+            'today': row['today'],
+            'sessions': row['sessions'],
+            'last_places': row['last_places']
         })
     
     except Exception as e:
@@ -912,37 +1320,124 @@ def get_user_stats(badge):
         return jsonify({'error': str(e)}), 500
 
 
+# Материализованные представления обновляются не чаще раза в свой интервал в фоновом потоке,
+# запущенном первым запросом после истечения интервала (без APScheduler/pg_cron). Время
+# последнего REFRESH хранится в matview_refresh: N воркеров не обновляют mv N раз за интервал.
+# На Vercel фоновый поток заморозился бы вместе с инвокацией посреди REFRESH — там mv не
+# обновляются и не читаются, запросы идут по сырой таблице.
+DAILY_STATS_MV_REFRESH_SECONDS = int(os.environ.get("DAILY_STATS_MV_REFRESH_SECONDS", "300"))
+# mv_zone_stats пересчитывается по всей истории сканов: при редких заходах в админку частый
+# REFRESH обошёлся бы дороже GROUP BY на каждый запрос, поэтому интервал крупный.
+ZONE_STATS_MV_REFRESH_SECONDS = int(os.environ.get("ZONE_STATS_MV_REFRESH_SECONDS", "900"))
+MATVIEW_REFRESH_TIMEOUT_MS = int(
+    os.environ.get("MATVIEW_REFRESH_TIMEOUT_MS")
+    or os.environ.get("DAILY_STATS_MV_REFRESH_TIMEOUT_MS", "120000")
+)
+# имя -> (интервал обновления, ключ advisory lock: один REFRESH на всю БД, а не на процесс)
+_MATVIEWS = {
+    "mv_daily_stats": (DAILY_STATS_MV_REFRESH_SECONDS, 7301),
+    "mv_zone_stats": (ZONE_STATS_MV_REFRESH_SECONDS, 7303),
+}
+_matview_refreshed_ts = {name: float("-inf") for name in _MATVIEWS}
+_matview_refresh_lock = threading.Lock()
+
+
+# fresh — другой процесс уже обновил представление в пределах интервала.
+_SQL_MATVIEW_STATE = """
+    SELECT m.ispopulated,
+           EXISTS (
+               SELECT 1 FROM matview_refresh r
+               WHERE r.name = m.matviewname
+                 AND r.refreshed_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+           ) AS fresh
+    FROM pg_matviews m
+    WHERE m.matviewname = %s
+"""
+
+_SQL_MATVIEW_REFRESHED = """
+    INSERT INTO matview_refresh (name, refreshed_at) VALUES (%s, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at
+"""
+
+
+def _refresh_matview(name: str):
+    """REFRESH материализованного представления на отдельном соединении пула (вне контекста запроса)."""
+    interval, lock_key = _MATVIEWS[name]
+    conn = None
+    try:
+        conn = _get_db_pool().getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (lock_key,))
+            if not cur.fetchone()["locked"]:
+                conn.rollback()
+                return
+            cur.execute(_SQL_MATVIEW_STATE, (interval, name))
+            row = cur.fetchone()
+            if row is None or (row["ispopulated"] and row["fresh"]):
+                conn.rollback()
+                return
+            cur.execute(f"SET LOCAL statement_timeout = {MATVIEW_REFRESH_TIMEOUT_MS}")
+            # CONCURRENTLY не блокирует чтение, но требует уже наполненного представления.
+            cur.execute(
+                f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"
+                if row["ispopulated"]
+                else f"REFRESH MATERIALIZED VIEW {name}"
+            )
+            cur.execute(_SQL_MATVIEW_REFRESHED, (name,))
+        conn.commit()
+    except Exception as e:
+        safe_rollback(conn)
+        logger.warning("Не удалось обновить %s: %s", name, e)
+    finally:
+        if conn is not None:
+            _release_db_conn(conn, True)
+
+
+def _maybe_refresh_matview(name: str):
+    if IS_VERCEL:
+        return
+    interval = _MATVIEWS[name][0]
+    now = time.monotonic()
+    if now - _matview_refreshed_ts[name] < interval:
+        return
+    with _matview_refresh_lock:
+        if now - _matview_refreshed_ts[name] < interval:
+            return
+        _matview_refreshed_ts[name] = now
+    threading.Thread(target=_refresh_matview, args=(name,), name=f"{name}_refresh", daemon=True).start()
+
+
+def _execute_matview_query(conn, cur, sql: str, params, live_sql: str, live_params):
+    """
+    Запрос по материализованному представлению, а по сырой таблице (live_sql) — на Vercel
+    и пока представление не наполнено (WITH NO DATA) или ещё не создано.
+    """
+    if not IS_VERCEL:
+        try:
+            execute_cached(cur, sql, params)
+            return
+        except (psycopg2.errors.ObjectNotInPrerequisiteState, psycopg2.errors.UndefinedTable):
+            safe_rollback(conn)
+    execute_cached(cur, live_sql, live_params)
+
+
 @app.route('/api/user/daily-stats/<badge>', methods=['GET'])
 def get_user_daily_stats(badge):
     """Динамика сканов пользователя за последние 7 дней."""
     badge, auth_err = _resolve_badge_for_user_scope(badge)
     if auth_err:
         return auth_err
+    _maybe_refresh_matview("mv_daily_stats")
+    conn = None
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT
-                    DATE(created_at) as date,
-                    COUNT(*) as total,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as errors,
-                    SUM(CASE WHEN NOT has_discrepancy THEN 1 ELSE 0 END) as ok
-                FROM inventory_results
-                WHERE badge = %s AND created_at >= CURRENT_DATE - INTERVAL '7 days'
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """, (badge,))
-            rows = cur.fetchall()
-        return jsonify({
-            'success': True,
-            'daily': [{
-                'date': r['date'].isoformat(),
-                'total': r['total'],
-                'errors': r['errors'],
-                'ok': r['ok']
-            } for r in rows]
-        })
+            # Готовый JSON ответа собирает Postgres — без поштучной сборки dict/isoformat в Python.
+            _execute_matview_query(conn, cur, _SQL_USER_DAILY, (badge, badge), _SQL_USER_DAILY_LIVE, (badge,))
+            body = cur.fetchone()['body']
+        return app.response_class(body, mimetype='application/json')
     except Exception as e:
+        safe_rollback(conn)
         logger.exception("Ошибка daily stats")
         return jsonify({'error': str(e)}), 500
 
@@ -957,55 +1452,14 @@ def get_user_history():
     date_from = request.args.get('from')
     date_to = request.args.get('to')
 
-    # Если даты не заданы — берём сегодня
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            query = """
-                SELECT 
-                    result_id,
-                    place_cod,
-                    place_name,
-                    qty_shk_db,
-                    qty_shk_fact,
-                    status,
-                    has_discrepancy,
-                    photo_filename,
-                    created_at
-                FROM inventory_results
-                WHERE badge = %s
-            """
-            params = [badge]
+            # Готовый JSON ответа собирает Postgres: одна текстовая строка вместо 500 dict.
+            execute_cached(cur, _SQL_USER_HISTORY, (badge, badge, date_from or None, date_to or None))
+            body = cur.fetchone()['body']
 
-            if date_from:
-                query += " AND created_at >= %s"
-                params.append(date_from)
-            if date_to:
-                query += " AND created_at < %s::date + INTERVAL '1 day'"
-                params.append(date_to)
-
-            query += " ORDER BY created_at DESC LIMIT 500"
-
-            cur.execute(query, params)
-            rows = cur.fetchall()
-
-        history = []
-        for row in rows:
-            history.append(
-                {
-                    "id": row["result_id"],
-                    "place_cod": row["place_cod"],
-                    "place_name": row["place_name"],
-                    "qty_db": row["qty_shk_db"],
-                    "qty_fact": row["qty_shk_fact"],
-                    "status": row["status"],
-                    "has_discrepancy": row["has_discrepancy"],
-                    "has_photo": bool(row["photo_filename"]),
-                    "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                }
-            )
-
-        return jsonify({"success": True, "badge": badge, "history": history})
+        return app.response_class(body, mimetype='application/json')
     except psycopg2.Error as e:
         logger.exception("База данных недоступна при получении истории сканов")
         return jsonify({"error": "История временно недоступна (нет связи с БД). Оффлайн-очередь продолжит работать."}), 503
@@ -1014,6 +1468,229 @@ def get_user_history():
         return jsonify({"error": str(e)}), 500
 
 
+# Справочники для Excel-выгрузок (общие для всех экспортов).
+# Порядок важен: "короб" проверяется раньше "полки" в пределах одного значения.
+_MX_TYPE_TOKENS = {
+    "короб": "Короб",
+    "box": "Короб",
+    "полка": "Полка",
+    "shelf": "Полка",
+    "стеллаж": "Полка",
+}
+_STATUS_LABELS = {
+    "ok": "Совпадает",
+    "error": "Ошибка",
+    "shelf_error": "Поломалось",
+    "recount": "Пересорт",
+    "missing": "Отсутствует",
+}
+
+
+def _format_mx_type(storage_type, box_type=None, category=None, dimensions=None):
+    """Только Полка или Короб по данным из отчёта Вместимость и заполненность."""
+    for val in (storage_type, box_type, category):
+        s = val and str(val).lower()
+        if not s:
+            continue
+        for token, label in _MX_TYPE_TOKENS.items():
+            if token in s:
+                return label
+    if dimensions:
+        try:
+            parts = str(dimensions).translate(DIM_TRANSLATE).split("x")
+            nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
+            if nums:
+                if max(nums) > 900:
+                    return "Полка"
+                return "Короб"
+        except (ValueError, TypeError):
+            pass
+    if storage_type or box_type or category:
+        return "Короб"
+    return ""
+
+
+def _status_label(status):
+    if not status:
+        return ""
+    # Новые сканы сохраняются уже в нижнем регистре — lower() нужен только старым строкам.
+    label = _STATUS_LABELS.get(status)
+    if label is None:
+        label = _STATUS_LABELS.get(status.lower(), status)
+    return label
+
+
+def _error_description(reason, comment, duplicate_floor_num=None, duplicate_row_num=None, duplicate_shelf_num=None):
+    if not reason and not comment and duplicate_floor_num is None and duplicate_row_num is None and duplicate_shelf_num is None:
+        return "—"
+    parts = []
+    if reason:
+        parts.append(str(reason).strip())
+    if comment:
+        parts.append(f"Коммент.: {str(comment).strip()}")
+    if duplicate_floor_num is not None or duplicate_row_num is not None or duplicate_shelf_num is not None:
+        floor_str = "" if duplicate_floor_num is None else str(duplicate_floor_num)
+        row_str = "" if duplicate_row_num is None else str(duplicate_row_num)
+        shelf_str = "" if duplicate_shelf_num is None else str(duplicate_shelf_num)
+        parts.append(f"Задвойка: этаж {floor_str}, ряд {row_str}, стеллаж {shelf_str}")
+    return " | ".join(parts) if parts else "—"
+
+
+# Стили отчётов создаются один раз на процесс, а не заново в каждом экспорте.
+_XLSX_HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+_XLSX_HEADER_FONT = Font(bold=True, color="FFFFFF")
+_XLSX_HEADER_ALIGNMENT = Alignment(horizontal="center")
+_XLSX_RED_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+_XLSX_GREEN_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+_XLSX_EMPLOYEES_HEADER_FILL = PatternFill(start_color="6E2B62", end_color="6E2B62", fill_type="solid")
+
+# Заголовки листов экспорта (неизменяемые, общие для всех запросов).
+_XLSX_USER_HISTORY_HEADERS = (
+    "Дата/время", "Этаж", "Ряд", "Секция",
+    "Код МХ", "ID места",
+    "Статус", "Что за ошибка (причина)", "Этаж (задвойка)", "Ряд (задвойка)", "Стеллаж (задвойка)", "Фото",
+)
+_XLSX_RESULTS_HEADERS = (
+    'Этаж', 'Ряд', 'Секция',
+    'Код МХ', 'ID места', 'Статус', 'Время',
+)
+_XLSX_BLOCK_ERRORS_HEADERS = (
+    "Дата/время", "Этаж", "Ряд", "Секция",
+    "Код МХ", "ID места", "Сотрудник",
+    "Статус", "Причина/коммент.", "Этаж (задвойка)", "Ряд (задвойка)", "Стеллаж (задвойка)", "Фото",
+)
+_XLSX_EMPLOYEES_HEADERS = (
+    "Бэйдж", "Сканов", "Расхождений", "Точность %", "Часов", "Сканов/час", "Первый скан", "Последний скан",
+)
+# Подсветка строки отчёта export_results по (есть расхождение, статус == 'OK');
+# подтверждённая задвойка всегда красная, остальные сочетания без заливки.
+_RESULT_ROW_FILLS = {
+    (True, False): _XLSX_RED_FILL,
+    (True, True): _XLSX_GREEN_FILL,
+    (False, True): _XLSX_GREEN_FILL,
+}
+
+
+def _xlsx_row(ws, values, fill=None, font=None, alignment=None):
+    """
+    Строка для write_only-листа openpyxl: стили задаются до append через WriteOnlyCell
+    (после записи строки ячейки уже недоступны). Без стилей — значения как есть.
+    """
+    if fill is None and font is None and alignment is None:
+        return values
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(ws, value=value)
+        if fill is not None:
+            cell.fill = fill
+        if font is not None:
+            cell.font = font
+        if alignment is not None:
+            cell.alignment = alignment
+        cells.append(cell)
+    return cells
+
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Порог, после которого собранный xlsx сбрасывается из памяти во временный файл.
+XLSX_SPOOL_MAX_BYTES = int(os.environ.get("XLSX_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+def _send_workbook(wb, filename):
+    """
+    Отдаёт книгу openpyxl вложением через SpooledTemporaryFile: небольшие отчёты
+    остаются в памяти, крупные уходят на диск, а не копятся в BytesIO целиком.
+    """
+    tmp = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_BYTES)
+    wb.save(tmp)
+    tmp.seek(0)
+    return send_file(
+        tmp,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=filename,
+    )
+
+
+# Фото в отчёте показываются высотой 60 px — в xlsx кладём JPEG-миниатюру с запасом
+# под масштаб, а не оригинал с телефона на несколько МБ.
+XLSX_THUMBNAIL_MAX_SIDE = 240
+XLSX_THUMBNAIL_QUALITY = 75
+# Миниатюры переиспользуются между выгрузками (блоки по соседним wh_id пересекаются).
+# Ключ — (result_id, размер фото), как в ETag: заменённое фото даёт новый ключ.
+XLSX_THUMBNAIL_CACHE_SIZE = int(os.environ.get("XLSX_THUMBNAIL_CACHE_SIZE", "500"))
+_xlsx_thumbnail_cache = OrderedDict()
+_xlsx_thumbnail_cache_lock = threading.Lock()
+
+
+def _xlsx_thumbnail(photo_data):
+    """JPEG-миниатюра фото для вставки в xlsx; None, если Pillow не смог прочитать фото."""
+    try:
+        with PILImage.open(BytesIO(photo_data)) as pil:
+            # Для JPEG декодер сразу уменьшает в 2-8 раз (DCT-scaling) — полный кадр не распаковывается.
+            pil.draft("RGB", (XLSX_THUMBNAIL_MAX_SIDE, XLSX_THUMBNAIL_MAX_SIDE))
+            pil.thumbnail((XLSX_THUMBNAIL_MAX_SIDE, XLSX_THUMBNAIL_MAX_SIDE), PILImage.LANCZOS)
+            if pil.mode != "RGB":
+                pil = pil.convert("RGB")
+            buf = BytesIO()
+            pil.save(buf, format="JPEG", quality=XLSX_THUMBNAIL_QUALITY, optimize=True)
+        return buf.getvalue()
+    except Exception as e:
+        logger.warning("Не удалось сжать фото для отчёта: %s", e)
+        return None
+
+
+def _fetch_embedded_photos(cur, result_ids) -> dict:
+    """
+    Фото для вставки в Excel: result_id -> JPEG-миниатюра. Основное фото из inventory_results,
+    иначе первое доп. фото из inventory_result_photos — всё одним round-trip
+    на курсоре самого экспорта (dict- или namedtuple-строки); сжатие — в PHOTO_POOL.
+    """
+    if not result_ids:
+        return {}
+    cur.execute(
+        """
+        SELECT ir.result_id, COALESCE(ir.photo_data, extra.photo_data) AS photo_data
+        FROM inventory_results ir
+        LEFT JOIN LATERAL (
+            SELECT p.photo_data
+            FROM inventory_result_photos p
+            WHERE p.result_id = ir.result_id AND p.photo_data IS NOT NULL
+            ORDER BY p.photo_id
+            LIMIT 1
+        ) extra ON ir.photo_data IS NULL
+        WHERE ir.result_id = ANY(%s)
+        """,
+        (list(result_ids),),
+    )
+    rows = cur.fetchall()
+    if rows and isinstance(rows[0], dict):
+        rows = [(row["result_id"], row["photo_data"]) for row in rows]
+    result = {}
+    missing = []
+    with _xlsx_thumbnail_cache_lock:
+        for result_id, photo in rows:
+            if photo is None:
+                continue
+            key = (result_id, len(photo))
+            thumb = _xlsx_thumbnail_cache.get(key)
+            if thumb is None:
+                missing.append((key, photo))
+            else:
+                _xlsx_thumbnail_cache.move_to_end(key)
+                result[result_id] = thumb
+    thumbnails = list(PHOTO_POOL.map(_xlsx_thumbnail, [photo for _, photo in missing]))
+    with _xlsx_thumbnail_cache_lock:
+        for (key, _), thumb in zip(missing, thumbnails):
+            if thumb is None:
+                continue
+            result[key[0]] = thumb
+            _xlsx_thumbnail_cache[key] = thumb
+        while len(_xlsx_thumbnail_cache) > XLSX_THUMBNAIL_CACHE_SIZE:
+            _xlsx_thumbnail_cache.popitem(last=False)
+    return result
+
+
 @app.route('/api/user/history/export', methods=['GET'])
 def export_user_history():
     """Скачать все сканы сотрудника со статусом не OK (или с расхождением) за период."""
@@ -1030,275 +1707,89 @@ def export_user_history():
 
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            query = """
-                SELECT 
-                    ir.result_id,
-                    ir.created_at,
-                    ir.place_cod,
-                    ir.place_name,
-                    ir.qty_shk_db,
-                    ir.qty_shk_fact,
-                    ir.status,
-                    ir.has_discrepancy,
-                    ir.photo_filename,
-                    ir.discrepancy_reason,
-                    ir.comment,
-                    ir.duplicate_floor_num,
-                    ir.duplicate_row_num,
-                    ir.duplicate_shelf_num,
-                    wp.storage_type,
-                    wp.box_type,
-                    wp.category,
-                    wp.dimensions,
-                    COALESCE(wp.floor, wp2.floor) AS floor,
-                    COALESCE(wp.row_num, wp2.row_num) AS row_num,
-                    COALESCE(wp.section, wp2.section) AS section
-                FROM inventory_results ir
-                LEFT JOIN warehouse_places wp ON wp.mx_id = ir.place_cod
-                LEFT JOIN warehouse_places wp2 ON UPPER(TRIM(wp2.mx_code)) = UPPER(TRIM(ir.place_name))
-                    AND ir.place_name IS NOT NULL AND ir.place_name != ''
-                WHERE ir.badge = %s
-                  AND (LOWER(COALESCE(ir.status, '')) <> 'ok' OR ir.has_discrepancy = TRUE)
-            """
-            params = [badge]
-
-            if date_from:
-                query += " AND ir.created_at >= %s"
-                params.append(date_from)
-            if date_to:
-                query += " AND ir.created_at < %s::date + INTERVAL '1 day'"
-                params.append(date_to)
-
-            query += " ORDER BY ir.created_at DESC"
-            if IS_VERCEL:
-                query += " LIMIT 3000"
-            cur.execute(query, params)
+        MAX_EMBEDDED_PHOTOS = 100
+        # NamedTupleCursor: один класс строки на запрос вместо dict на каждую из тысяч строк.
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_cached(cur, _SQL_USER_HISTORY_NOT_OK, (badge, date_from or None, date_to or None))
             rows = cur.fetchall()
+            # Фото только для первых MAX_EMBEDDED_PHOTOS строк — одним запросом, без N+1.
+            photo_by_result_id = _fetch_embedded_photos(
+                cur, [row.result_id for row in rows[:MAX_EMBEDDED_PHOTOS] if row.photo_filename and row.result_id]
+            )
 
         if not rows:
             return jsonify({'error': 'Нет записей со статусом не OK за выбранный период'}), 404
 
-        def _format_mx_type(storage_type, box_type=None, category=None, dimensions=None):
-            """Только Полка или Короб по данным из отчёта Вместимость и заполненность."""
-            for val in (storage_type, box_type, category):
-                if not val:
-                    continue
-                s = str(val).lower()
-                if "короб" in s or "box" in s:
-                    return "Короб"
-                if "полка" in s or "shelf" in s or "стеллаж" in s:
-                    return "Полка"
-            if dimensions:
-                try:
-                    parts = str(dimensions).replace("х", "x").replace("Х", "x").split("x")
-                    nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
-                    if nums:
-                        if max(nums) > 900:
-                            return "Полка"
-                        return "Короб"
-                except (ValueError, TypeError):
-                    pass
-            if storage_type or box_type or category:
-                return "Короб"
-            return ""
-
-        def _status_label(status):
-            if not status:
-                return ""
-            s = (status or "").lower()
-            if s == "ok":
-                return "Совпадает"
-            if s == "error":
-                return "Ошибка"
-            if s == "shelf_error":
-                return "Поломалось"
-            if s == "recount":
-                return "Пересорт"
-            if s == "missing":
-                return "Отсутствует"
-            return status
-
-        def _error_description(reason, comment, duplicate_floor_num=None, duplicate_row_num=None, duplicate_shelf_num=None):
-            parts = []
-            if reason:
-                parts.append(str(reason).strip())
-            if comment:
-                parts.append(f"Коммент.: {str(comment).strip()}")
-            if duplicate_floor_num is not None or duplicate_row_num is not None or duplicate_shelf_num is not None:
-                floor_str = "" if duplicate_floor_num is None else str(duplicate_floor_num)
-                row_str = "" if duplicate_row_num is None else str(duplicate_row_num)
-                shelf_str = "" if duplicate_shelf_num is None else str(duplicate_shelf_num)
-                parts.append(f"Задвойка: этаж {floor_str}, ряд {row_str}, стеллаж {shelf_str}")
-            return " | ".join(parts) if parts else "—"
-
-        def _parse_mx_code(mx_code):
-            """Извлечь этаж, ряд, секцию из кода МХ формата 36.02.40.140.06.03."""
-            if not mx_code or not isinstance(mx_code, str):
-                return None, None, None
-            parts = str(mx_code).strip().split(".")
-            try:
-                floor = int(parts[1]) if len(parts) >= 2 else None
-                row_num = int(parts[2]) if len(parts) >= 3 else None
-                section = int(parts[3]) if len(parts) >= 4 else None
-                return floor, row_num, section
-            except (ValueError, IndexError):
-                return None, None, None
-
         # Формируем Excel-файл
-        import openpyxl
-        from openpyxl.styles import Font, Alignment, PatternFill
-        from openpyxl.drawing.image import Image as XlImage
-        from openpyxl.utils import get_column_letter
-        from io import BytesIO
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Проблемные сканы"
-
-        headers = [
-            "Дата/время", "Этаж", "Ряд", "Секция",
-            "Код МХ", "ID места",
-            "Статус", "Что за ошибка (причина)", "Этаж (задвойка)", "Ряд (задвойка)", "Стеллаж (задвойка)", "Фото"
-        ]
-        ws.append(headers)
-
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        duplicate_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-        for cell in ws[1]:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.alignment = Alignment(horizontal="center")
-            cell.fill = header_fill
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Проблемные сканы")
 
+        headers = _XLSX_USER_HISTORY_HEADERS
         photo_col = len(headers)
+        # write_only: ширины колонок пишутся в начало листа — задаём до первой строки.
+        ws.column_dimensions[get_column_letter(photo_col)].width = 18
+        ws.append(_xlsx_row(
+            ws, headers, fill=_XLSX_HEADER_FILL, font=_XLSX_HEADER_FONT, alignment=_XLSX_HEADER_ALIGNMENT,
+        ))
+
         row_height = 75
         img_max_height = 60
-        MAX_EMBEDDED_PHOTOS = 100
-
-        # Оптимизация: убираем N+1 запросы по фото (bulk-fetch по result_id).
-        candidate_result_ids = []
-        for row in rows:
-            if len(candidate_result_ids) >= MAX_EMBEDDED_PHOTOS:
-                break
-            if row.get("photo_filename") and row.get("result_id"):
-                candidate_result_ids.append(row["result_id"])
-
-        photo_by_result_id = {}
-        if candidate_result_ids:
-            with conn.cursor() as cur_ph:
-                cur_ph.execute(
-                    """
-                    SELECT result_id, photo_data
-                    FROM inventory_results
-                    WHERE result_id = ANY(%s) AND photo_data IS NOT NULL
-                    """,
-                    (candidate_result_ids,),
-                )
-                for ph_row in cur_ph.fetchall():
-                    photo_by_result_id[ph_row["result_id"]] = ph_row.get("photo_data")
-
-                missing_ids = [rid for rid in candidate_result_ids if rid not in photo_by_result_id]
-                if missing_ids:
-                    cur_ph.execute(
-                        """
-                        SELECT DISTINCT ON (result_id) result_id, photo_data
-                        FROM inventory_result_photos
-                        WHERE result_id = ANY(%s) AND photo_data IS NOT NULL
-                        ORDER BY result_id, photo_id ASC
-                        """,
-                        (missing_ids,),
-                    )
-                    for ph_row in cur_ph.fetchall():
-                        photo_by_result_id[ph_row["result_id"]] = ph_row.get("photo_data")
 
         for excel_row_idx, row in enumerate(rows, start=2):
-            created = row["created_at"]
-            has_photo = bool(row.get("photo_filename"))
+            has_photo = bool(row.photo_filename)
             photo_data = None
-            if has_photo and row.get("result_id") and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
-                photo_data = photo_by_result_id.get(row["result_id"])
+            if has_photo and row.result_id and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
+                photo_data = photo_by_result_id.get(row.result_id)
 
             photo_cell_value = "есть" if has_photo else ""
             if has_photo and photo_data and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
                 try:
-                    raw = photo_data
-                    if hasattr(raw, "tobytes"):
-                        raw = raw.tobytes()
-                    elif not isinstance(raw, bytes):
-                        raw = bytes(raw)
-                    if raw:
-                        img_io = BytesIO(raw)
-                        img_io.seek(0)
-                        xl_img = XlImage(img_io)
-                        if xl_img.height and xl_img.height > img_max_height:
-                            ratio = img_max_height / xl_img.height
-                            xl_img.height = img_max_height
-                            xl_img.width = int(xl_img.width * ratio)
-                        xl_img.anchor = f"{get_column_letter(photo_col)}{excel_row_idx}"
-                        ws.add_image(xl_img)
-                        ws.row_dimensions[excel_row_idx].height = row_height
-                        photo_cell_value = ""
+                    xl_img = XlImage(BytesIO(photo_data))
+                    if xl_img.height and xl_img.height > img_max_height:
+                        ratio = img_max_height / xl_img.height
+                        xl_img.height = img_max_height
+                        xl_img.width = int(xl_img.width * ratio)
+                    xl_img.anchor = f"{get_column_letter(photo_col)}{excel_row_idx}"
+                    ws.add_image(xl_img)
+                    ws.row_dimensions[excel_row_idx].height = row_height
+                    photo_cell_value = ""
                 except Exception as e:
-                    logger.warning("Фото в отчёт (result_id=%s): %s", row.get("result_id"), e)
-
-            # Этаж, ряд, секция: из БД или парсинг из place_name (36.02.40.140.06.03 → этаж 2, ряд 40, секция 140)
-            floor_val = row.get("floor")
-            row_num_val = row.get("row_num")
-            section_val = row.get("section")
-            if (floor_val is None or row_num_val is None or section_val is None) and row.get("place_name"):
-                pf, pr, ps = _parse_mx_code(row["place_name"])
-                if floor_val is None:
-                    floor_val = pf
-                if row_num_val is None:
-                    row_num_val = pr
-                if section_val is None:
-                    section_val = ps
-
-            ws.append(
-                [
-                    created.strftime("%Y-%m-%d %H:%M") if created else "",
-                    floor_val if floor_val is not None else "",
-                    row_num_val if row_num_val is not None else "",
-                    section_val if section_val is not None else "",
-                    row["place_name"],
-                    row["place_cod"],
-                    _status_label(row.get("status")),
-                    _error_description(
-                        row.get("discrepancy_reason"),
-                        row.get("comment"),
-                        row.get("duplicate_floor_num"),
-                        row.get("duplicate_row_num"),
-                        row.get("duplicate_shelf_num"),
-                    ),
-                    row.get("duplicate_floor_num") if row.get("duplicate_floor_num") is not None else "",
-                    row.get("duplicate_row_num") if row.get("duplicate_row_num") is not None else "",
-                    row.get("duplicate_shelf_num") if row.get("duplicate_shelf_num") is not None else "",
-                    photo_cell_value,
-                ]
-            )
-            is_duplicate = (
-                row.get("duplicate_floor_num") is not None
-                or row.get("duplicate_row_num") is not None
-                or row.get("duplicate_shelf_num") is not None
-                or "[Задвойка подтверждена]" in str(row.get("comment") or "")
-            )
-            if is_duplicate:
-                for col in range(1, len(headers) + 1):
-                    ws.cell(row=excel_row_idx, column=col).fill = duplicate_fill
+                    logger.warning("Фото в отчёт (result_id=%s): %s", row.result_id, e)
 
-        ws.column_dimensions[get_column_letter(photo_col)].width = 18
+            # Этаж, ряд, секция: из БД или (в SQL) из place_name 36.02.40.140.06.03 → этаж 2, ряд 40, секция 140
+            floor_val = row.floor
+            row_num_val = row.row_num
+            section_val = row.section
 
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+            values = [
+                row.created_at,
+                floor_val if floor_val is not None else "",
+                row_num_val if row_num_val is not None else "",
+                section_val if section_val is not None else "",
+                row.place_name,
+                row.place_cod,
+                _status_label(row.status),
+                _error_description(
+                    row.discrepancy_reason,
+                    row.comment,
+                    row.duplicate_floor_num,
+                    row.duplicate_row_num,
+                    row.duplicate_shelf_num,
+                ),
+                row.duplicate_floor_num if row.duplicate_floor_num is not None else "",
+                row.duplicate_row_num if row.duplicate_row_num is not None else "",
+                row.duplicate_shelf_num if row.duplicate_shelf_num is not None else "",
+                photo_cell_value,
+            ]
+            is_duplicate = (
+                row.duplicate_floor_num is not None
+                or row.duplicate_row_num is not None
+                or row.duplicate_shelf_num is not None
+                or "[Задвойка подтверждена]" in str(row.comment or "")
+            )
+            ws.append(_xlsx_row(ws, values, fill=_XLSX_RED_FILL if is_duplicate else None))
 
-        filename = f"history_not_ok_{badge}.xlsx"
-        return send_file(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            as_attachment=True,
-            download_name=filename,
-        )
+        return _send_workbook(wb, f"history_not_ok_{badge}.xlsx")
     except Exception as e:
         logger.exception("Ошибка экспорта истории сканов пользователя")
         return jsonify({'error': str(e)}), 500
@@ -1434,7 +1925,7 @@ def admin_auth():
     if not badge or not password:
         return jsonify({'success': False, 'error': 'Заполните все поля'}), 400
     
-    if badge != ADMIN_BADGE or not hmac.compare_digest(password, ADMIN_PASSWORD):
+    if badge != ADMIN_BADGE or not _admin_password_ok(password):
         return jsonify({'success': False, 'error': 'Неверный бэйдж или пароль'}), 401
     
     session.clear()
@@ -1497,13 +1988,13 @@ def export_results():
     try:
         # Сохраняем результаты в БД
         conn = get_db()
+        insert_rows = []
         with conn.cursor() as cur:
             for item in results:
                 # Декодируем фото если есть
                 photo_data = None
                 photo_filename = None
                 if item.get('photo'):
-                    import base64
                     try:
                         # Формат: "data:image/jpeg;base64,..."
                         photo_str = item.get('photo')
@@ -1518,11 +2009,7 @@ def export_results():
                     except Exception as e:
                         logger.error("Ошибка декодирования фото: %s", e)
                 
-                cur.execute("""
-                    INSERT INTO inventory_results 
-                    (badge, place_cod, place_name, qty_shk_db, qty_shk_fact, status, has_discrepancy, photo_data, photo_filename)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
+                insert_rows.append((
                     badge,
                     item.get('place_cod'),
                     item.get('place_name'),
@@ -1533,126 +2020,72 @@ def export_results():
                     photo_data,
                     photo_filename
                 ))
+            # Одна многострочная вставка, сразу возвращающая этаж/ряд/секцию из warehouse_places
+            # для отчёта. result_id растёт в порядке VALUES, поэтому строки идут в порядке results.
+            place_rows = execute_values(cur, """
+                WITH ins AS (
+                    INSERT INTO inventory_results 
+                    (badge, place_cod, place_name, qty_shk_db, qty_shk_fact, status, has_discrepancy, photo_data, photo_filename)
+                    VALUES %s
+                    RETURNING result_id, place_cod
+                )
+                SELECT w.floor, w.row_num, w.section
+                FROM ins
+                LEFT JOIN warehouse_places w ON w.mx_id = ins.place_cod
+                ORDER BY ins.result_id
+            """, insert_rows, page_size=200, fetch=True)
             conn.commit()
-        
-        logger.info("Сохранено %d записей в БД для сотрудника %s", len(results), badge)
-        
-        # Подтягиваем тип/этаж/ряд/секция из warehouse_places для отчёта
-        place_cods = [item.get('place_cod') for item in results if item.get('place_cod') is not None]
-        place_info = {}
-        if place_cods:
-            with conn.cursor() as cur2:
-                cur2.execute("""
-                    SELECT mx_id, storage_type, box_type, category, dimensions, floor, row_num, section
-                    FROM warehouse_places
-                    WHERE mx_id = ANY(%s)
-                """, (place_cods,))
-                for r in cur2.fetchall():
-                    place_info[r['mx_id']] = r
-
-        def _fmt_type(st, box_type=None, category=None, dimensions=None):
-            """Только Полка или Короб."""
-            for val in (st, box_type, category):
-                if not val:
-                    continue
-                s = str(val).lower()
-                if "короб" in s or "box" in s:
-                    return "Короб"
-                if "полка" in s or "shelf" in s or "стеллаж" in s:
-                    return "Полка"
-            if dimensions:
-                try:
-                    parts = str(dimensions).replace("х", "x").replace("Х", "x").split("x")
-                    nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
-                    if nums:
-                        if max(nums) > 900:
-                            return "Полка"
-                        return "Короб"
-                except (ValueError, TypeError):
-                    pass
-            if st or box_type or category:
-                return "Короб"
-            return ""
+            logger.info("Сохранено %d записей в БД для сотрудника %s", len(results), badge)
 
         # Создаём Excel файл
-        import openpyxl
-        from openpyxl.styles import Font, Alignment, PatternFill
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Инвентаризация"
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Инвентаризация")
         
         # Заголовки: этаж, ряд, секция, код МХ, ID места, статус, время
-        headers = [
-            'Этаж', 'Ряд', 'Секция',
-            'Код МХ', 'ID места', 'Статус', 'Время'
-        ]
-        ws.append(headers)
-        
-        # Жирный шрифт для заголовков
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        for cell in ws[1]:
-            cell.font = Font(bold=True, color='FFFFFF')
-            cell.alignment = Alignment(horizontal='center')
-            cell.fill = header_fill
+        headers = _XLSX_RESULTS_HEADERS
         
-        # Цвета для подсветки
-        red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')  # Красный фон
-        green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')  # Зеленый фон
-        yellow_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')  # Желтый фон
-        num_cols = len(headers)
-        
-        # Данные
-        row_num = 2
-        for item in results:
-            qty_db = item.get('qty_shk_db')
-            qty_fact = item.get('qty_shk_fact')
+        # write_only не даёт вернуться к ячейкам: сначала готовим строки и считаем
+        # автоширину, затем пишем лист за один проход.
+        col_widths = [len(h) for h in headers]
+        prepared = []
+        for item, wp in zip(results, place_rows):
             status = item.get('status', '')
             has_discrepancy = item.get('has_discrepancy', False)
             comment_text = str(item.get('comment') or '')
             is_duplicate = bool(item.get('is_duplicate')) or ("[Задвойка подтверждена]" in comment_text)
             pc = item.get('place_cod')
-            wp = place_info.get(pc) or {}
             
-            ws.append([
-                wp.get('floor') if wp.get('floor') is not None else "",
-                wp.get('row_num') if wp.get('row_num') is not None else "",
-                wp.get('section') or "",
+            values = [
+                wp['floor'] if wp['floor'] is not None else "",
+                wp['row_num'] if wp['row_num'] is not None else "",
+                wp['section'] or "",
                 item.get('place_name'),
                 pc,
                 status,
                 item.get('timestamp')
-            ])
+            ]
+            for col, value in enumerate(values):
+                if value:
+                    col_widths[col] = max(col_widths[col], len(str(value)))
             
             # Подсветка строк: подтверждённая задвойка приоритетно красным.
             if is_duplicate:
-                for col in range(1, num_cols + 1):
-                    cell = ws.cell(row=row_num, column=col)
-                    cell.fill = red_fill
-            elif has_discrepancy and status != 'OK':
-                for col in range(1, num_cols + 1):
-                    cell = ws.cell(row=row_num, column=col)
-                    cell.fill = red_fill
-            elif status == 'OK':
-                for col in range(1, num_cols + 1):
-                    ws.cell(row=row_num, column=col).fill = green_fill
-            elif has_discrepancy:
-                for col in range(1, num_cols + 1):
-                    ws.cell(row=row_num, column=col).fill = yellow_fill
-            
-            row_num += 1
+                fill = _XLSX_RED_FILL
+            else:
+                fill = _RESULT_ROW_FILLS.get((bool(has_discrepancy), status == 'OK'))
+            prepared.append((values, fill))
         
         # Автоширина колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+        for col, width in enumerate(col_widths, start=1):
+            ws.column_dimensions[get_column_letter(col)].width = min(width + 2, 50)
+        
+        ws.append(_xlsx_row(
+            ws, headers, fill=_XLSX_HEADER_FILL, font=_XLSX_HEADER_FONT, alignment=_XLSX_HEADER_ALIGNMENT,
+        ))
+        for values, fill in prepared:
+            ws.append(_xlsx_row(ws, values, fill=fill))
         
         # Сохранение в память (BytesIO)
-        from io import BytesIO
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"inventory_{badge}_{timestamp}.xlsx"
         
@@ -1709,113 +2142,51 @@ def get_new_task():
         occupied_zones = get_occupied_zones()
         
         conn = get_db()
-        max_attempts = 10  # Максимум попыток найти свободную зону
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT MIN(mx_id) AS min_id, MAX(mx_id) AS max_id
-                FROM warehouse_places
-                WHERE mx_code IS NOT NULL AND mx_code != ''
-                """
-            )
-            id_range = cur.fetchone() or {}
-            min_id = id_range.get("min_id")
-            max_id = id_range.get("max_id")
-        if min_id is None or max_id is None:
+        max_attempts = 10  # Сколько свободных зон предлагаем SQL за один запрос
+        zones = get_zone_index()
+        if not zones:
             return jsonify({
                 'success': False,
                 'error': 'В справочнике нет доступных МХ.'
             }), 404
+        free_zones = [z for z in zones if z not in occupied_zones]
+        if not free_zones:
+            return jsonify({
+                'success': False,
+                'error': 'Все доступные зоны заняты. Попробуйте позже.'
+            }), 503
         
-        for attempt in range(max_attempts):
+        # Зоны из индекса заведомо непустые; если кандидат занят параллельным
+        # запросом, SQL сам переходит к следующему без ожидания блокировки.
+        candidates = random.sample(free_zones, min(max_attempts, len(free_zones)))
+        zone_prefix = reserve_free_zone(candidates, badge, hours=2)
+        if zone_prefix:
             with conn.cursor() as cur:
-                # Быстрый выбор случайной опорной точки через диапазон mx_id (без OFFSET и RANDOM sort).
-                random_id = random.randint(int(min_id), int(max_id))
-                cur.execute(
-                    """
-                    SELECT mx_code
-                    FROM warehouse_places
-                    WHERE mx_code IS NOT NULL AND mx_code != '' AND mx_id >= %s
-                    ORDER BY mx_id
-                    LIMIT 1
-                    """,
-                    (random_id,),
-                )
-                seed_row = cur.fetchone()
-                if not seed_row:
-                    # fallback на начало диапазона
-                    cur.execute(
-                        """
-                        SELECT mx_code
-                        FROM warehouse_places
-                        WHERE mx_code IS NOT NULL AND mx_code != ''
-                        ORDER BY mx_id
-                        LIMIT 1
-                        """
-                    )
-                    seed_row = cur.fetchone()
-
-                if not seed_row or not seed_row.get("mx_code"):
-                    rows = []
-                else:
-                    cur.execute(
-                        """
-                        SELECT
-                            w.mx_id as place_cod,
-                            w.mx_code as place_name,
-                            0 as qty_shk
-                        FROM warehouse_places w
-                        WHERE w.mx_code LIKE SUBSTRING(%s, 1, 9) || '%%'
-                          AND w.mx_code IS NOT NULL
-                        ORDER BY w.mx_code
-                        LIMIT %s
-                        """,
-                        (seed_row["mx_code"], zone_size),
-                    )
-                    rows = cur.fetchall()
-            
-            if not rows:
-                continue
-            
-            places = [dict(row) for row in rows]
-            zone_prefix = places[0]['place_name'][:9] if places[0]['place_name'] else None
-            
-            if not zone_prefix:
-                continue
+                execute_cached(cur, _SQL_ZONE_PLACES, (zone_prefix, zone_size))
+                places = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+            task = {
+                'zone': zone_prefix,
+                'total_places': len(places),
+                'places': places,
+                'reserved': True
+            }
             
-            # Проверяем, не занята ли эта зона
-            if zone_prefix in occupied_zones:
-                logger.info("Попытка %d: зона %s занята, ищем другую", attempt + 1, zone_prefix)
-                continue
+            logger.info(
+                "✅ Задание создано: зона=%s, мест=%d, сотрудник=%s",
+                task['zone'],
+                task['total_places'],
+                badge
+            )
             
-            # Пытаемся зарезервировать зону
-            if reserve_zone(zone_prefix, badge, hours=2):
-                task = {
-                    'zone': zone_prefix,
-                    'total_places': len(places),
-                    'places': places,
-                    'reserved': True
-                }
-                
-                logger.info(
-                    "✅ Задание создано: зона=%s, мест=%d, сотрудник=%s",
-                    task['zone'],
-                    task['total_places'],
-                    badge
-                )
-                
-                return jsonify({
-                    'success': True,
-                    'task': task,
-                    'timestamp': datetime.now().isoformat(),
-                    'expires_in_hours': 2
-                })
-            else:
-                # Зона уже занята другим сотрудником
-                occupied_zones.add(zone_prefix)
-                continue
+            return jsonify({
+                'success': True,
+                'task': task,
+                'timestamp': datetime.now(),
+                'expires_in_hours': 2
+            })
         
-        # Если не нашли свободную зону за max_attempts попыток
+        # Все предложенные кандидаты оказались заняты
         return jsonify({
             'success': False,
             'error': 'Все доступные зоны заняты. Попробуйте позже.'
@@ -1857,6 +2228,7 @@ def complete_task():
             conn.commit()
         
         if updated > 0:
+            _invalidate_occupied_zones()
             logger.info("✅ Задание завершено: зона=%s, сотрудник=%s", zone, badge)
             return jsonify({
                 'success': True,
@@ -1882,7 +2254,7 @@ def get_active_tasks():
         return jsonify({'error': 'Доступ запрещен'}), 403
     try:
         conn = get_db()
-        with conn.cursor() as cur:
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
             cur.execute("""
                 SELECT 
                     task_id,
@@ -1901,12 +2273,12 @@ def get_active_tasks():
             tasks = []
             for row in cur.fetchall():
                 tasks.append({
-                    'task_id': row['task_id'],
-                    'zone': row['zone_prefix'],
-                    'badge': row['badge'],
-                    'assigned_at': row['assigned_at'].isoformat(),
-                    'expires_at': row['expires_at'].isoformat(),
-                    'hours_left': round(row['hours_left'], 1)
+                    'task_id': row.task_id,
+                    'zone': row.zone_prefix,
+                    'badge': row.badge,
+                    'assigned_at': row.assigned_at,
+                    'expires_at': row.expires_at,
+                    'hours_left': round(row.hours_left, 1)
                 })
         
         return jsonify({
@@ -1929,33 +2301,69 @@ def admin_assign_task():
 
     data = request.get_json() or {}
     badge = data.get('badge')
-    zone_prefix = data.get('zone')
+    zones = data.get('zones')
+    if zones is None:
+        zones = [data.get('zone')] if data.get('zone') else []
+    elif not isinstance(zones, list):
+        return jsonify({'error': 'zones должен быть списком'}), 400
+    # Дубликаты схлопываем: повтор зоны иначе попал бы в busy_zones.
+    zones = list(dict.fromkeys(str(z).strip() for z in zones if z and str(z).strip()))
     hours = data.get('hours', 2)
 
-    if not badge or not zone_prefix:
+    if not badge or not zones:
         return jsonify({'error': 'Укажите badge и зону'}), 400
+    try:
+        hours = float(hours)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректное значение hours'}), 400
+    # float() принимает 'inf'/'nan': в interval они дают ошибку БД или бессрочное задание.
+    if not math.isfinite(hours) or hours <= 0:
+        return jsonify({'error': 'Некорректное значение hours'}), 400
 
     conn = None
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
+            # Все зоны одним statement'ом: просроченные задания этих зон помечаются
+            # expired, новые вставляются отдельными строками; занятые (активные и не
+            # просроченные) просто не попадают в RETURNING.
+            tasks = execute_values(cur, """
+                WITH req(zone_prefix, badge, expires_at) AS (VALUES %s),
+                expired AS (
+                    UPDATE active_tasks t
+                    SET status = 'expired'
+                    FROM req
+                    WHERE t.zone_prefix = req.zone_prefix
+                      AND t.status = 'active'
+                      AND t.expires_at <= CURRENT_TIMESTAMP
+                    RETURNING 1
+                )
                 INSERT INTO active_tasks (zone_prefix, badge, expires_at)
-                VALUES (%s, %s, CURRENT_TIMESTAMP + INTERVAL '%s hours')
-                RETURNING task_id, assigned_at, expires_at
-            """, (zone_prefix, badge, hours))
-            task = cur.fetchone()
+                SELECT req.zone_prefix, req.badge, req.expires_at
+                FROM req, (SELECT COUNT(*) FROM expired) e
+                ON CONFLICT (zone_prefix) WHERE status = 'active' DO NOTHING
+                RETURNING task_id, zone_prefix, assigned_at, expires_at
+            """, [(zone, badge, hours) for zone in zones],
+                template="(%s, %s, CURRENT_TIMESTAMP + (%s::float8 * INTERVAL '1 hour'))",
+                page_size=max(len(zones), 1), fetch=True)
             conn.commit()
+        if not tasks:
+            return jsonify({'error': f'Зона {", ".join(zones)} уже занята'}), 409
+        _invalidate_occupied_zones()
 
+        assigned = [{
+            'task_id': task['task_id'],
+            'zone': task['zone_prefix'],
+            'badge': badge,
+            'assigned_at': task['assigned_at'],
+            'expires_at': task['expires_at']
+        } for task in tasks]
+        assigned_zones = {task['zone'] for task in assigned}
         return jsonify({
             'success': True,
-            'task': {
-                'task_id': task['task_id'],
-                'zone': zone_prefix,
-                'badge': badge,
-                'assigned_at': task['assigned_at'].isoformat() if task['assigned_at'] else None,
-                'expires_at': task['expires_at'].isoformat() if task['expires_at'] else None
-            }
+            'task': assigned[0],
+            'tasks': assigned,
+            'busy_zones': [zone for zone in zones if zone not in assigned_zones]
         })
     except Exception as e:
         safe_rollback(conn)
@@ -1976,14 +2384,22 @@ def admin_extend_task():
 
     if not task_id:
         return jsonify({'error': 'Не передан task_id'}), 400
+    try:
+        hours = float(hours)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректное значение hours'}), 400
+    if not math.isfinite(hours) or hours <= 0:
+        return jsonify({'error': 'Некорректное значение hours'}), 400
 
     conn = None
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
+            # Часы — типизированный параметр (float8): дробные значения вроде 1.5
+            # make_interval(hours => int) не принял бы, а текст запроса неизменен и готовится один раз.
+            execute_cached(cur, """
                 UPDATE active_tasks
-                SET expires_at = expires_at + INTERVAL '%s hours'
+                SET expires_at = expires_at + (%s::float8 * INTERVAL '1 hour')
                 WHERE task_id = %s AND status = 'active'
                 RETURNING task_id, zone_prefix, badge, expires_at
             """, (hours, task_id))
@@ -1999,7 +2415,7 @@ def admin_extend_task():
                 'task_id': updated['task_id'],
                 'zone': updated['zone_prefix'],
                 'badge': updated['badge'],
-                'expires_at': updated['expires_at'].isoformat() if updated['expires_at'] else None
+                'expires_at': updated['expires_at']
             }
         })
     except Exception as e:
@@ -2035,6 +2451,7 @@ def admin_close_task():
 
         if not updated:
             return jsonify({'error': 'Задача уже закрыта или не найдена'}), 404
+        _invalidate_occupied_zones()
 
         return jsonify({
             'success': True,
@@ -2045,6 +2462,67 @@ def admin_close_task():
         return jsonify({'error': str(e)}), 500
 
 
+# Подсказки маршрута одним запросом: референс (переданный near или последнее отсканированное
+# место сотрудника), 5 последних МХ с расхождениями для подсветки и 20 ближайших МХ.
+_SQL_TASK_SUGGESTIONS = """
+    WITH last_scan AS (
+        SELECT ir.place_cod, ir.place_name
+        FROM inventory_results ir
+        WHERE %(near)s::text IS NULL AND ir.badge = %(badge)s
+          AND (ir.place_cod IS NOT NULL OR ir.place_name IS NOT NULL)
+        ORDER BY ir.created_at DESC NULLS LAST
+        LIMIT 1
+    ),
+    ref_place AS (
+        (
+            SELECT wp.floor, wp.row_num, wp.section
+            FROM warehouse_places wp
+            WHERE UPPER(TRIM(wp.mx_code)) = %(near)s::text
+            LIMIT 1
+        )
+        UNION ALL
+        (
+            SELECT wp.floor, wp.row_num, wp.section
+            FROM last_scan ls
+            JOIN warehouse_places wp ON wp.mx_id = ls.place_cod
+            LIMIT 1
+        )
+        UNION ALL
+        (
+            SELECT wp.floor, wp.row_num, wp.section
+            FROM last_scan ls
+            JOIN warehouse_places wp ON UPPER(TRIM(wp.mx_code)) = UPPER(TRIM(ls.place_name))
+            WHERE ls.place_cod IS NULL
+            LIMIT 1
+        )
+        LIMIT 1
+    ),
+    ref AS (
+        SELECT COALESCE(rp.floor, 0) AS f, COALESCE(rp.row_num, 0) AS r, COALESCE(rp.section, 0) AS s
+        FROM (SELECT 1) one
+        LEFT JOIN ref_place rp ON TRUE
+    ),
+    priority AS (
+        SELECT UPPER(TRIM(ir.place_name)) AS code
+        FROM inventory_results ir
+        WHERE ir.has_discrepancy AND ir.place_name IS NOT NULL AND ir.place_name != ''
+        GROUP BY ir.place_name
+        ORDER BY MAX(ir.created_at) DESC NULLS LAST
+        LIMIT 5
+    )
+    SELECT p.mx_code,
+           UPPER(TRIM(p.mx_code)) IN (SELECT code FROM priority) AS highlight
+    FROM warehouse_places p
+    CROSS JOIN ref
+    WHERE p.mx_code IS NOT NULL AND p.mx_code != ''
+    ORDER BY ABS(COALESCE(p.floor, 0) - ref.f)
+             + ABS(COALESCE(p.row_num, 0) - ref.r)
+             + ABS(COALESCE(p.section, 0) - ref.s) ASC,
+             p.mx_code ASC
+    LIMIT 20
+"""
+
+
 @app.route('/api/tasks/suggestions', methods=['GET'])
 def get_task_suggestions():
     """Ближайшие МХ: отталкиваясь от последнего отсканированного места сотрудника."""
@@ -2053,84 +2531,12 @@ def get_task_suggestions():
     conn = None
     try:
         conn = get_db()
-        ref_floor = ref_row = ref_section = None
-
         with conn.cursor() as cur:
-            # Референс: последнее отсканированное место сотрудника или переданный near
-            if near:
-                cur.execute("""
-                    SELECT floor, row_num, section FROM warehouse_places
-                    WHERE UPPER(TRIM(mx_code)) = UPPER(TRIM(%s))
-                    LIMIT 1
-                """, (near,))
-                row = cur.fetchone()
-                if row:
-                    ref_floor = row.get('floor')
-                    ref_row = row.get('row_num')
-                    ref_section = row.get('section')
-            elif badge:
-                cur.execute("""
-                    SELECT ir.place_cod, ir.place_name
-                    FROM inventory_results ir
-                    WHERE ir.badge = %s AND (ir.place_cod IS NOT NULL OR ir.place_name IS NOT NULL)
-                    ORDER BY ir.created_at DESC NULLS LAST
-                    LIMIT 1
-                """, (badge,))
-                last_scan = cur.fetchone()
-                if last_scan:
-                    pc = last_scan.get('place_cod')
-                    pn = last_scan.get('place_name')
-                    if pc is not None:
-                        cur.execute(
-                            "SELECT floor, row_num, section FROM warehouse_places WHERE mx_id = %s LIMIT 1",
-                            (pc,)
-                        )
-                    elif pn:
-                        cur.execute(
-                            "SELECT floor, row_num, section FROM warehouse_places WHERE UPPER(TRIM(mx_code)) = UPPER(TRIM(%s)) LIMIT 1",
-                            (pn,)
-                        )
-                    else:
-                        cur.execute("SELECT 1 WHERE FALSE")
-                    ref_row_db = cur.fetchone()
-                    if ref_row_db:
-                        ref_floor = ref_row_db.get('floor')
-                        ref_row = ref_row_db.get('row_num')
-                        ref_section = ref_row_db.get('section')
-
-            # МХ с приоритетом (есть расхождения в инвентаризации)
-            cur.execute("""
-                SELECT ir.place_name AS mx_code
-                FROM inventory_results ir
-                WHERE ir.has_discrepancy AND ir.place_name IS NOT NULL AND ir.place_name != ''
-                GROUP BY ir.place_name
-                ORDER BY MAX(ir.created_at) DESC NULLS LAST
-                LIMIT 5
-            """)
-            priority_mx = {row['mx_code'].strip().upper(): True for row in cur.fetchall() if row.get('mx_code')}
-
-            # Ближайшие МХ: сортировка по расстоянию от референса
-            rf = ref_floor if ref_floor is not None else 0
-            rr = ref_row if ref_row is not None else 0
-            rs = ref_section if ref_section is not None else 0
-
-            cur.execute("""
-                WITH places AS (
-                    SELECT mx_code, floor, row_num, section,
-                           COALESCE(floor, 0) AS f,
-                           COALESCE(row_num, 0) AS r,
-                           COALESCE(section, 0) AS s
-                    FROM warehouse_places
-                    WHERE mx_code IS NOT NULL AND mx_code != ''
-                )
-                SELECT mx_code,
-                       ABS(f - %s) + ABS(r - %s) + ABS(s - %s) AS dist
-                FROM places
-                ORDER BY dist ASC, mx_code ASC
-                LIMIT 20
-            """, (rf, rr, rs))
-
-            nearest = [dict(row) for row in cur.fetchall()]
+            cur.execute(_SQL_TASK_SUGGESTIONS, {
+                'near': normalize_mx_code(near) if near else None,
+                'badge': badge or None,
+            })
+            nearest = cur.fetchall()
 
         suggestions = []
         seen_mx = set()
@@ -2142,7 +2548,7 @@ def get_task_suggestions():
             suggestions.append({
                 'mx_code': mc,
                 'zone': mc[:9] if len(mc) >= 9 else mc,  # для обратной совместимости
-                'highlight': mc.upper() in priority_mx,
+                'highlight': bool(row.get('highlight')),
             })
             if len(suggestions) >= 12:
                 break
@@ -2162,6 +2568,73 @@ def get_task_suggestions():
         return jsonify({'error': str(e)}), 500
 
 
+_SQL_SYNC_VERSION = """
+    SELECT COUNT(*) AS cnt, COALESCE(MAX(mx_id), 0) AS max_id, MAX(updated_at) AS max_updated
+    FROM warehouse_places
+"""
+
+
+def _warehouse_places_version(conn) -> str:
+    """Версия справочника warehouse_places: число строк, max(mx_id), max(updated_at)."""
+    cached = _sync_version_cache["version"]
+    if cached is not None and time.monotonic() - _sync_version_cache["ts"] < SYNC_VERSION_TTL_SECONDS:
+        return cached
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+        execute_cached(cur, _SQL_SYNC_VERSION)
+        row = cur.fetchone()
+    version = f"{row.cnt}:{row.max_id}:{row.max_updated}"
+    _sync_version_cache.update(ts=time.monotonic(), version=version)
+    return version
+
+
+def _sync_payload_get(etag: str):
+    with _sync_payload_lock:
+        body = _sync_payload_cache.get(etag)
+        if body is not None:
+            _sync_payload_cache.move_to_end(etag)
+        return body
+
+
+def _sync_payload_put(etag: str, body: bytes) -> None:
+    global _sync_payload_bytes
+    if len(body) > SYNC_PAYLOAD_CACHE_MAX_BYTES:
+        return
+    with _sync_payload_lock:
+        old = _sync_payload_cache.pop(etag, None)
+        if old is not None:
+            _sync_payload_bytes -= len(old)
+        _sync_payload_cache[etag] = body
+        _sync_payload_bytes += len(body)
+        while (len(_sync_payload_cache) > SYNC_PAYLOAD_CACHE_SIZE
+               or _sync_payload_bytes > SYNC_PAYLOAD_CACHE_MAX_BYTES):
+            _, evicted = _sync_payload_cache.popitem(last=False)
+            _sync_payload_bytes -= len(evicted)
+
+
+# Колонки ответа /api/sync; place_cod обязан идти первым (next_since_id берётся из row[0]).
+_SYNC_COLUMNS = ('place_cod', 'place_name', 'qty_shk', 'floor', 'row_num', 'section', 'mx_status', 'updated_at')
+_SYNC_SELECT = """
+                mx_id AS place_cod,
+                mx_code AS place_name,
+                0 AS qty_shk,
+                floor,
+                row_num,
+                section,
+                mx_status,
+                updated_at"""
+
+
+def _sync_response(body, etag: str, status: int = 200):
+    # no-cache: браузер хранит ответ, но каждый раз переспрашивает с If-None-Match.
+    # В кэше лежит тело без закрывающей скобки: timestamp — время этого ответа, а не сборки.
+    if body is not None:
+        body = b''.join((body, b',"timestamp":', orjson.dumps(datetime.now()), b'}'))
+    resp = app.response_class(body, status=status, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
 @app.route('/api/sync', methods=['GET'])
 def sync_data():
     """Синхронизация данных для offline работы (поддерживает инкрементальную загрузку)."""
@@ -2211,51 +2684,69 @@ def sync_data():
                 return jsonify({"error": "Слишком много этажей в одном запросе"}), 400
 
         conn = get_db()
-        with conn.cursor() as cur:
-            query = """
-                SELECT
-                    mx_id AS place_cod,
-                    mx_code AS place_name,
-                    0 AS qty_shk,
-                    floor,
-                    row_num,
-                    section,
-                    mx_status,
-                    updated_at
-                FROM warehouse_places
-                WHERE 1=1
-            """
-            params = []
-            if since_id is not None:
-                query += " AND mx_id > %s"
-                params.append(since_id)
-            if blocks:
-                query += " AND UPPER(TRIM(warehouse_places.warehouse_name)) = ANY(%s::text[])"
-                params.append(blocks)
-            if floors:
-                query += " AND UPPER(TRIM(CAST(warehouse_places.floor AS TEXT))) = ANY(%s::text[])"
-                params.append(floors)
-            query += " ORDER BY mx_id"
-            if limit is not None:
-                query += " LIMIT %s"
-                params.append(limit)
+        version = _warehouse_places_version(conn)
+        etag = hashlib.md5(
+            f"{version}|{since_id}|{limit}|{','.join(blocks)}|{','.join(floors)}".encode("utf-8")
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            return _sync_response(None, etag, status=304)
+        body = _sync_payload_get(etag)
+        if body is not None:
+            return _sync_response(body, etag)
+
+        query = f"""
+            SELECT {_SYNC_SELECT}
+            FROM warehouse_places
+            WHERE 1=1
+        """
+        params = []
+        if since_id is not None:
+            query += " AND mx_id > %s"
+            params.append(since_id)
+        if blocks:
+            query += " AND UPPER(TRIM(warehouse_places.warehouse_name)) = ANY(%s::text[])"
+            params.append(blocks)
+        if floors:
+            query += " AND UPPER(TRIM(CAST(warehouse_places.floor AS TEXT))) = ANY(%s::text[])"
+            params.append(floors)
+        query += " ORDER BY mx_id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        # Ответ собираем сразу в байты пачками с серверного курсора: без списка
+        # dict'ов на весь склад и без повторной сериализации в jsonify.
+        chunks = []
+        count = 0
+        last_place_cod = since_id
+        # Обычный (кортежный) курсор: RealDictRow на каждую строку заметно дороже dict(zip(...)).
+        with conn.cursor(name='sync_stream', cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.itersize = SYNC_FETCH_BATCH_SIZE
             cur.execute(query, tuple(params))
-            rows = cur.fetchall()
+            while True:
+                batch = cur.fetchmany(SYNC_FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                chunks.append(orjson.dumps(
+                    [dict(zip(_SYNC_COLUMNS, row)) for row in batch],
+                    default=_orjson_default,
+                )[1:-1])
+                count += len(batch)
+                last_place_cod = batch[-1][0]
         
-        data = [dict(row) for row in rows]
+        logger.info("Синхронизация: отправлено %d записей", count)
         
-        logger.info("Синхронизация: отправлено %d записей", len(data))
-        
-        return jsonify({
+        meta = orjson.dumps({
             'success': True,
-            'count': len(data),
-            'data': data,
-            'next_since_id': data[-1]['place_cod'] if data else since_id,
-            'has_more': bool(limit and len(data) >= limit),
+            'count': count,
+            'next_since_id': last_place_cod,
+            'has_more': bool(limit and count >= limit),
             'blocks': blocks,
             'floors': floors,
-            'timestamp': datetime.now().isoformat()
         })
+        body = b''.join((b'{"data":[', b','.join(chunks), b'],', meta[1:-1]))
+        _sync_payload_put(etag, body)
+        return _sync_response(body, etag)
     
     except Exception as e:
         logger.exception("Ошибка при синхронизации данных")
@@ -2333,9 +2824,15 @@ def get_sync_floors():
         return jsonify({"error": str(e)}), 500
 
 
+def _admin_period() -> str:
+    """Период из request.args, приведённый к today|7d|30d (неизвестное значение — 7d)."""
+    period = request.args.get('period', '7d')
+    return period if period in ('today', '30d') else '7d'
+
+
 def _admin_period_dates():
     """Возвращает (date_from, date_to) для периода из request.args (period=today|7d|30d)."""
-    period = request.args.get('period', '7d')
+    period = _admin_period()
     date_to = datetime.now().date() + timedelta(days=1)
     if period == 'today':
         date_from = datetime.now().date()
@@ -2360,6 +2857,29 @@ def _admin_cache_set(key: str, value):
     _admin_cache[key] = {"ts": datetime.now(), "value": value}
 
 
+def _admin_json_cached(key: str):
+    """Готовый JSON-ответ из кэша админки (без повторной сериализации) или None."""
+    body = _admin_cache_get(key)
+    if body is None:
+        return None
+    return app.response_class(body, mimetype='application/json')
+
+
+def _admin_body_store(key: str, body: str):
+    _admin_cache_set(key, body)
+    return app.response_class(body, mimetype='application/json')
+
+
+def _admin_compute_lock(key: str) -> threading.Lock:
+    with _admin_compute_locks_guard:
+        return _admin_compute_locks.setdefault(key, threading.Lock())
+
+
+def _admin_cache_invalidate(*keys: str):
+    for key in keys:
+        _admin_cache.pop(key, None)
+
+
 def _check_rate_limit(bucket: str, limit: int, window_seconds: int):
     """
     Возвращает (allowed: bool, retry_after: int).
@@ -2379,100 +2899,217 @@ def _check_rate_limit(bucket: str, limit: int, window_seconds: int):
     return True, 0
 
 
+# Дневная динамика для аналитики: прошлые дни периода — из mv_daily_stats (десятки строк
+# вместо агрегации всей inventory_results), текущий день — вживую.
+# Параметры: (date_from, date_to, date_from, date_to).
+_SQL_ANALYTICS_DAILY = """
+    SELECT d AS date,
+           SUM(total)::bigint AS total,
+           SUM(errors)::bigint AS errors,
+           SUM(ok)::bigint AS ok
+    FROM mv_daily_stats
+    WHERE d >= %s::date AND d < LEAST(%s::date, CURRENT_DATE)
+    GROUP BY d
+    UNION ALL
+    SELECT CURRENT_DATE,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE has_discrepancy),
+           COUNT(*) FILTER (WHERE NOT has_discrepancy)
+    FROM inventory_results
+    WHERE created_at >= GREATEST(CURRENT_DATE, %s::date) AND created_at < %s::date
+    HAVING COUNT(*) > 0
+    ORDER BY date
+"""
+
+# Точность сотрудников за период (не меньше 10 сканов), из тех же источников.
+_SQL_ANALYTICS_ACCURACY = """
+    WITH per_badge AS (
+        SELECT badge, total, ok
+        FROM mv_daily_stats
+        WHERE d >= %s::date AND d < LEAST(%s::date, CURRENT_DATE)
+        UNION ALL
+        SELECT badge, COUNT(*), COUNT(*) FILTER (WHERE NOT has_discrepancy)
+        FROM inventory_results
+        WHERE created_at >= GREATEST(CURRENT_DATE, %s::date) AND created_at < %s::date
+        GROUP BY badge
+    )
+    SELECT badge,
+           ROUND(SUM(ok) * 100.0 / SUM(total), 1)::float8 AS accuracy
+    FROM per_badge
+    GROUP BY badge
+    HAVING SUM(total) >= 10
+    ORDER BY badge
+    LIMIT 200
+"""
+
+# Те же запросы по сырой таблице — на Vercel и пока mv_daily_stats ещё ни разу не наполнено.
+_SQL_ANALYTICS_DAILY_LIVE = """
+    SELECT 
+        DATE(created_at) as date,
+        COUNT(*) as total,
+        COUNT(*) FILTER (WHERE has_discrepancy) as errors,
+        COUNT(*) FILTER (WHERE NOT has_discrepancy) as ok
+    FROM inventory_results
+    WHERE created_at >= %s AND created_at < %s
+    GROUP BY DATE(created_at)
+    ORDER BY date
+"""
+
+_SQL_ANALYTICS_ACCURACY_LIVE = """
+    SELECT 
+        badge,
+        ROUND(COUNT(*) FILTER (WHERE NOT has_discrepancy) * 100.0 / COUNT(*), 1)::float8 AS accuracy
+    FROM inventory_results
+    WHERE created_at >= %s AND created_at < %s
+    GROUP BY badge
+    HAVING COUNT(*) >= 10
+    ORDER BY badge
+    LIMIT 200
+"""
+
+
 @app.route('/api/admin/analytics', methods=['GET'])
 def get_admin_analytics():
     """Получить данные для графиков."""
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    allowed, retry_after = _check_rate_limit("admin_analytics", limit=30, window_seconds=60)
+    if not allowed:
+        return jsonify({'error': f'Слишком много запросов. Повторите через {retry_after} сек.'}), 429
 
-    period = request.args.get('period', '7d')
-    cache_key = f"admin:analytics:{period}"
+    # Ключ по нормализованному периоду: произвольный ?period= не плодит записи в кэше.
+    cache_key = f"admin:analytics:{_admin_period()}"
     cached = _admin_cache_get(cache_key)
     if cached is not None:
         return jsonify(cached)
 
-    date_from, date_to = _admin_period_dates()
-    try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(*) as total,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as errors,
-                    SUM(CASE WHEN NOT has_discrepancy THEN 1 ELSE 0 END) as ok
-                FROM inventory_results
-                WHERE created_at >= %s AND created_at < %s
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """, (date_from, date_to))
-            daily_stats = []
-            for row in cur.fetchall():
-                daily_stats.append({
-                    'date': row['date'].isoformat(),
-                    'total': row['total'],
-                    'errors': row['errors'],
-                    'ok': row['ok']
-                })
-            
-            # Распределение сотрудников по точности
-            cur.execute("""
-                SELECT 
-                    badge,
-                    COUNT(*) as total,
-                    SUM(CASE WHEN NOT has_discrepancy THEN 1 ELSE 0 END) as ok
-                FROM inventory_results
-                WHERE created_at >= %s AND created_at < %s
-                GROUP BY badge
-                HAVING COUNT(*) >= 10
-                ORDER BY badge
-                LIMIT 200
-            """, (date_from, date_to))
-            accuracy_stats = []
-            for row in cur.fetchall():
-                accuracy = round((row['ok'] / row['total']) * 100, 1) if row['total'] > 0 else 0
-                accuracy_stats.append({
-                    'badge': row['badge'],
-                    'accuracy': accuracy
-                })
-            
-            # ТОП проблемных мест
-            cur.execute("""
-                SELECT 
-                    place_cod,
-                    place_name,
-                    COUNT(*) as scan_count,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as error_count
-                FROM inventory_results
-                WHERE created_at >= %s AND created_at < %s
-                GROUP BY place_cod, place_name
-                HAVING SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) > 0
-                ORDER BY error_count DESC, scan_count DESC
-                LIMIT 20
-            """, (date_from, date_to))
-            problem_zones = []
-            for row in cur.fetchall():
-                problem_zones.append({
-                    'place_cod': row['place_cod'],
-                    'place_name': row['place_name'],
-                    'scan_count': row['scan_count'],
-                    'error_count': row['error_count'],
-                    'error_rate': round((row['error_count'] / row['scan_count']) * 100, 1)
-                })
+    # Пока первый запрос считает агрегаты, параллельные ждут его и берут результат из кэша.
+    with _admin_compute_lock(cache_key):
+        cached = _admin_cache_get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+
+        date_from, date_to = _admin_period_dates()
+        _maybe_refresh_matview("mv_daily_stats")
+        try:
+            conn = get_db()
+            with conn.cursor() as cur:
+                # Прошлые дни — из mv_daily_stats, текущий — вживую.
+                period_params = (date_from, date_to, date_from, date_to)
+                _execute_matview_query(
+                    conn, cur, _SQL_ANALYTICS_DAILY, period_params,
+                    _SQL_ANALYTICS_DAILY_LIVE, (date_from, date_to),
+                )
+                daily_stats = [dict(row) for row in cur.fetchall()]
+                
+                # Распределение сотрудников по точности
+                _execute_matview_query(
+                    conn, cur, _SQL_ANALYTICS_ACCURACY, period_params,
+                    _SQL_ANALYTICS_ACCURACY_LIVE, (date_from, date_to),
+                )
+                accuracy_stats = [dict(row) for row in cur.fetchall()]
+                
+                # ТОП проблемных мест
+                execute_cached(cur, """
+                    SELECT 
+                        place_cod,
+                        place_name,
+                        COUNT(*) as scan_count,
+                        COUNT(*) FILTER (WHERE has_discrepancy) as error_count,
+                        ROUND(COUNT(*) FILTER (WHERE has_discrepancy) * 100.0 / COUNT(*), 1)::float8 AS error_rate
+                    FROM inventory_results
+                    WHERE created_at >= %s AND created_at < %s
+                    GROUP BY place_cod, place_name
+                    HAVING COUNT(*) FILTER (WHERE has_discrepancy) > 0
+                    ORDER BY error_count DESC, scan_count DESC
+                    LIMIT 20
+                """, (date_from, date_to))
+                problem_zones = [dict(row) for row in cur.fetchall()]
         
-        payload = {
-            'success': True,
-            'daily_stats': daily_stats,
-            'accuracy_stats': accuracy_stats,
-            'problem_zones': problem_zones
-        }
-        _admin_cache_set(cache_key, payload)
-        return jsonify(payload)
+            payload = {
+                'success': True,
+                'daily_stats': daily_stats,
+                'accuracy_stats': accuracy_stats,
+                'problem_zones': problem_zones
+            }
+            _admin_cache_set(cache_key, payload)
+            return jsonify(payload)
     
-    except Exception as e:
-        logger.exception("Ошибка при получении аналитики")
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            logger.exception("Ошибка при получении аналитики")
+            return jsonify({'error': str(e)}), 500
+
+
+# Вся статистика админки одним запросом (один round trip и один снимок данных):
+# общие счётчики, топ-20 сотрудников с суммарным временем сессий,
+# причины расхождений и почасовая динамика за 24 часа (в МСК).
+_SQL_ADMIN_STATS = """
+    WITH p AS (
+        SELECT %s::timestamp AS date_from, %s::timestamp AS date_to
+    ),
+    scoped AS (
+        SELECT ir.badge, ir.place_cod, ir.has_discrepancy, ir.discrepancy_reason, ir.created_at
+        FROM inventory_results ir, p
+        WHERE ir.created_at >= p.date_from AND ir.created_at < p.date_to
+    ),
+    overall AS (
+        SELECT
+            COUNT(*) as total_scanned,
+            COUNT(DISTINCT badge) as total_employees,
+            COUNT(*) FILTER (WHERE has_discrepancy) as with_discrepancy,
+            COUNT(*) FILTER (WHERE NOT has_discrepancy) as no_discrepancy,
+            COUNT(DISTINCT place_cod) as unique_places
+        FROM scoped
+    ),
+    employees AS (
+        SELECT
+            badge,
+            COUNT(*) as scanned,
+            COUNT(*) FILTER (WHERE has_discrepancy) as discrepancies,
+            MIN(created_at) as first_scan,
+            MAX(created_at) as last_scan
+        FROM scoped
+        GROUP BY badge
+        ORDER BY scanned DESC
+        LIMIT 20
+    ),
+    reasons AS (
+        SELECT
+            NULLIF(TRIM(discrepancy_reason), '') AS reason_raw,
+            COUNT(*) AS count
+        FROM scoped
+        WHERE has_discrepancy
+        GROUP BY NULLIF(TRIM(discrepancy_reason), '')
+    ),
+    hourly AS (
+        SELECT
+            DATE_TRUNC('hour', created_at + INTERVAL '3 hours') as hour,
+            COUNT(*) as count
+        FROM inventory_results
+        WHERE created_at >= NOW() - INTERVAL '24 hours'
+        GROUP BY DATE_TRUNC('hour', created_at + INTERVAL '3 hours')
+    )
+    SELECT
+        (SELECT row_to_json(o) FROM overall o) AS overall,
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'badge', e.badge,
+                    'scanned', e.scanned,
+                    'discrepancies', e.discrepancies,
+                    'first_scan', e.first_scan,
+                    'last_scan', e.last_scan,
+                    'total_seconds', COALESCE(d.total_seconds, 0)
+                ) ORDER BY e.scanned DESC), '[]')
+         FROM employees e
+         -- 20 index-only scans по idx_user_sessions_badge_duration
+         CROSS JOIN LATERAL (
+             SELECT SUM(us.session_duration) AS total_seconds
+             FROM user_sessions us
+             WHERE us.badge = e.badge
+         ) d) AS employees,
+        (SELECT COALESCE(json_agg(r ORDER BY r.count DESC), '[]') FROM reasons r) AS reasons,
+        (SELECT COALESCE(json_agg(h ORDER BY h.hour), '[]') FROM hourly h) AS hourly
+"""
 
 
 @app.route('/api/admin/stats', methods=['GET'])
@@ -2481,92 +3118,50 @@ def get_admin_stats():
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    allowed, retry_after = _check_rate_limit("admin_stats", limit=30, window_seconds=60)
+    if not allowed:
+        return jsonify({'error': f'Слишком много запросов. Повторите через {retry_after} сек.'}), 429
 
-    period = request.args.get('period', '7d')
-    cache_key = f"admin:stats:{period}"
+    cache_key = f"admin:stats:{_admin_period()}"
     cached = _admin_cache_get(cache_key)
     if cached is not None:
         return jsonify(cached)
 
-    date_from, date_to = _admin_period_dates()
-    try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    COUNT(*) as total_scanned,
-                    COUNT(DISTINCT badge) as total_employees,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as with_discrepancy,
-                    SUM(CASE WHEN NOT has_discrepancy THEN 1 ELSE 0 END) as no_discrepancy,
-                    COUNT(DISTINCT place_cod) as unique_places
-                FROM inventory_results
-                WHERE created_at >= %s AND created_at < %s
-            """, (date_from, date_to))
-            overall = dict(cur.fetchone())
+    # Пока первый запрос считает агрегаты, параллельные ждут его и берут результат из кэша.
+    with _admin_compute_lock(cache_key):
+        cached = _admin_cache_get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
 
-            cur.execute("""
-                SELECT 
-                    badge,
-                    COUNT(*) as scanned,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as discrepancies,
-                    MIN(created_at) as first_scan,
-                    MAX(created_at) as last_scan
-                FROM inventory_results
-                WHERE created_at >= %s AND created_at < %s
-                GROUP BY badge
-                ORDER BY scanned DESC
-                LIMIT 20
-            """, (date_from, date_to))
-            
-            employee_rows = cur.fetchall()
-            badges = [row['badge'] for row in employee_rows]
-
-            # Общее время работы по всем этим бэйджам одной выборкой
-            durations = {}
-            if badges:
-                cur.execute(
-                    """
-                    SELECT badge, COALESCE(SUM(session_duration), 0) AS total_seconds
-                    FROM user_sessions
-                    WHERE badge = ANY(%s) AND session_duration IS NOT NULL
-                    GROUP BY badge
-                    """,
-                    (badges,),
-                )
-                for d_row in cur.fetchall():
-                    durations[d_row['badge']] = d_row['total_seconds'] or 0
+        date_from, date_to = _admin_period_dates()
+        try:
+            conn = get_db()
+            with conn.cursor() as cur:
+                execute_cached(cur, _SQL_ADMIN_STATS, (date_from, date_to))
+                stats = cur.fetchone()
 
+            overall = stats['overall']
             employees = []
-            for row in employee_rows:
+            for row in stats['employees']:
                 scanned = row['scanned']
-                badge = row['badge']
-                total_seconds = durations.get(badge, 0)
+                total_seconds = float(row['total_seconds'] or 0)
                 total_hours = total_seconds / 3600 if total_seconds else 0
                 speed = round(scanned / total_hours, 1) if total_hours > 0 else 0
-                
+            
                 employees.append({
-                    'badge': badge,
+                    'badge': row['badge'],
                     'scanned': scanned,
                     'discrepancies': row['discrepancies'],
                     'accuracy': round((1 - row['discrepancies'] / scanned) * 100, 1) if scanned > 0 else 100,
                     'total_hours': round(total_hours, 1),
                     'speed': speed,  # сканов в час
-                    'first_scan': row['first_scan'].isoformat() if row['first_scan'] else None,
-                    'last_scan': row['last_scan'].isoformat() if row['last_scan'] else None
+                    'first_scan': row['first_scan'],
+                    'last_scan': row['last_scan']
                 })
-            
+        
             # Статистика по причинам расхождений
-            cur.execute("""
-                SELECT 
-                    COALESCE(NULLIF(TRIM(discrepancy_reason), ''), NULL) AS reason_raw,
-                    COUNT(*) AS count
-                FROM inventory_results
-                WHERE has_discrepancy = TRUE AND created_at >= %s AND created_at < %s
-                GROUP BY NULLIF(TRIM(discrepancy_reason), '')
-                ORDER BY count DESC
-            """, (date_from, date_to))
             discrepancy_types = []
-            for row in cur.fetchall():
+            for row in stats['reasons']:
                 reason = row['reason_raw']
                 label = (reason and reason.strip()) or "Причина не указана"
                 discrepancy_types.append({
@@ -2574,37 +3169,23 @@ def get_admin_stats():
                     'label': label,
                     'count': row['count'],
                 })
-            
-            # Динамика по часам (последние 24 часа, в МСК для一致ности с UI админки)
-            cur.execute("""
-                SELECT 
-                    DATE_TRUNC('hour', created_at + INTERVAL '3 hours') as hour,
-                    COUNT(*) as count
-                FROM inventory_results
-                WHERE created_at >= NOW() - INTERVAL '24 hours'
-                GROUP BY DATE_TRUNC('hour', created_at + INTERVAL '3 hours')
-                ORDER BY hour
-            """)
-            hourly_stats = []
-            for row in cur.fetchall():
-                hourly_stats.append({
-                    'hour': row['hour'].isoformat() if row['hour'] else None,
-                    'count': row['count']
-                })
         
-        payload = {
-            'success': True,
-            'overall': overall,
-            'employees': employees,
-            'discrepancy_types': discrepancy_types,
-            'hourly_stats': hourly_stats
-        }
-        _admin_cache_set(cache_key, payload)
-        return jsonify(payload)
+            # Динамика по часам (последние 24 часа, в МСК для единообразия с UI админки)
+            hourly_stats = [{'hour': row['hour'], 'count': row['count']} for row in stats['hourly']]
+        
+            payload = {
+                'success': True,
+                'overall': overall,
+                'employees': employees,
+                'discrepancy_types': discrepancy_types,
+                'hourly_stats': hourly_stats
+            }
+            _admin_cache_set(cache_key, payload)
+            return jsonify(payload)
     
-    except Exception as e:
-        logger.exception("Ошибка получения статистики")
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            logger.exception("Ошибка получения статистики")
+            return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/admin/latest_scans', methods=['GET'])
@@ -2621,8 +3202,8 @@ def get_admin_latest_scans():
 
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_cached(cur, """
                 SELECT result_id, place_cod, place_name, badge, qty_shk_db, qty_shk_fact,
                        status, has_discrepancy, photo_filename,
                        created_at
@@ -2636,17 +3217,17 @@ def get_admin_latest_scans():
         scans = []
         for row in rows:
             scans.append({
-                'id': row['result_id'],
-                'place_cod': row['place_cod'],
-                'place_name': row['place_name'],
-                'badge': row['badge'],
-                'qty_db': row['qty_shk_db'],
-                'qty_fact': row['qty_shk_fact'],
-                'status': row['status'],
-                'has_discrepancy': row['has_discrepancy'],
-                'has_photo': bool(row['photo_filename']),
-                'photo_url': f"/api/admin/photo/{row['result_id']}" if row['photo_filename'] else None,
-                'created_at': row['created_at'].isoformat() if row['created_at'] else None
+                'id': row.result_id,
+                'place_cod': row.place_cod,
+                'place_name': row.place_name,
+                'badge': row.badge,
+                'qty_db': row.qty_shk_db,
+                'qty_fact': row.qty_shk_fact,
+                'status': row.status,
+                'has_discrepancy': row.has_discrepancy,
+                'has_photo': bool(row.photo_filename),
+                'photo_url': f"/api/admin/photo/{row.result_id}" if row.photo_filename else None,
+                'created_at': row.created_at
             })
 
         payload = {'success': True, 'scans': scans}
@@ -2657,6 +3238,42 @@ def get_admin_latest_scans():
         return jsonify({'error': str(e)}), 500
 
 
+# Все фото МХ одним запросом: фото в самой inventory_results (старые записи и первое фото)
+# и дополнительные из inventory_result_photos, новые сверху.
+_SQL_PLACE_PHOTOS = """
+    SELECT
+        result_id AS id,
+        place_cod,
+        place_name,
+        badge,
+        qty_shk_db,
+        qty_shk_fact,
+        status,
+        has_discrepancy,
+        created_at,
+        '/api/admin/photo/' || result_id AS photo_url
+    FROM inventory_results
+    WHERE place_cod = %s
+      AND photo_filename IS NOT NULL
+    UNION ALL
+    SELECT
+        p.photo_id,
+        p.place_cod,
+        r.place_name,
+        p.badge,
+        r.qty_shk_db,
+        r.qty_shk_fact,
+        r.status,
+        r.has_discrepancy,
+        p.created_at,
+        '/api/admin/photo_file/' || p.photo_id
+    FROM inventory_result_photos p
+    LEFT JOIN inventory_results r ON r.result_id = p.result_id
+    WHERE p.place_cod = %s
+    ORDER BY created_at DESC NULLS LAST
+"""
+
+
 @app.route('/api/admin/place/<int:place_cod>/photos', methods=['GET'])
 def get_place_photos(place_cod: int):
     """Получить все фото по указанному МХ (для админ-панели)."""
@@ -2666,89 +3283,23 @@ def get_place_photos(place_cod: int):
 
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            # Фото, хранящиеся прямо в inventory_results (старые записи и первое фото)
-            cur.execute(
-                """
-                SELECT
-                    result_id,
-                    place_cod,
-                    place_name,
-                    badge,
-                    qty_shk_db,
-                    qty_shk_fact,
-                    status,
-                    has_discrepancy,
-                    created_at,
-                    photo_filename
-                FROM inventory_results
-                WHERE place_cod = %s
-                  AND photo_filename IS NOT NULL
-                """,
-                (place_cod,),
-            )
-            result_photos = cur.fetchall()
-
-            # Дополнительные фото из новой таблицы
-            cur.execute(
-                """
-                SELECT
-                    p.photo_id,
-                    p.result_id,
-                    p.place_cod,
-                    r.place_name,
-                    p.badge,
-                    r.qty_shk_db,
-                    r.qty_shk_fact,
-                    r.status,
-                    r.has_discrepancy,
-                    p.created_at,
-                    p.photo_filename
-                FROM inventory_result_photos p
-                LEFT JOIN inventory_results r ON r.result_id = p.result_id
-                WHERE p.place_cod = %s
-                """,
-                (place_cod,),
-            )
-            extra_photos = cur.fetchall()
-
-        photos = []
-        # Старые / первые фото
-        for row in result_photos:
-            photos.append(
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_cached(cur, _SQL_PLACE_PHOTOS, (place_cod, place_cod))
+            photos = [
                 {
-                    "id": row["result_id"],
-                    "place_cod": row["place_cod"],
-                    "place_name": row["place_name"],
-                    "badge": row["badge"],
-                    "qty_db": row["qty_shk_db"],
-                    "qty_fact": row["qty_shk_fact"],
-                    "status": row["status"],
-                    "has_discrepancy": row["has_discrepancy"],
-                    "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                    "photo_url": f"/api/admin/photo/{row['result_id']}",
+                    "id": row.id,
+                    "place_cod": row.place_cod,
+                    "place_name": row.place_name,
+                    "badge": row.badge,
+                    "qty_db": row.qty_shk_db,
+                    "qty_fact": row.qty_shk_fact,
+                    "status": row.status,
+                    "has_discrepancy": row.has_discrepancy,
+                    "created_at": row.created_at,
+                    "photo_url": row.photo_url,
                 }
-            )
-
-        # Дополнительные фото
-        for row in extra_photos:
-            photos.append(
-                {
-                    "id": row["photo_id"],
-                    "place_cod": row["place_cod"],
-                    "place_name": row["place_name"],
-                    "badge": row["badge"],
-                    "qty_db": row["qty_shk_db"],
-                    "qty_fact": row["qty_shk_fact"],
-                    "status": row["status"],
-                    "has_discrepancy": row["has_discrepancy"],
-                    "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                    "photo_url": f"/api/admin/photo_file/{row['photo_id']}",
-                }
-            )
-
-        # Сортируем по дате (новые сверху)
-        photos.sort(key=lambda x: x["created_at"] or "", reverse=True)
+                for row in cur.fetchall()
+            ]
 
         return jsonify({"success": True, "photos": photos})
     except Exception as e:
@@ -2756,6 +3307,36 @@ def get_place_photos(place_cod: int):
         return jsonify({"error": str(e)}), 500
 
 
+# Лента админки: 30 последних сканов и 10 отчётов, слитые и обрезанные в БД.
+# created_at хранится в UTC (timestamp without time zone) — переводим в МСК.
+_SQL_ADMIN_ACTIVITY = """
+    SELECT type, message, ts
+    FROM (
+        (
+            SELECT 'scan' AS type,
+                   concat(badge, ' зафиксировал ',
+                          COALESCE(NULLIF(place_name, ''), 'ID:' || place_cod),
+                          ' (', COALESCE(NULLIF(status, ''), 'без статуса'), ')') AS message,
+                   (created_at AT TIME ZONE 'UTC') AT TIME ZONE 'Europe/Moscow' AS ts
+            FROM inventory_results
+            ORDER BY created_at DESC
+            LIMIT 30
+        )
+        UNION ALL
+        (
+            SELECT 'report',
+                   concat('Отчет ', filename, ' отправлен (', badge, ')'),
+                   (created_at AT TIME ZONE 'UTC') AT TIME ZONE 'Europe/Moscow'
+            FROM reports
+            ORDER BY created_at DESC
+            LIMIT 10
+        )
+    ) t
+    ORDER BY ts DESC NULLS LAST
+    LIMIT 30
+"""
+
+
 @app.route('/api/admin/activity', methods=['GET'])
 def get_admin_activity():
     """Получить ленту событий (сканы, отчеты)."""
@@ -2770,45 +3351,12 @@ def get_admin_activity():
 
     try:
         conn = get_db()
-        events = []
-
-        with conn.cursor() as cur:
-            moscow_offset = timedelta(hours=3)
-            cur.execute("""
-                SELECT badge, place_cod, place_name, status, created_at
-                FROM inventory_results
-                ORDER BY created_at DESC
-                LIMIT 30
-            """)
-            for row in cur.fetchall():
-                created = row['created_at']
-                if created:
-                    created = created + moscow_offset
-                place_display = row['place_name'] or f"ID:{row['place_cod']}"
-                events.append({
-                    'type': 'scan',
-                    'message': f"{row['badge']} зафиксировал {place_display} ({row['status'] or 'без статуса'})",
-                    'timestamp': created.isoformat() if created else None
-                })
-
-            cur.execute("""
-                SELECT badge, filename, created_at
-                FROM reports
-                ORDER BY created_at DESC
-                LIMIT 10
-            """)
-            for row in cur.fetchall():
-                created = row['created_at']
-                if created:
-                    created = created + moscow_offset
-                events.append({
-                    'type': 'report',
-                    'message': f"Отчет {row['filename']} отправлен ({row['badge']})",
-                    'timestamp': created.isoformat() if created else None
-                })
-
-        events.sort(key=lambda item: item['timestamp'] or '', reverse=True)
-        events = events[:30]
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
+            execute_cached(cur, _SQL_ADMIN_ACTIVITY)
+            events = [
+                {'type': row.type, 'message': row.message, 'timestamp': row.ts}
+                for row in cur.fetchall()
+            ]
 
         payload = {'success': True, 'events': events}
         _admin_cache_set(cache_key, payload)
@@ -2818,6 +3366,22 @@ def get_admin_activity():
         return jsonify({'error': str(e)}), 500
 
 
+_SQL_CREATE_TICKET = """
+    INSERT INTO tickets (badge, place_cod, description, priority)
+    VALUES (%s, %s, %s, %s)
+    RETURNING ticket_id, created_at
+"""
+
+_SQL_RESOLVE_TICKET = """
+    UPDATE tickets
+    SET status = 'resolved',
+        resolver = %s,
+        resolved_at = CURRENT_TIMESTAMP
+    WHERE ticket_id = %s AND status != 'resolved'
+    RETURNING ticket_id
+"""
+
+
 @app.route('/api/tickets', methods=['POST'])
 def create_ticket():
     """Создать тикет/инцидент от сотрудника."""
@@ -2830,75 +3394,77 @@ def create_ticket():
     if not badge or not description:
         return jsonify({'error': 'Заполните описание и badge'}), 400
 
+    conn = None
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO tickets (badge, place_cod, description, priority)
-                VALUES (%s, %s, %s, %s)
-                RETURNING ticket_id, created_at
-            """, (badge, place_cod, description, priority))
+        with single_statement_commit(conn), conn.cursor() as cur:
+            execute_cached(cur, _SQL_CREATE_TICKET, (badge, place_cod, description, priority))
             ticket = cur.fetchone()
-            conn.commit()
+        _admin_cache_invalidate("admin:tickets")
 
         return jsonify({
             'success': True,
             'ticket': {
                 'id': ticket['ticket_id'],
-                'created_at': ticket['created_at'].isoformat() if ticket['created_at'] else None
+                'created_at': ticket['created_at']
             }
         })
     except psycopg2.Error as e:
-        if conn and not conn.closed:
-            try:
-                conn.rollback()
-            except:
-                pass
+        safe_rollback(conn)
         logger.exception("Ошибка БД при создании тикета")
         return jsonify({'error': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
-        if conn and not conn.closed:
-            try:
-                conn.rollback()
-            except:
-                pass
+        safe_rollback(conn)
         logger.exception("Ошибка создания тикета")
         return jsonify({'error': str(e)}), 500
 
 
+# Готовый JSON списка тикетов собирает Postgres — без dict на строку и повторной сериализации.
+_SQL_ADMIN_TICKETS = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'tickets', COALESCE(json_agg(json_build_object(
+            'id', t.ticket_id,
+            'badge', t.badge,
+            'place_cod', t.place_cod,
+            'place_name', t.place_name,
+            'description', t.description,
+            'priority', t.priority,
+            'status', t.status,
+            'created_at', t.created_at,
+            'resolved_at', t.resolved_at,
+            'resolver', t.resolver
+        ) ORDER BY t.status DESC, t.created_at DESC), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT t.ticket_id, t.badge, t.place_cod, t.description, t.priority, t.status,
+               t.created_at, t.resolved_at, t.resolver,
+               wp.mx_code as place_name
+        FROM tickets t
+        LEFT JOIN warehouse_places wp ON t.place_cod = wp.mx_id
+        ORDER BY t.status DESC, t.created_at DESC
+        LIMIT 100
+    ) t
+"""
+
+
+def _admin_tickets_body(conn) -> str:
+    with conn.cursor() as cur:
+        execute_cached(cur, _SQL_ADMIN_TICKETS)
+        return cur.fetchone()['body']
+
+
 @app.route('/api/admin/tickets', methods=['GET'])
 def get_tickets():
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    cached = _admin_json_cached("admin:tickets")
+    if cached is not None:
+        return cached
 
     try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT t.ticket_id, t.badge, t.place_cod, t.description, t.priority, t.status,
-                       t.created_at, t.resolved_at, t.resolver,
-                       wp.mx_code as place_name
-                FROM tickets t
-                LEFT JOIN warehouse_places wp ON t.place_cod = wp.mx_id
-                ORDER BY t.status DESC, t.created_at DESC
-                LIMIT 100
-            """)
-            tickets = []
-            for row in cur.fetchall():
-                tickets.append({
-                    'id': row['ticket_id'],
-                    'badge': row['badge'],
-                    'place_cod': row['place_cod'],
-                    'place_name': row['place_name'],
-                    'description': row['description'],
-                    'priority': row['priority'],
-                    'status': row['status'],
-                    'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                    'resolved_at': row['resolved_at'].isoformat() if row['resolved_at'] else None,
-                    'resolver': row['resolver']
-                })
-        return jsonify({'success': True, 'tickets': tickets})
+        return _admin_body_store("admin:tickets", _admin_tickets_body(get_db()))
     except Exception as e:
         logger.exception("Ошибка получения тикетов")
         return jsonify({'error': str(e)}), 500
@@ -2913,17 +3479,10 @@ def resolve_ticket(ticket_id):
     conn = None
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE tickets
-                SET status = 'resolved',
-                    resolver = %s,
-                    resolved_at = CURRENT_TIMESTAMP
-                WHERE ticket_id = %s AND status != 'resolved'
-                RETURNING ticket_id
-            """, (admin_badge, ticket_id))
+        with single_statement_commit(conn), conn.cursor() as cur:
+            execute_cached(cur, _SQL_RESOLVE_TICKET, (admin_badge, ticket_id))
             updated = cur.fetchone()
-            conn.commit()
+        _admin_cache_invalidate("admin:tickets")
 
         if not updated:
             return jsonify({'error': 'Тикет уже закрыт или не найден'}), 404
@@ -2935,6 +3494,35 @@ def resolve_ticket(ticket_id):
         return jsonify({'error': str(e)}), 500
 
 
+_SQL_ADMIN_REPORTS = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'reports', COALESCE(json_agg(r ORDER BY r.created_at DESC), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT 
+            report_id,
+            badge,
+            filename,
+            total_scanned,
+            with_discrepancy,
+            no_discrepancy,
+            created_at,
+            downloaded_at,
+            downloaded_by
+        FROM reports
+        ORDER BY created_at DESC
+        LIMIT 100
+    ) r
+"""
+
+
+def _admin_reports_body(conn) -> str:
+    with conn.cursor() as cur:
+        execute_cached(cur, _SQL_ADMIN_REPORTS)
+        return cur.fetchone()['body']
+
+
 @app.route('/api/admin/reports', methods=['GET'])
 def get_reports():
     """Получить список всех отчетов."""
@@ -2942,72 +3530,49 @@ def get_reports():
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    cached = _admin_json_cached("admin:reports")
+    if cached is not None:
+        return cached
     
     try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    report_id,
-                    badge,
-                    filename,
-                    total_scanned,
-                    with_discrepancy,
-                    no_discrepancy,
-                    created_at,
-                    downloaded_at,
-                    downloaded_by
-                FROM reports
-                ORDER BY created_at DESC
-                LIMIT 100
-            """)
-            
-            reports = []
-            for row in cur.fetchall():
-                reports.append({
-                    'report_id': row['report_id'],
-                    'badge': row['badge'],
-                    'filename': row['filename'],
-                    'total_scanned': row['total_scanned'],
-                    'with_discrepancy': row['with_discrepancy'],
-                    'no_discrepancy': row['no_discrepancy'],
-                    'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                    'downloaded_at': row['downloaded_at'].isoformat() if row['downloaded_at'] else None,
-                    'downloaded_by': row['downloaded_by']
-                })
-        
-        return jsonify({
-            'success': True,
-            'reports': reports
-        })
-    
+        return _admin_body_store("admin:reports", _admin_reports_body(get_db()))
+
     except Exception as e:
         logger.exception("Ошибка получения отчетов")
         return jsonify({'error': str(e)}), 500
 
 
+_SQL_ADMIN_WH_IDS = """
+    SELECT DISTINCT wh_id,
+           MAX(warehouse_name) FILTER (WHERE warehouse_name IS NOT NULL AND warehouse_name != '') AS warehouse_name
+    FROM warehouse_places
+    WHERE wh_id IS NOT NULL
+    GROUP BY wh_id
+    ORDER BY wh_id
+"""
+
+
+def _admin_wh_ids_body(conn) -> str:
+    with conn.cursor() as cur:
+        execute_cached(cur, _SQL_ADMIN_WH_IDS)
+        wh_ids = [
+            {'wh_id': row['wh_id'], 'warehouse_name': row['warehouse_name'] or ''}
+            for row in cur.fetchall()
+        ]
+    return app.json.dumps({'success': True, 'wh_ids': wh_ids})
+
+
 @app.route('/api/admin/wh_ids', methods=['GET'])
 def get_wh_ids():
     """Список wh_id (складов) для выгрузки отчёта по складу."""
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    cached = _admin_json_cached("admin:wh_ids")
+    if cached is not None:
+        return cached
     try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT DISTINCT wh_id,
-                       MAX(warehouse_name) FILTER (WHERE warehouse_name IS NOT NULL AND warehouse_name != '') AS warehouse_name
-                FROM warehouse_places
-                WHERE wh_id IS NOT NULL
-                GROUP BY wh_id
-                ORDER BY wh_id
-            """)
-            wh_ids = [
-                {'wh_id': row['wh_id'], 'warehouse_name': row['warehouse_name'] or ''}
-                for row in cur.fetchall()
-            ]
-        return jsonify({'success': True, 'wh_ids': wh_ids})
+        return _admin_body_store("admin:wh_ids", _admin_wh_ids_body(get_db()))
     except Exception as e:
         logger.exception("Ошибка получения списка wh_id")
         return jsonify({'error': str(e)}), 500
@@ -3152,153 +3717,82 @@ def export_block_errors():
 
     try:
         conn = get_db()
-        with conn.cursor() as cur:
-            query = """
-                SELECT 
-                    ir.result_id,
-                    ir.created_at,
-                    ir.place_cod,
-                    ir.place_name,
-                    ir.badge,
-                    ir.qty_shk_db,
-                    ir.qty_shk_fact,
-                    ir.status,
-                    ir.has_discrepancy,
-                    ir.photo_filename,
-                    ir.discrepancy_reason,
-                    ir.comment,
-                    ir.duplicate_floor_num,
-                    ir.duplicate_row_num,
-                    ir.duplicate_shelf_num,
-                    wp.storage_type,
-                    wp.box_type,
-                    wp.category,
-                    wp.dimensions,
-                    COALESCE(wp.floor, wp2.floor) AS floor,
-                    COALESCE(wp.row_num, wp2.row_num) AS row_num,
-                    COALESCE(wp.section, wp2.section) AS section
-                FROM inventory_results ir
-                LEFT JOIN warehouse_places wp ON wp.mx_id = ir.place_cod
-                LEFT JOIN warehouse_places wp2 ON UPPER(TRIM(wp2.mx_code)) = UPPER(TRIM(ir.place_name))
-                    AND ir.place_name IS NOT NULL AND ir.place_name != ''
-                WHERE (ir.has_discrepancy = TRUE OR LOWER(COALESCE(ir.status, '')) <> 'ok')
-                  AND (wp.wh_id = %s OR wp2.wh_id = %s)
-                  AND NOT EXISTS (SELECT 1 FROM repaired_places rp WHERE rp.wh_id = %s AND rp.place_cod = ir.place_cod AND (rp.status = 'repaired' OR rp.status IS NULL))
-            """
-            # На Vercel лимит 60 с — ограничиваем выборку, иначе таймаут
-            export_limit = 2500 if IS_VERCEL else 50000
-            cur.execute(
-                query + " ORDER BY ir.place_name, ir.created_at DESC LIMIT %s",
-                (wh_id, wh_id, wh_id, export_limit),
-            )
-            rows = cur.fetchall()
+        query = """
+            SELECT 
+                ir.result_id,
+                COALESCE(to_char(ir.created_at, 'YYYY-MM-DD HH24:MI'), '') AS created_at,
+                ir.place_cod,
+                ir.place_name,
+                ir.badge,
+                ir.qty_shk_db,
+                ir.qty_shk_fact,
+                ir.status,
+                ir.has_discrepancy,
+                ir.photo_filename,
+                ir.discrepancy_reason,
+                ir.comment,
+                ir.duplicate_floor_num,
+                ir.duplicate_row_num,
+                ir.duplicate_shelf_num,
+                wp.storage_type,
+                wp.box_type,
+                wp.category,
+                wp.dimensions,
+                COALESCE(wp.floor, wp2.floor, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.]([0-9]{1,9})(?![0-9])')::int) AS floor,
+                COALESCE(wp.row_num, wp2.row_num, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.][0-9]+[.]([0-9]{1,9})(?![0-9])')::int) AS row_num,
+                COALESCE(wp.section, wp2.section, SUBSTRING(BTRIM(ir.place_name) FROM '^[^.]*[.][0-9]+[.][0-9]+[.]([0-9]{1,9})(?![0-9])')::int) AS section
+            FROM inventory_results ir
+            LEFT JOIN warehouse_places wp ON wp.mx_id = ir.place_cod
+            LEFT JOIN warehouse_places wp2 ON UPPER(TRIM(wp2.mx_code)) = UPPER(TRIM(ir.place_name))
+                AND ir.place_name IS NOT NULL AND ir.place_name != ''
+            WHERE (ir.has_discrepancy = TRUE OR LOWER(COALESCE(ir.status, '')) <> 'ok')
+              AND (wp.wh_id = %s OR wp2.wh_id = %s)
+              AND NOT EXISTS (SELECT 1 FROM repaired_places rp WHERE rp.wh_id = %s AND rp.place_cod = ir.place_cod AND (rp.status = 'repaired' OR rp.status IS NULL))
+        """
+        # На Vercel лимит 60 с — ограничиваем выборку, иначе таймаут
+        export_limit = 2500 if IS_VERCEL else 50000
+        # Фото только для первых MAX_EMBEDDED_PHOTOS строк — одним запросом, без N+1.
+        MAX_EMBEDDED_PHOTOS = 50 if IS_VERCEL else 100
 
-        def _status_label(s):
-            if not s:
-                return ""
-            s = (s or "").lower()
-            if s == "ok": return "Совпадает"
-            if s == "error": return "Ошибка"
-            if s == "shelf_error": return "Поломалось"
-            if s == "missing": return "Отсутствует"
-            return s
-
-        def _err_desc(reason, comment, duplicate_floor_num=None, duplicate_row_num=None, duplicate_shelf_num=None):
-            parts = []
-            if reason:
-                parts.append(str(reason).strip())
-            if comment:
-                parts.append(f"Коммент.: {str(comment).strip()}")
-            if duplicate_floor_num is not None or duplicate_row_num is not None or duplicate_shelf_num is not None:
-                floor_str = "" if duplicate_floor_num is None else str(duplicate_floor_num)
-                row_str = "" if duplicate_row_num is None else str(duplicate_row_num)
-                shelf_str = "" if duplicate_shelf_num is None else str(duplicate_shelf_num)
-                parts.append(f"Задвойка: этаж {floor_str}, ряд {row_str}, стеллаж {shelf_str}")
-            return " | ".join(parts) if parts else "—"
-
-        import openpyxl
-        from openpyxl.styles import Font, Alignment, PatternFill
-        from openpyxl.drawing.image import Image as XlImage
-        from openpyxl.utils import get_column_letter
-        from io import BytesIO
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Ошибки wh_id {wh_id}"
-
-        headers = [
-            "Дата/время", "Этаж", "Ряд", "Секция",
-            "Код МХ", "ID места", "Сотрудник",
-            "Статус", "Причина/коммент.", "Этаж (задвойка)", "Ряд (задвойка)", "Стеллаж (задвойка)", "Фото"
-        ]
-        ws.append(headers)
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        duplicate_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-        for cell in ws[1]:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.alignment = Alignment(horizontal="center")
-            cell.fill = header_fill
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(f"Ошибки wh_id {wh_id}")
 
+        headers = _XLSX_BLOCK_ERRORS_HEADERS
         photo_col = len(headers)
+        # write_only: ширины колонок пишутся в начало листа — задаём до первой строки.
+        ws.column_dimensions[get_column_letter(photo_col)].width = 18
+        ws.append(_xlsx_row(
+            ws, headers, fill=_XLSX_HEADER_FILL, font=_XLSX_HEADER_FONT, alignment=_XLSX_HEADER_ALIGNMENT,
+        ))
+
         row_height = 75
         img_max_height = 60
-        MAX_EMBEDDED_PHOTOS = 50 if IS_VERCEL else 100
 
-        # Оптимизация: убираем N+1 запросы по фото (bulk-fetch по result_id).
-        candidate_result_ids = []
-        for row in rows:
-            if len(candidate_result_ids) >= MAX_EMBEDDED_PHOTOS:
-                break
-            if row.get("photo_filename") and row.get("result_id"):
-                candidate_result_ids.append(row["result_id"])
-
-        photo_by_result_id = {}
-        if candidate_result_ids:
-            with conn.cursor() as cur_ph:
-                cur_ph.execute(
-                    """
-                    SELECT result_id, photo_data
-                    FROM inventory_results
-                    WHERE result_id = ANY(%s) AND photo_data IS NOT NULL
-                    """,
-                    (candidate_result_ids,),
+        # Серверный курсор: строки идут пачками по EXPORT_FETCH_BATCH_SIZE прямо в лист,
+        # без fetchall() всей выборки в память.
+        with conn.cursor(name="export_block_errors") as cur:
+            cur.itersize = EXPORT_FETCH_BATCH_SIZE
+            cur.execute(
+                query + " ORDER BY ir.place_name, ir.created_at DESC LIMIT %s",
+                (wh_id, wh_id, wh_id, export_limit),
+            )
+            head = cur.fetchmany(MAX_EMBEDDED_PHOTOS)
+            with conn.cursor() as photo_cur:
+                photo_by_result_id = _fetch_embedded_photos(
+                    photo_cur,
+                    [row["result_id"] for row in head if row.get("photo_filename") and row.get("result_id")],
                 )
-                for ph_row in cur_ph.fetchall():
-                    photo_by_result_id[ph_row["result_id"]] = ph_row.get("photo_data")
-
-                missing_ids = [rid for rid in candidate_result_ids if rid not in photo_by_result_id]
-                if missing_ids:
-                    cur_ph.execute(
-                        """
-                        SELECT DISTINCT ON (result_id) result_id, photo_data
-                        FROM inventory_result_photos
-                        WHERE result_id = ANY(%s) AND photo_data IS NOT NULL
-                        ORDER BY result_id, photo_id ASC
-                        """,
-                        (missing_ids,),
-                    )
-                    for ph_row in cur_ph.fetchall():
-                        photo_by_result_id[ph_row["result_id"]] = ph_row.get("photo_data")
 
-        for excel_row_idx, row in enumerate(rows, start=2):
-            created = row["created_at"]
-            has_photo = bool(row.get("photo_filename"))
-            photo_data = None
-            if has_photo and row.get("result_id") and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
-                photo_data = photo_by_result_id.get(row["result_id"])
+            for excel_row_idx, row in enumerate(itertools.chain(head, cur), start=2):
+                has_photo = bool(row.get("photo_filename"))
+                photo_data = None
+                if has_photo and row.get("result_id") and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
+                    photo_data = photo_by_result_id.get(row["result_id"])
 
-            photo_cell_value = "есть" if has_photo else ""
-            if has_photo and photo_data and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
-                try:
-                    raw = photo_data
-                    if hasattr(raw, "tobytes"):
-                        raw = raw.tobytes()
-                    elif not isinstance(raw, bytes):
-                        raw = bytes(raw)
-                    if raw:
-                        img_io = BytesIO(raw)
-                        img_io.seek(0)
-                        xl_img = XlImage(img_io)
+                photo_cell_value = "есть" if has_photo else ""
+                if has_photo and photo_data and (excel_row_idx - 2) < MAX_EMBEDDED_PHOTOS:
+                    try:
+                        xl_img = XlImage(BytesIO(photo_data))
                         if xl_img.height and xl_img.height > img_max_height:
                             ratio = img_max_height / xl_img.height
                             xl_img.height = img_max_height
@@ -3307,67 +3801,43 @@ def export_block_errors():
                         ws.add_image(xl_img)
                         ws.row_dimensions[excel_row_idx].height = row_height
                         photo_cell_value = ""
-                except Exception as e:
-                    logger.warning("Фото в отчёт по блоку (result_id=%s): %s", row.get("result_id"), e)
+                    except Exception as e:
+                        logger.warning("Фото в отчёт по блоку (result_id=%s): %s", row.get("result_id"), e)
 
-            floor_val = row.get("floor")
-            row_num_val = row.get("row_num")
-            section_val = row.get("section")
-            if (floor_val is None or row_num_val is None or section_val is None) and row.get("place_name"):
-                parts = str(row["place_name"]).strip().split(".")
-                try:
-                    if floor_val is None and len(parts) >= 2:
-                        floor_val = int(parts[1])
-                    if row_num_val is None and len(parts) >= 3:
-                        row_num_val = int(parts[2])
-                    if section_val is None and len(parts) >= 4:
-                        section_val = int(parts[3])
-                except (ValueError, IndexError):
-                    pass
-
-            ws.append([
-                created.strftime("%Y-%m-%d %H:%M") if created else "",
-                floor_val if floor_val is not None else "",
-                row_num_val if row_num_val is not None else "",
-                section_val if section_val is not None else "",
-                row["place_name"],
-                row["place_cod"],
-                row.get("badge") or "",
-                _status_label(row.get("status")),
-                _err_desc(
-                    row.get("discrepancy_reason"),
-                    row.get("comment"),
-                    row.get("duplicate_floor_num"),
-                    row.get("duplicate_row_num"),
-                    row.get("duplicate_shelf_num"),
-                ),
-                row.get("duplicate_floor_num") if row.get("duplicate_floor_num") is not None else "",
-                row.get("duplicate_row_num") if row.get("duplicate_row_num") is not None else "",
-                row.get("duplicate_shelf_num") if row.get("duplicate_shelf_num") is not None else "",
-                photo_cell_value,
-            ])
-            is_duplicate = (
-                row.get("duplicate_floor_num") is not None
-                or row.get("duplicate_row_num") is not None
-                or row.get("duplicate_shelf_num") is not None
-                or "[Задвойка подтверждена]" in str(row.get("comment") or "")
-            )
-            if is_duplicate:
-                for col in range(1, len(headers) + 1):
-                    ws.cell(row=excel_row_idx, column=col).fill = duplicate_fill
+                floor_val = row.get("floor")
+                row_num_val = row.get("row_num")
+                section_val = row.get("section")
 
-        ws.column_dimensions[get_column_letter(photo_col)].width = 18
+                values = [
+                    row["created_at"],
+                    floor_val if floor_val is not None else "",
+                    row_num_val if row_num_val is not None else "",
+                    section_val if section_val is not None else "",
+                    row["place_name"],
+                    row["place_cod"],
+                    row.get("badge") or "",
+                    _status_label(row.get("status")),
+                    _error_description(
+                        row.get("discrepancy_reason"),
+                        row.get("comment"),
+                        row.get("duplicate_floor_num"),
+                        row.get("duplicate_row_num"),
+                        row.get("duplicate_shelf_num"),
+                    ),
+                    row.get("duplicate_floor_num") if row.get("duplicate_floor_num") is not None else "",
+                    row.get("duplicate_row_num") if row.get("duplicate_row_num") is not None else "",
+                    row.get("duplicate_shelf_num") if row.get("duplicate_shelf_num") is not None else "",
+                    photo_cell_value,
+                ]
+                is_duplicate = (
+                    row.get("duplicate_floor_num") is not None
+                    or row.get("duplicate_row_num") is not None
+                    or row.get("duplicate_shelf_num") is not None
+                    or "[Задвойка подтверждена]" in str(row.get("comment") or "")
+                )
+                ws.append(_xlsx_row(ws, values, fill=_XLSX_RED_FILL if is_duplicate else None))
 
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        filename = f"errors_wh_id_{wh_id}.xlsx"
-        return send_file(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            as_attachment=True,
-            download_name=filename,
-        )
+        return _send_workbook(wb, f"errors_wh_id_{wh_id}.xlsx")
     except Exception as e:
         logger.exception("Ошибка выгрузки отчёта по блоку")
         return jsonify({'error': str(e)}), 500
@@ -3391,9 +3861,9 @@ def export_employees():
                 SELECT 
                     badge,
                     COUNT(*) as scanned,
-                    SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as discrepancies,
-                    MIN(created_at) as first_scan,
-                    MAX(created_at) as last_scan
+                    COUNT(*) FILTER (WHERE has_discrepancy) as discrepancies,
+                    COALESCE(to_char(MIN(created_at), 'YYYY-MM-DD HH24:MI'), '') as first_scan,
+                    COALESCE(to_char(MAX(created_at), 'YYYY-MM-DD HH24:MI'), '') as last_scan
                 FROM inventory_results
                 WHERE created_at >= %s AND created_at < %s
                 GROUP BY badge
@@ -3413,19 +3883,13 @@ def export_employees():
                 for d in cur.fetchall():
                     durations[d['badge']] = d['total_seconds'] or 0
 
-        import openpyxl
-        from openpyxl.styles import Font, Alignment, PatternFill
-        from io import BytesIO
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Сотрудники"
-        headers = ["Бэйдж", "Сканов", "Расхождений", "Точность %", "Часов", "Сканов/час", "Первый скан", "Последний скан"]
-        ws.append(headers)
-        for c in ws[1]:
-            c.font = Font(bold=True)
-            c.fill = PatternFill(start_color="6E2B62", end_color="6E2B62", fill_type="solid")
-            c.font = Font(bold=True, color="FFFFFF")
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Сотрудники")
+        ws.append(_xlsx_row(
+            ws, _XLSX_EMPLOYEES_HEADERS,
+            fill=_XLSX_EMPLOYEES_HEADER_FILL,
+            font=_XLSX_HEADER_FONT,
+        ))
         for row in rows:
             badge = row['badge']
             scanned = row['scanned']
@@ -3434,71 +3898,182 @@ def export_employees():
             sec = durations.get(badge, 0)
             hours = round(sec / 3600, 1)
             speed = round(scanned / (hours or 0.01), 1)
-            first_scan = row['first_scan'].strftime("%Y-%m-%d %H:%M") if row.get('first_scan') else ""
-            last_scan = row['last_scan'].strftime("%Y-%m-%d %H:%M") if row.get('last_scan') else ""
-            ws.append([badge, scanned, disc, acc, hours, speed, first_scan, last_scan])
-        out = BytesIO()
-        wb.save(out)
-        out.seek(0)
+            ws.append([badge, scanned, disc, acc, hours, speed, row['first_scan'], row['last_scan']])
         period = request.args.get('period', '7d')
-        name = f"employees_{period}_{date_from}_{date_to}.xlsx"
-        return send_file(out, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", as_attachment=True, download_name=name)
+        return _send_workbook(wb, f"employees_{period}_{date_from}_{date_to}.xlsx")
     except Exception as e:
         logger.exception("Ошибка выгрузки сводки по сотрудникам")
         return jsonify({'error': str(e)}), 500
 
 
+_SQL_ZONE_QUALITY = """
+    SELECT zone_prefix, scan_count, errors, last_scan
+    FROM mv_zone_stats
+    ORDER BY errors DESC, scan_count DESC
+    LIMIT 20
+"""
+
+_SQL_ZONE_QUALITY_LIVE = """
+    SELECT SUBSTRING(place_name, 1, 9) as zone_prefix,
+           COUNT(*) as scan_count,
+           COUNT(*) FILTER (WHERE has_discrepancy) as errors,
+           MAX(created_at) as last_scan
+    FROM inventory_results
+    WHERE place_name IS NOT NULL
+    GROUP BY zone_prefix
+    ORDER BY errors DESC, scan_count DESC
+    LIMIT 20
+"""
+
+_SQL_QUALITY_REVIEWS = """
+    SELECT review_id, zone_prefix, reviewer, status, summary, created_at
+    FROM quality_reviews
+    ORDER BY created_at DESC
+    LIMIT 20
+"""
+
+
+def _admin_reviews_body(conn) -> str:
+    with conn.cursor() as cur:
+        _execute_matview_query(conn, cur, _SQL_ZONE_QUALITY, (), _SQL_ZONE_QUALITY_LIVE, ())
+        aggregates = []
+        for row in cur.fetchall():
+            aggregates.append({
+                'zone': row['zone_prefix'],
+                'scan_count': row['scan_count'],
+                'errors': row['errors'],
+                'last_scan': row['last_scan']
+            })
+
+        execute_cached(cur, _SQL_QUALITY_REVIEWS)
+        reviews = []
+        for row in cur.fetchall():
+            reviews.append({
+                'id': row['review_id'],
+                'zone': row['zone_prefix'],
+                'reviewer': row['reviewer'],
+                'status': row['status'],
+                'summary': row['summary'],
+                'created_at': row['created_at']
+            })
+    return app.json.dumps({'success': True, 'aggregates': aggregates, 'reviews': reviews})
+
+
 @app.route('/api/admin/reviews', methods=['GET'])
 def get_quality_reviews():
     admin_badge = request.cookies.get('admin_badge')
     if not admin_badge or admin_badge != 'ADMIN':
         return jsonify({'error': 'Доступ запрещен'}), 403
+    cached = _admin_json_cached("admin:quality_reviews")
+    if cached is not None:
+        return cached
 
+    _maybe_refresh_matview("mv_zone_stats")
     try:
-        conn = get_db()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT SUBSTRING(place_name, 1, 9) as zone_prefix,
-                       COUNT(*) as scan_count,
-                       SUM(CASE WHEN has_discrepancy THEN 1 ELSE 0 END) as errors,
-                       MAX(created_at) as last_scan
-                FROM inventory_results
-                WHERE place_name IS NOT NULL
-                GROUP BY zone_prefix
-                ORDER BY errors DESC, scan_count DESC
-                LIMIT 20
-            """)
-            aggregates = []
-            for row in cur.fetchall():
-                aggregates.append({
-                    'zone': row['zone_prefix'],
-                    'scan_count': row['scan_count'],
-                    'errors': row['errors'],
-                    'last_scan': row['last_scan'].isoformat() if row['last_scan'] else None
-                })
+        return _admin_body_store("admin:quality_reviews", _admin_reviews_body(get_db()))
+    except Exception as e:
+        logger.exception("Ошибка выдачи ревизий")
+        return jsonify({'error': str(e)}), 500
 
-            cur.execute("""
-                SELECT review_id, zone_prefix, reviewer, status, summary, created_at
-                FROM quality_reviews
-                ORDER BY created_at DESC
-                LIMIT 20
-            """)
-            reviews = []
-            for row in cur.fetchall():
-                reviews.append({
-                    'id': row['review_id'],
-                    'zone': row['zone_prefix'],
-                    'reviewer': row['reviewer'],
-                    'status': row['status'],
-                    'summary': row['summary'],
-                    'created_at': row['created_at'].isoformat() if row['created_at'] else None
-                })
 
-        return jsonify({'success': True, 'aggregates': aggregates, 'reviews': reviews})
+# Части дашборда: (поле ответа, ключ кэша админки, сборщик JSON-тела на переданном соединении).
+_ADMIN_DASHBOARD_PARTS = (
+    ("reports", "admin:reports", _admin_reports_body),
+    ("tickets", "admin:tickets", _admin_tickets_body),
+    ("wh_ids", "admin:wh_ids", _admin_wh_ids_body),
+    ("reviews", "admin:quality_reviews", _admin_reviews_body),
+)
+ADMIN_DASHBOARD_POOL = ThreadPoolExecutor(
+    max_workers=max(1, ADMIN_DASHBOARD_EXTRA_CONNS), thread_name_prefix="admin-dash"
+)
+# Слоты на дополнительные соединения (на процесс). Берутся без ожидания: нет слота — часть
+# считается на соединении запроса, а не ждёт в очереди за чужим дашбордом.
+_admin_dashboard_slots = threading.BoundedSemaphore(ADMIN_DASHBOARD_EXTRA_CONNS)
+
+
+def _admin_dashboard_part(key: str, build):
+    """
+    Собирает часть дашборда на соединении из пула (вне контекста запроса) и кладёт в кэш.
+    Освобождает слот _admin_dashboard_slots. None — пул исчерпан, часть надо досчитать
+    на соединении запроса.
+    """
+    try:
+        # Как и отдельные эндпоинты: одну часть одновременно считает один поток,
+        # остальные ждут его и берут тело из кэша.
+        with _admin_compute_lock(key):
+            body = _admin_cache_get(key)
+            if body is not None:
+                return body
+            try:
+                conn = _get_db_pool().getconn()
+            except PoolError:
+                return None
+            try:
+                body = build(conn)
+            finally:
+                _release_db_conn(conn, True)
+            _admin_cache_set(key, body)
+            return body
+    finally:
+        _admin_dashboard_slots.release()
+
+
+@app.route('/api/admin/dashboard', methods=['GET'])
+def get_admin_dashboard():
+    """
+    Отчёты, тикеты, wh_id и ревизии одним ответом. Первая часть, которой нет в кэше,
+    считается на соединении запроса, остальные — параллельно на соединениях из пула, пока
+    есть слоты и пул не пуст; иначе тоже на соединении запроса, последовательно.
+    На Vercel пула нет, и все части считаются на соединении запроса.
+    Каждое поле — тело соответствующего /api/admin/* эндпоинта без изменений.
+    """
+    admin_badge = request.cookies.get('admin_badge')
+    if not admin_badge or admin_badge != 'ADMIN':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    _maybe_refresh_matview("mv_zone_stats")
+    bodies = {}
+    missing = []
+    for field, key, build in _ADMIN_DASHBOARD_PARTS:
+        body = _admin_cache_get(key)
+        if body is None:
+            missing.append((field, key, build))
+        else:
+            bodies[field] = body
+
+    def build_on_request_conn(key, build):
+        with _admin_compute_lock(key):
+            body = _admin_cache_get(key)
+            if body is None:
+                body = build(get_db())
+                _admin_cache_set(key, body)
+            return body
+
+    # На Vercel каждое соединение — новый TCP/TLS-handshake на холодном инстансе.
+    inline, parallel = (missing, []) if IS_VERCEL else (missing[:1], missing[1:])
+    futures = {}
+    for part in parallel:
+        if _admin_dashboard_slots.acquire(blocking=False):
+            futures[ADMIN_DASHBOARD_POOL.submit(_admin_dashboard_part, part[1], part[2])] = part
+        else:
+            inline.append(part)
+    try:
+        for field, key, build in inline:
+            bodies[field] = build_on_request_conn(key, build)
+        for future in as_completed(futures):
+            field, key, build = futures[future]
+            body = future.result()
+            bodies[field] = body if body is not None else build_on_request_conn(key, build)
     except Exception as e:
-        logger.exception("Ошибка выдачи ревизий")
+        logger.exception("Ошибка сборки дашборда админки")
         return jsonify({'error': str(e)}), 500
 
+    # Тела уже сериализованы — склеиваем строки, без повторного разбора JSON.
+    body = '{"success":true,' + ','.join(
+        f'"{field}":{bodies[field]}' for field, _, _ in _ADMIN_DASHBOARD_PARTS
+    ) + '}'
+    return app.response_class(body, mimetype='application/json')
+
 
 @app.route('/api/admin/reviews', methods=['POST'])
 def create_quality_review():
@@ -3525,12 +4100,13 @@ def create_quality_review():
             """, (zone, admin_badge, status, summary))
             review = cur.fetchone()
             conn.commit()
+        _admin_cache_invalidate("admin:quality_reviews")
 
         return jsonify({
             'success': True,
             'review': {
                 'id': review['review_id'],
-                'created_at': review['created_at'].isoformat() if review['created_at'] else None
+                'created_at': review['created_at']
             }
         })
     except Exception as e:
@@ -3539,6 +4115,37 @@ def create_quality_review():
         return jsonify({'error': str(e)}), 500
 
 
+# Отчёт отдаём кусками через substring(bytea): в памяти процесса не больше одного куска,
+# а не весь xlsx (file_data хранится с STORAGE EXTERNAL, срез не распаковывает всё значение).
+REPORT_STREAM_CHUNK_SIZE = 256 * 1024
+
+_SQL_REPORT_CHUNK = "SELECT substring(file_data FROM %s FOR %s) AS chunk FROM reports WHERE report_id = %s"
+
+_SQL_REPORT_FILE_INFO = """
+    SELECT octet_length(file_data) AS size, filename
+    FROM reports
+    WHERE report_id = %s
+"""
+
+_SQL_REPORT_MARK_DOWNLOADED = """
+    UPDATE reports
+    SET downloaded_at = NOW(), downloaded_by = %s
+    WHERE report_id = %s AND downloaded_at IS NULL
+"""
+
+
+def _iter_report_chunks(report_id: int, total: int):
+    conn = get_db()
+    with conn.cursor() as cur:
+        for offset in range(1, total + 1, REPORT_STREAM_CHUNK_SIZE):
+            execute_cached(cur, _SQL_REPORT_CHUNK, (offset, REPORT_STREAM_CHUNK_SIZE, report_id))
+            row = cur.fetchone()
+            if not row or row['chunk'] is None:
+                logger.warning("Отчёт %s исчез во время скачивания (offset=%d)", report_id, offset)
+                return
+            yield bytes(row['chunk'])
+
+
 @app.route('/api/admin/reports/<int:report_id>/download', methods=['GET'])
 def download_report(report_id):
     """Скачать отчет."""
@@ -3551,38 +4158,32 @@ def download_report(report_id):
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT file_data, filename
-                FROM reports
-                WHERE report_id = %s
-            """, (report_id,))
-            
+            execute_cached(cur, _SQL_REPORT_FILE_INFO, (report_id,))
+
             row = cur.fetchone()
             if not row:
                 return jsonify({'error': 'Отчет не найден'}), 404
 
-            raw_data = row['file_data']
-            if raw_data is None or (hasattr(raw_data, '__len__') and len(raw_data) == 0):
+            total = row['size']
+            if not total:
                 return jsonify({'error': 'Файл отчёта удалён (хранится 30 дней). Сформируйте новый отчёт.'}), 404
 
-            file_data = bytes(raw_data)
             filename = row['filename'] or f'report_{report_id}.xlsx'
             
             # Отмечаем скачивание
-            cur.execute("""
-                UPDATE reports
-                SET downloaded_at = NOW(), downloaded_by = %s
-                WHERE report_id = %s AND downloaded_at IS NULL
-            """, (admin_badge, report_id))
+            execute_cached(cur, _SQL_REPORT_MARK_DOWNLOADED, (admin_badge, report_id))
             conn.commit()
+            if cur.rowcount:
+                _admin_cache_invalidate("admin:reports")
         
-        # Отправляем файл
-        from io import BytesIO
-        return send_file(
-            BytesIO(file_data),
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        # Отправляем файл потоком
+        return Response(
+            stream_with_context(_iter_report_chunks(report_id, total)),
+            mimetype=XLSX_MIMETYPE,
+            headers={
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+                'Content-Length': str(total),
+            },
         )
     
     except Exception as e:
@@ -3591,6 +4192,122 @@ def download_report(report_id):
         return jsonify({'error': str(e)}), 500
 
 
+# Фото отдаём с ETag: id + размер (octet_length у несжатого TOAST-значения не читает сами байты).
+# Если ETag совпал с If-None-Match, запрос возвращает photo_data = NULL — байты не передаются вовсе.
+PHOTO_CACHE_CONTROL_MUTABLE = "private, no-cache"
+
+_SQL_RESULT_PHOTO = """
+    SELECT photo_filename, etag,
+           CASE WHEN etag = ANY(%s::text[]) THEN NULL ELSE photo_data END AS photo_data
+    FROM (
+        SELECT photo_filename, photo_data,
+               'r' || result_id || '-' || octet_length(photo_data) AS etag
+        FROM inventory_results
+        WHERE result_id = %s AND photo_data IS NOT NULL
+    ) ph
+"""
+
+_SQL_PHOTO_FILE = """
+    SELECT photo_filename, etag,
+           CASE WHEN etag = ANY(%s::text[]) THEN NULL ELSE photo_data END AS photo_data
+    FROM (
+        SELECT photo_filename, photo_data,
+               'p' || photo_id || '-' || octet_length(photo_data) AS etag
+        FROM inventory_result_photos
+        WHERE photo_id = %s AND photo_data IS NOT NULL
+    ) ph
+"""
+
+
+# Размер доп. фото без чтения байтов: сверка файла дискового кэша со строкой в БД.
+_SQL_PHOTO_FILE_SIZE = """
+    SELECT octet_length(photo_data) AS size
+    FROM inventory_result_photos
+    WHERE photo_id = %s AND photo_data IS NOT NULL
+"""
+
+
+# Дисковый кэш доп. фото (байты под photo_id не меняются, но строка удаляется каскадом вместе
+# с результатом — очистка истории зоны, clear_user_data.py). PHOTO_DISK_CACHE_DIR включает кэш:
+# повторный запрос читает из БД только размер фото, не bytea. С PHOTO_ACCEL_REDIRECT_PREFIX
+# (например /_photos/) байты отдаёт nginx: location /_photos/ { internal; alias <PHOTO_DISK_CACHE_DIR>/; }.
+PHOTO_DISK_CACHE_DIR = os.environ.get("PHOTO_DISK_CACHE_DIR", "").strip()
+PHOTO_ACCEL_REDIRECT_PREFIX = os.environ.get("PHOTO_ACCEL_REDIRECT_PREFIX", "").strip()
+
+
+def _photo_disk_lookup(photo_id: int):
+    """(путь, размер) доп. фото в дисковом кэше или None."""
+    for ext in (".jpg", ".png"):
+        path = os.path.join(PHOTO_DISK_CACHE_DIR, f"{photo_id}{ext}")
+        try:
+            return path, os.stat(path).st_size
+        except OSError:
+            continue
+    return None
+
+
+def _photo_disk_discard(path: str):
+    """Удаляет файл дискового кэша (уже удалённый — не ошибка)."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _photo_disk_store(photo_id: int, filename: str, data: bytes):
+    """Атомарно (tmp + rename) кладёт доп. фото в дисковый кэш; ошибки записи не мешают ответу."""
+    ext = ".png" if (filename or "").lower().endswith(".png") else ".jpg"
+    tmp_name = None
+    try:
+        os.makedirs(PHOTO_DISK_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=PHOTO_DISK_CACHE_DIR, suffix=".tmp", delete=False) as tmp:
+            tmp_name = tmp.name
+            tmp.write(data)
+        os.replace(tmp_name, os.path.join(PHOTO_DISK_CACHE_DIR, f"{photo_id}{ext}"))
+    except OSError as e:
+        logger.warning("Не удалось записать фото %s в дисковый кэш: %s", photo_id, e)
+        if tmp_name is not None:
+            _photo_disk_discard(tmp_name)
+
+
+def _send_photo_from_disk(photo_id: int, path: str, size: int):
+    """Ответ из дискового кэша: ETag тот же, что у _SQL_PHOTO_FILE (размер файла = octet_length)."""
+    etag = f"p{photo_id}-{size}"
+    mimetype = "image/png" if path.endswith(".png") else "image/jpeg"
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    elif PHOTO_ACCEL_REDIRECT_PREFIX:
+        resp = app.response_class(mimetype=mimetype)
+        resp.headers["X-Accel-Redirect"] = PHOTO_ACCEL_REDIRECT_PREFIX + os.path.basename(path)
+    else:
+        resp = send_file(path, mimetype=mimetype, etag=False, conditional=False)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = PHOTO_CACHE_CONTROL_MUTABLE
+    return resp
+
+
+def _if_none_match_tags() -> list:
+    return [tag for tag in request.if_none_match if tag]
+
+
+def _send_photo(row, as_attachment: bool, download_name: str, cache_control: str):
+    """Ответ по строке _SQL_RESULT_PHOTO/_SQL_PHOTO_FILE: 304 при совпавшем ETag, иначе сам файл."""
+    if row["photo_data"] is None:
+        resp = app.response_class(status=304)
+    else:
+        mimetype = "image/png" if download_name.endswith(".png") else "image/jpeg"
+        resp = send_file(
+            BytesIO(row["photo_data"]),
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            etag=False,
+        )
+    resp.set_etag(row["etag"])
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+
 @app.route('/api/admin/photo/<int:result_id>', methods=['GET'])
 def get_result_photo(result_id):
     """Получить фото для результата инвентаризации."""
@@ -3602,32 +4319,19 @@ def get_result_photo(result_id):
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT photo_data, photo_filename
-                FROM inventory_results
-                WHERE result_id = %s AND photo_data IS NOT NULL
-                """,
-                (result_id,),
-            )
+            execute_cached(cur, _SQL_RESULT_PHOTO, (_if_none_match_tags(), result_id))
             row = cur.fetchone()
 
-            if not row or not row["photo_data"]:
-                return jsonify({"error": "Фото не найдено"}), 404
-
-            # Определяем mimetype
-            mimetype = "image/jpeg"
-            if row["photo_filename"] and row["photo_filename"].endswith(".png"):
-                mimetype = "image/png"
-
-            from io import BytesIO
+        if not row:
+            return jsonify({"error": "Фото не найдено"}), 404
 
-            return send_file(
-                BytesIO(row["photo_data"]),
-                mimetype=mimetype,
-                as_attachment=False,
-                download_name=row["photo_filename"] or "photo.jpg",
-            )
+        # Фото можно удалить из админки — браузер переспрашивает, но при совпадении ETag получает 304.
+        return _send_photo(
+            row,
+            as_attachment=False,
+            download_name=row["photo_filename"] or "photo.jpg",
+            cache_control=PHOTO_CACHE_CONTROL_MUTABLE,
+        )
     
     except Exception as e:
         logger.exception("Ошибка при получении фото")
@@ -3644,29 +4348,31 @@ def get_photo_file(photo_id: int):
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT photo_data, photo_filename
-                FROM inventory_result_photos
-                WHERE photo_id = %s AND photo_data IS NOT NULL
-                """,
-                (photo_id,),
-            )
+            cached = _photo_disk_lookup(photo_id) if PHOTO_DISK_CACHE_DIR else None
+            if cached is not None:
+                # Файл отдаём, только если строка ещё есть и размер совпал; иначе фото удалено
+                # (или id занят другим) — файл выбрасываем и идём обычным путём.
+                execute_cached(cur, _SQL_PHOTO_FILE_SIZE, (photo_id,))
+                row = cur.fetchone()
+                if row is not None and row["size"] == cached[1]:
+                    return _send_photo_from_disk(photo_id, *cached)
+                _photo_disk_discard(cached[0])
+
+            execute_cached(cur, _SQL_PHOTO_FILE, (_if_none_match_tags(), photo_id))
             row = cur.fetchone()
 
-        if not row or not row["photo_data"]:
+        if not row:
             return jsonify({"error": "Фото не найдено"}), 404
+        if PHOTO_DISK_CACHE_DIR and row["photo_data"] is not None:
+            _photo_disk_store(photo_id, row["photo_filename"], row["photo_data"])
 
-        mimetype = "image/jpeg"
-        if row["photo_filename"] and row["photo_filename"].endswith(".png"):
-            mimetype = "image/png"
-
-        from io import BytesIO
-        return send_file(
-            BytesIO(row["photo_data"]),
-            mimetype=mimetype,
+        # Доп. фото удаляются каскадом вместе с результатом (очистка истории зоны, clear_user_data.py):
+        # как и основные, браузер переспрашивает, но при совпадении ETag получает 304.
+        return _send_photo(
+            row,
             as_attachment=False,
             download_name=row["photo_filename"] or f"photo_{photo_id}.jpg",
+            cache_control=PHOTO_CACHE_CONTROL_MUTABLE,
         )
 
     except Exception as e:
@@ -3684,31 +4390,17 @@ def download_result_photo(result_id: int):
     try:
         conn = get_db()
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT photo_data, photo_filename
-                FROM inventory_results
-                WHERE result_id = %s AND photo_data IS NOT NULL
-                """,
-                (result_id,),
-            )
+            execute_cached(cur, _SQL_RESULT_PHOTO, (_if_none_match_tags(), result_id))
             row = cur.fetchone()
 
-        if not row or not row["photo_data"]:
+        if not row:
             return jsonify({"error": "Фото не найдено"}), 404
 
-        mimetype = "image/jpeg"
-        filename = row["photo_filename"] or f"photo_{result_id}.jpg"
-        if filename.endswith(".png"):
-            mimetype = "image/png"
-
-        from io import BytesIO
-
-        return send_file(
-            BytesIO(row["photo_data"]),
-            mimetype=mimetype,
+        return _send_photo(
+            row,
             as_attachment=True,
-            download_name=filename,
+            download_name=row["photo_filename"] or f"photo_{result_id}.jpg",
+            cache_control=PHOTO_CACHE_CONTROL_MUTABLE,
         )
     except Exception as e:
         logger.exception("Ошибка при скачивании фото")
@@ -3750,6 +4442,42 @@ def delete_result_photo(result_id: int):
         return jsonify({'error': str(e)}), 500
 
 
+# 100 последних сканов сотрудника готовым JSON; наличие фото — по IS NOT NULL, без чтения bytea.
+_SQL_EMPLOYEE_SCANS = """
+    SELECT json_build_object(
+        'success', TRUE,
+        'badge', %s::text,
+        'scans', COALESCE(json_agg(json_build_object(
+            'id', s.result_id,
+            'place_cod', s.place_cod,
+            'place_name', s.place_name,
+            'qty_db', s.qty_shk_db,
+            'qty_fact', s.qty_shk_fact,
+            'status', s.status,
+            'has_discrepancy', s.has_discrepancy,
+            'has_photo', s.has_photo,
+            'created_at', s.created_at
+        ) ORDER BY s.created_at DESC), '[]'::json)
+    )::text AS body
+    FROM (
+        SELECT 
+            result_id,
+            place_cod,
+            place_name,
+            qty_shk_db,
+            qty_shk_fact,
+            status,
+            has_discrepancy,
+            photo_data IS NOT NULL AS has_photo,
+            created_at
+        FROM inventory_results
+        WHERE badge = %s
+        ORDER BY created_at DESC
+        LIMIT 100
+    ) s
+"""
+
+
 @app.route('/api/admin/employee/<badge>', methods=['GET'])
 def get_employee_details(badge):
     """Получить детальную статистику по сотруднику."""
@@ -3762,42 +4490,10 @@ def get_employee_details(badge):
         conn = get_db()
         with conn.cursor() as cur:
             # Последние сканирования
-            cur.execute("""
-                SELECT 
-                    result_id,
-                    place_cod,
-                    place_name,
-                    qty_shk_db,
-                    qty_shk_fact,
-                    status,
-                    has_discrepancy,
-                    photo_data,
-                    created_at
-                FROM inventory_results
-                WHERE badge = %s
-                ORDER BY created_at DESC
-                LIMIT 100
-            """, (badge,))
-            
-            scans = []
-            for row in cur.fetchall():
-                scans.append({
-                    'id': row['result_id'],
-                    'place_cod': row['place_cod'],
-                    'place_name': row['place_name'],
-                    'qty_db': row['qty_shk_db'],
-                    'qty_fact': row['qty_shk_fact'],
-                    'status': row['status'],
-                    'has_discrepancy': row['has_discrepancy'],
-                    'has_photo': row['photo_data'] is not None,
-                    'created_at': row['created_at'].isoformat()
-                })
+            execute_cached(cur, _SQL_EMPLOYEE_SCANS, (badge, badge))
+            body = cur.fetchone()['body']
         
-        return jsonify({
-            'success': True,
-            'badge': badge,
-            'scans': scans
-        })
+        return app.response_class(body, mimetype='application/json')
     
     except Exception as e:
         logger.exception("Ошибка получения данных сотрудника")
@@ -8,6 +8,7 @@
 Использует переменные окружения из .env (DB_HOST, DB_NAME, DB_USER, DB_PASSWORD).
 """
 import os
+import sys
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -52,10 +53,25 @@ def main():
     ]
 
     try:
+        # Примерные счётчики из статистики — только для вывода, без COUNT(*) по большим таблицам.
+        cur.execute(
+            "SELECT relname, n_live_tup FROM pg_stat_user_tables WHERE relname = ANY(%s)",
+            ([table for table, _ in tables],),
+        )
+        approx = {row["relname"]: row["n_live_tup"] for row in cur.fetchall()}
+        # Один TRUNCATE вместо построчного DELETE: без WAL на каждую строку и мёртвых кортежей.
+        # Счётчики id не сбрасываем: ETag фото в админке строится по id и не должен повторяться.
+        cur.execute("TRUNCATE TABLE " + ", ".join(table for table, _ in tables))
+        # Агрегаты mv_* построены по очищенным таблицам — пересчитываем в той же транзакции,
+        # иначе статистика/дашборд показывают удалённые данные до фонового refresh.
+        matviews = ("mv_daily_stats", "mv_zone_stats")
+        cur.execute("SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s)", (list(matviews),))
+        existing = {row["matviewname"] for row in cur.fetchall()}
+        for view in matviews:
+            if view in existing:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {view}")
         for table, label in tables:
-            cur.execute(f"DELETE FROM {table}")
-            n = cur.rowcount
-            print(f"  {label}: удалено строк {n}")
+            print(f"  {label}: удалено строк ~{approx.get(table, 0)}")
         conn.commit()
         print("Готово. Все пользовательские данные очищены.")
     except Exception as e:
@@ -1,7 +1,22 @@
+import hashlib
 import logging
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
 logger = logging.getLogger(__name__)
 
+# DDL «при первом обращении» достаточно выполнить один раз на процесс: повторный
+# CREATE/ALTER ... IF NOT EXISTS — лишний round-trip, а ALTER ещё и берёт эксклюзивную блокировку.
+# Флаг ставим только после COMMIT самой DDL: вызывающий код может не закоммитить свою транзакцию
+# (ответ 400/409, исключение), и откат унёс бы CREATE/ALTER, а процесс считал бы его выполненным.
+_ensured = set()
+
 
 def safe_rollback(conn):
     """Безопасный rollback транзакции."""
@@ -12,9 +27,28 @@ def safe_rollback(conn):
             logger.error("Ошибка при rollback: %s", e)
 
 
+@contextmanager
+def single_statement_commit(conn):
+    """
+    Одиночная запись без явных BEGIN/COMMIT: на время блока соединение в autocommit,
+    и INSERT/UPDATE ... RETURNING фиксируется за один round-trip вместо трёх.
+    Если транзакция на соединении уже открыта — пишем в ней и коммитим по выходу, как раньше.
+    """
+    if conn.autocommit or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        yield
+        if not conn.autocommit:
+            conn.commit()
+        return
+    conn.autocommit = True
+    try:
+        yield
+    finally:
+        conn.autocommit = False
+
+
 def ensure_shift_start_table(conn):
     """Создаёт таблицу shift_start при первом обращении (граница смены для блокировки дубликатов МХ)."""
-    if not conn or conn.closed:
+    if not conn or conn.closed or "shift_start" in _ensured:
         return
     try:
         with conn.cursor() as cur:
@@ -24,22 +58,89 @@ def ensure_shift_start_table(conn):
                     started_at TIMESTAMPTZ NOT NULL DEFAULT (NOW())
                 )
             """)
+        conn.commit()
+        _ensured.add("shift_start")
     except Exception as e:
         safe_rollback(conn)
         logger.warning("Не удалось создать shift_start: %s", e)
 
 
+_SQL_HAS_MX_STATUS = """
+    SELECT 1 FROM pg_attribute
+    WHERE attrelid = 'warehouse_places'::regclass AND attname = 'mx_status' AND NOT attisdropped
+"""
+
+
 def ensure_warehouse_places_mx_status(conn):
     """Добавляет колонку mx_status в warehouse_places при первом обращении (Статус МХ: Активно, есть/нет товаров)."""
-    if not conn or conn.closed:
+    if not conn or conn.closed or "mx_status" in _ensured:
         return
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-                ALTER TABLE warehouse_places
-                ADD COLUMN IF NOT EXISTS mx_status VARCHAR(150)
-            """)
+            # ALTER ... IF NOT EXISTS берёт ACCESS EXCLUSIVE даже когда колонка уже есть
+            # (и встаёт в очередь за долгими чтениями справочника) — сначала смотрим в каталог.
+            cur.execute(_SQL_HAS_MX_STATUS)
+            if cur.fetchone() is None:
+                cur.execute("""
+                    ALTER TABLE warehouse_places
+                    ADD COLUMN IF NOT EXISTS mx_status VARCHAR(150)
+                """)
+        conn.commit()
+        _ensured.add("mx_status")
     except Exception as e:
         safe_rollback(conn)
         logger.warning("Не удалось добавить mx_status: %s", e)
 
+
+# Серверные PREPARE имеют смысл только на переиспользуемых соединениях пула:
+# на Vercel соединение живёт один запрос, а PgBouncer (transaction) не сохраняет сессию.
+_USE_PREPARED_STATEMENTS = not (
+    os.environ.get("VERCEL") == "1"
+    or (os.environ.get("USE_POOLED_DB") or "").strip().lower() in ("1", "true", "yes", "on")
+)
+DB_STMT_CACHE_SIZE = int(os.environ.get("DB_STMT_CACHE_SIZE", "200"))
+_PLACEHOLDER_RE = re.compile(r"%[s%]")
+# LRU имён prepared statements по соединениям. У psycopg2 connection нет __dict__
+# (атрибут не повесить), но есть weakref: запись исчезает вместе с закрытым соединением.
+_stmt_caches = weakref.WeakKeyDictionary()
+_stmt_caches_lock = threading.Lock()
+
+
+def _to_server_placeholders(sql: str) -> str:
+    """Переводит %s-плейсхолдеры psycopg2 в $1, $2, ... для PREPARE (%% оставляем для psycopg2)."""
+    counter = iter(range(1, sql.count("%s") + 1))
+    return _PLACEHOLDER_RE.sub(lambda m: "%%" if m.group() == "%%" else f"${next(counter)}", sql)
+
+
+def execute_cached(cur, sql: str, params=()):
+    """
+    Выполняет sql как серверный prepared statement: PREPARE один раз на соединение,
+    дальше только EXECUTE (без повторного parse/plan). Имена держим в LRU на соединении,
+    вытесненные освобождаем через DEALLOCATE. Без пула — обычный execute.
+    """
+    if not _USE_PREPARED_STATEMENTS:
+        cur.execute(sql, params)
+        return
+    conn = cur.connection
+    cache = _stmt_caches.get(conn)
+    if cache is None:
+        with _stmt_caches_lock:
+            cache = _stmt_caches.setdefault(conn, OrderedDict())
+    # Ключ — сам текст: у str хэш кэшируется в объекте, поэтому для модульных констант
+    # _SQL_* поиск в кэше не пересчитывает хэш; md5 считаем только при PREPARE.
+    key = sql
+    name = cache.get(key)
+    if name is None:
+        name = f"s_{hashlib.md5(sql.encode('utf-8')).hexdigest()}"
+        # PREPARE не транзакционный: после успеха имя живёт до конца сессии, даже при rollback.
+        cur.execute(f"PREPARE {name} AS {_to_server_placeholders(sql)}", ())
+        cache[key] = name
+        if len(cache) > DB_STMT_CACHE_SIZE:
+            _, evicted = cache.popitem(last=False)
+            cur.execute(f"DEALLOCATE {evicted}")
+    else:
+        cache.move_to_end(key)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
@@ -5,15 +5,31 @@ core/places.py
 """
 
 import logging
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
 
 from flask import jsonify
 import psycopg2
 
-from core.db import ensure_warehouse_places_mx_status
+from core.db import ensure_warehouse_places_mx_status, execute_cached
 
 logger = logging.getLogger(__name__)
 
+# Допустимый строковый mx_code (кириллица/латиница, цифры, точка, дефис)
+MX_CODE_INPUT_RE = re.compile(r"^[\u0410-\u042F\u0401A-Z0-9.\-]+$")
+# Кириллическая «х» в габаритах (600х400х300) -> латинская x, одним проходом
+DIM_TRANSLATE = str.maketrans({"х": "x", "Х": "x"})
+
+# Справочник МХ меняется только импортом, а сканеры многократно запрашивают одни и те же
+# места: найденные строки держим в LRU-кэше процесса (ключи ("id", mx_id) и ("code", код)).
+PLACE_CACHE_TTL_SECONDS = float(os.environ.get("PLACE_CACHE_TTL_SECONDS", "300"))
+PLACE_CACHE_MAX_SIZE = int(os.environ.get("PLACE_CACHE_MAX_SIZE", "10000"))
+_place_cache = OrderedDict()
+_place_cache_lock = threading.Lock()
+
 _SELECT_FIELDS = """
     SELECT
         wh_id,
@@ -36,6 +52,11 @@ _SELECT_FIELDS = """
     FROM warehouse_places
 """
 
+# Поиск по mx_id и точному коду — горячий путь сканера: серверные prepared statements.
+_SQL_PLACE_BY_ID = _SELECT_FIELDS + "WHERE mx_id = %s"
+# Параметр нормализуется в Python (strip + upper), со стороны БД — индекс idx_mx_code_norm.
+_SQL_PLACE_BY_CODE = _SELECT_FIELDS + "WHERE UPPER(TRIM(mx_code)) = %s::text"
+
 
 def resolve_mx_type(storage_type, box_type, dimensions, category=None):
     """Определяем тип МХ — только «Полка» или «Короб»; при неизвестном возвращаем None."""
@@ -49,7 +70,7 @@ def resolve_mx_type(storage_type, box_type, dimensions, category=None):
             return "Полка"
     if dimensions:
         try:
-            parts = str(dimensions).replace("х", "x").replace("Х", "x").split("x")
+            parts = str(dimensions).translate(DIM_TRANSLATE).split("x")
             nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
             if nums:
                 return "Полка" if max(nums) > 900 else "Короб"
@@ -77,7 +98,7 @@ def get_place_handler(place_cod, get_db_fn):
         search_by_id = False
         place_cod_int = None
         place_cod_str = place_cod.strip().upper()
-        if not re.match(r"^[\u0410-\u042F\u0401A-Z0-9.\-]+$", place_cod_str):
+        if not MX_CODE_INPUT_RE.match(place_cod_str):
             return jsonify({"error": "Некорректный формат кода МХ"}), 400
 
     try:
@@ -116,7 +137,7 @@ def get_place_handler(place_cod, get_db_fn):
                     "current_volume": float(row["current_volume"]) if row["current_volume"] else None,
                     "current_occupancy": row["current_occupancy"],
                     "mx_status": row.get("mx_status"),
-                    "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+                    "updated_at": row["updated_at"],
                     "admin_status": admin_status,
                 }
             )
@@ -132,17 +153,61 @@ def get_place_handler(place_cod, get_db_fn):
 # ──────────────────────── внутренние вспомогательные функции ────────────────────────
 
 
+def _place_cache_get(key):
+    with _place_cache_lock:
+        entry = _place_cache.get(key)
+        if entry is None:
+            return None
+        ts, row = entry
+        if time.monotonic() - ts >= PLACE_CACHE_TTL_SECONDS:
+            del _place_cache[key]
+            return None
+        _place_cache.move_to_end(key)
+        return row
+
+
+def _place_cache_put(row, *keys):
+    now = time.monotonic()
+    with _place_cache_lock:
+        for key in keys:
+            _place_cache[key] = (now, row)
+            _place_cache.move_to_end(key)
+        while len(_place_cache) > PLACE_CACHE_MAX_SIZE:
+            _place_cache.popitem(last=False)
+
+
+def fetch_place_by_id(cur, mx_id: int):
+    """Строка warehouse_places по mx_id (через кэш справочника) или None."""
+    return _fetch_place_row(cur, True, mx_id, None)
+
+
+def normalize_mx_code(code) -> str:
+    """Код МХ в форме выражения индекса idx_mx_code_norm: UPPER(TRIM(mx_code))."""
+    return str(code).strip().upper()
+
+
 def _fetch_place_row(cur, search_by_id: bool, place_cod_int, place_cod_str):
+    """Ищем место в warehouse_places (сначала в кэше); возвращаем найденную строку или None."""
+    if not search_by_id:
+        place_cod_str = normalize_mx_code(place_cod_str)
+    key = ("id", place_cod_int) if search_by_id else ("code", place_cod_str)
+    row = _place_cache_get(key)
+    if row is None:
+        row = _query_place_row(cur, search_by_id, place_cod_int, place_cod_str)
+        if row:
+            row = dict(row)
+            _place_cache_put(row, key, ("id", row["place_cod"]))
+    return row
+
+
+def _query_place_row(cur, search_by_id: bool, place_cod_int, place_cod_str):
     """Ищем место в warehouse_places; возвращаем первую найденную строку или None."""
     if search_by_id:
-        cur.execute(_SELECT_FIELDS + "WHERE mx_id = %s", (place_cod_int,))
+        execute_cached(cur, _SQL_PLACE_BY_ID, (place_cod_int,))
         return cur.fetchone()
 
     # Точное совпадение с TRIM
-    cur.execute(
-        _SELECT_FIELDS + "WHERE UPPER(TRIM(mx_code)) = UPPER(TRIM(%s))",
-        (place_cod_str,),
-    )
+    execute_cached(cur, _SQL_PLACE_BY_CODE, (place_cod_str,))
     row = cur.fetchone()
     if row:
         return row
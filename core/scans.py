@@ -5,42 +5,101 @@ core/scans.py
 
 import base64
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import psycopg2
 from flask import jsonify, request
+from psycopg2.extras import execute_values
 
-from core.db import ensure_shift_start_table, safe_rollback
+from core.db import ensure_shift_start_table, execute_cached, safe_rollback
+from core.places import fetch_place_by_id
 
 logger = logging.getLogger(__name__)
 
+# Декодирование base64 (binascii) и сжатие Pillow отпускают GIL на больших данных —
+# фото скана и миниатюры для xlsx-отчётов обрабатываем параллельно в общем пуле.
+PHOTO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="photo")
+
+
+# Запросы каждого скана — серверные prepared statements (execute_cached): parse/plan один раз
+# на соединение пула. Фиксация начала смены и поиск дубликата — одним запросом: основной SELECT
+# не видит строку, вставленную в CTE, поэтому начало смены берём из RETURNING или из таблицы.
+_SQL_SHIFT_DUPLICATE = """
+    WITH new_shift AS (
+        INSERT INTO shift_start (badge, started_at)
+        SELECT %s::text, COALESCE(
+            (SELECT MIN(created_at) FROM inventory_results WHERE badge = %s),
+            NOW()
+        )
+        ON CONFLICT (badge) DO NOTHING
+        RETURNING started_at
+    )
+    SELECT 1 FROM inventory_results ir
+    WHERE ir.badge = %s AND ir.place_cod = %s
+      AND ir.created_at >= COALESCE(
+          (SELECT started_at FROM new_shift),
+          (SELECT started_at FROM shift_start WHERE shift_start.badge = %s)
+      )
+    LIMIT 1
+"""
+
+_SQL_INSERT_RESULT = """
+    INSERT INTO inventory_results
+    (badge, place_cod, place_name, qty_shk_db, qty_shk_fact, status, has_discrepancy,
+     photo_data, photo_filename, discrepancy_reason, comment, duplicate_floor_num, duplicate_row_num, duplicate_shelf_num)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING result_id, created_at
+"""
+
+
+def _split_photo(photo_str: str):
+    """Разделяет data URL на (header, base64-часть)."""
+    if "," in photo_str:
+        return photo_str.split(",", 1)
+    return "", photo_str
+
+
+def _b64decode_safe(encoded: str):
+    try:
+        return base64.b64decode(encoded)
+    except Exception as exc:
+        return exc
+
 
 def _decode_photos(photos_list, single_photo, place_cod):
     """
     Декодирует список base64-фото (или одиночное фото для обратной совместимости).
     Возвращает [(bytes, filename), ...].
     """
-    decoded = []
-
-    def _decode_one(photo_str: str, index: int):
-        if not photo_str:
-            return
-        try:
-            if "," in photo_str:
-                header, encoded = photo_str.split(",", 1)
-            else:
-                header, encoded = "", photo_str
-            raw = base64.b64decode(encoded)
-            ext = "png" if "png" in header else "jpg"
-            decoded.append((raw, f"{place_cod}_{index + 1}.{ext}"))
-        except Exception as exc:
-            logger.error("Ошибка декодирования фото #%s: %s", index + 1, exc)
-
     if isinstance(photos_list, list) and photos_list:
-        for idx, p in enumerate(photos_list):
-            _decode_one(p, idx)
+        sources = list(enumerate(photos_list))
     elif single_photo:
-        _decode_one(single_photo, 0)
+        sources = [(0, single_photo)]
+    else:
+        return []
+
+    split_photos = []
+    for idx, p in sources:
+        if not p:
+            continue
+        # Тело запроса — произвольный JSON: число/объект вместо строки пропускаем, как битое фото.
+        if not isinstance(p, str):
+            logger.error("Ошибка декодирования фото #%s: ожидалась строка, получен %s", idx + 1, type(p).__name__)
+            continue
+        split_photos.append((idx, _split_photo(p)))
+    encoded_list = [encoded for _, (_, encoded) in split_photos]
+    if len(encoded_list) > 1:
+        raw_list = list(PHOTO_POOL.map(_b64decode_safe, encoded_list))
+    else:
+        raw_list = [_b64decode_safe(encoded) for encoded in encoded_list]
 
+    decoded = []
+    for (idx, (header, _)), raw in zip(split_photos, raw_list):
+        if isinstance(raw, Exception):
+            logger.error("Ошибка декодирования фото #%s: %s", idx + 1, raw)
+            continue
+        ext = "png" if "png" in header else "jpg"
+        decoded.append((raw, f"{place_cod}_{idx + 1}.{ext}"))
     return decoded
 
 
@@ -102,12 +161,8 @@ def complete_scan_handler(get_db_fn, badge_override=None):
     try:
         conn = get_db_fn()
         with conn.cursor() as cur:
-            # Получаем название места из справочника
-            cur.execute(
-                "SELECT mx_code AS place_name, 0 AS qty_shk FROM warehouse_places WHERE mx_id = %s",
-                (place_cod_int,),
-            )
-            place_row = cur.fetchone()
+            # Получаем название места из справочника (кэш процесса)
+            place_row = fetch_place_by_id(cur, place_cod_int)
 
             # Канонизируем статус, чтобы "OK"/" ok "/etc. не ломали логику расхождений.
             status = status_norm
@@ -128,26 +183,8 @@ def complete_scan_handler(get_db_fn, badge_override=None):
 
             # Проверка дубликата в рамках текущей смены
             ensure_shift_start_table(conn)
-            cur.execute(
-                """
-                INSERT INTO shift_start (badge, started_at)
-                SELECT %s, COALESCE(
-                    (SELECT MIN(created_at) FROM inventory_results WHERE badge = %s),
-                    NOW()
-                )
-                ON CONFLICT (badge) DO NOTHING
-                """,
-                (badge, badge),
-            )
-            cur.execute(
-                """
-                SELECT 1 FROM inventory_results ir
-                WHERE ir.badge = %s AND ir.place_cod = %s
-                  AND ir.created_at >= (SELECT started_at FROM shift_start WHERE shift_start.badge = %s)
-                LIMIT 1
-                """,
-                (badge, place_cod_int, badge),
-            )
+            # Фиксация начала смены и поиск дубликата — одним запросом
+            execute_cached(cur, _SQL_SHIFT_DUPLICATE, (badge, badge, badge, place_cod_int, badge))
             if cur.fetchone():
                 if force_duplicate:
                     if duplicate_floor_int is None or duplicate_row_int is None or duplicate_shelf_int is None:
@@ -177,14 +214,9 @@ def complete_scan_handler(get_db_fn, badge_override=None):
                     ), 409
 
             # Сохраняем результат
-            cur.execute(
-                """
-                INSERT INTO inventory_results
-                (badge, place_cod, place_name, qty_shk_db, qty_shk_fact, status, has_discrepancy,
-                 photo_data, photo_filename, discrepancy_reason, comment, duplicate_floor_num, duplicate_row_num, duplicate_shelf_num)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING result_id, created_at
-                """,
+            execute_cached(
+                cur,
+                _SQL_INSERT_RESULT,
                 (
                     badge,
                     place_cod_int,
@@ -204,15 +236,20 @@ def complete_scan_handler(get_db_fn, badge_override=None):
             )
             inserted = cur.fetchone()
 
-            # Сохраняем все фото отдельной таблицей
-            for raw, fname in decoded_photos:
-                cur.execute(
+            # Сохраняем все фото отдельной таблицей — одним INSERT на все фото
+            if decoded_photos:
+                execute_values(
+                    cur,
                     """
                     INSERT INTO inventory_result_photos
                     (result_id, badge, place_cod, photo_data, photo_filename)
-                    VALUES (%s, %s, %s, %s, %s)
+                    VALUES %s
                     """,
-                    (inserted["result_id"], badge, place_cod_int, psycopg2.Binary(raw), fname),
+                    [
+                        (inserted["result_id"], badge, place_cod_int, psycopg2.Binary(raw), fname)
+                        for raw, fname in decoded_photos
+                    ],
+                    page_size=100,
                 )
 
             conn.commit()
@@ -235,9 +272,7 @@ def complete_scan_handler(get_db_fn, badge_override=None):
                     "duplicate_row_num": duplicate_row_int if force_duplicate else None,
                     "duplicate_shelf_num": duplicate_shelf_int if force_duplicate else None,
                     "comment": comment,
-                    "created_at": inserted["created_at"].isoformat()
-                    if inserted and inserted["created_at"]
-                    else None,
+                    "created_at": inserted["created_at"],
                 },
             }
         )
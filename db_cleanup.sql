@@ -30,23 +30,44 @@ WHERE created_at < NOW() - INTERVAL '60 days';
 -- DELETE FROM inventory_results
 -- WHERE created_at < NOW() - INTERVAL '180 days';
 
--- 6. Составной индекс (если ещё не создан)
-CREATE INDEX IF NOT EXISTS idx_inventory_results_badge_date
-    ON inventory_results(badge, created_at DESC);
+COMMIT;
+
+-- Индексы строятся CONCURRENTLY: запись сканов не блокируется, но такие команды не работают
+-- внутри BEGIN/COMMIT. Если сборка прервалась, остаётся INVALID-индекс:
+-- DROP INDEX CONCURRENTLY <имя> и запустить скрипт заново.
 
--- 7. Функциональный индекс под поиск по mx_code (UPPER TRIM)
-CREATE INDEX IF NOT EXISTS idx_mx_code_norm
+-- 6. Покрывающий индекс по сотруднику: WHERE badge=? ORDER BY created_at DESC — index-only scan.
+--    Старые индексы удаляем только после готового нового.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ir_badge_created
+    ON inventory_results(badge, created_at DESC)
+    INCLUDE (has_discrepancy, place_cod, place_name, status, photo_filename);
+DROP INDEX CONCURRENTLY IF EXISTS idx_inventory_results_badge;
+DROP INDEX CONCURRENTLY IF EXISTS idx_inventory_results_badge_date;
+--    Выгрузка "не ok" сканов сотрудника (export_user_history).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ir_badge_not_ok_created
+    ON inventory_results(badge, created_at DESC)
+    WHERE has_discrepancy = TRUE OR LOWER(COALESCE(status, '')) <> 'ok';
+
+-- 7. Функциональный индекс под поиск по mx_code (UPPER TRIM): join wp2 в экспортах, get_place по коду
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mx_code_norm
     ON warehouse_places ((UPPER(TRIM(mx_code))));
 
-COMMIT;
+-- 8. Частичный индекс по времени вместо индекса по одному boolean (почти не отсекал строк):
+--    причины расхождений за период (аналитика) и последние МХ с расхождениями (подсказки)
+--    читаются index-only scan.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ir_discrepancy_created
+    ON inventory_results(created_at DESC)
+    INCLUDE (place_name, discrepancy_reason)
+    WHERE has_discrepancy;
+DROP INDEX CONCURRENTLY IF EXISTS idx_inventory_results_discrepancy;
 
--- 8. Обновить статистику планировщика
+-- 9. Обновить статистику планировщика
 ANALYZE inventory_results;
 ANALYZE inventory_result_photos;
 ANALYZE reports;
 ANALYZE warehouse_places;
 
--- 9. VACUUM: освободить физическое место после массового DELETE/UPDATE
+-- 10. VACUUM: освободить физическое место после массового DELETE/UPDATE
 --    VACUUM FULL берёт эксклюзивную блокировку — запускать в окно обслуживания!
 VACUUM (ANALYZE) inventory_results;
 VACUUM (ANALYZE) inventory_result_photos;
@@ -1,23 +1,26 @@
 """
 ОСНОВНОЙ скрипт загрузки МХ в БД.
-Читает все ZIP-архивы из папки (по умолчанию archives/), распаковывает и загружает CSV в БД.
+Читает все ZIP-архивы из папки (по умолчанию archives/) и загружает CSV в БД прямо из архивов.
 
 Файл "Вместимость и заполненность" НЕ требуется.
 При скане пользователю отображаются: этаж, ряд, секция.
 """
 
+import io
 import os
+import queue
 import zipfile
 import csv
 import re
 import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Generator, List, Optional
+from typing import Dict, Generator, List, NamedTuple, Optional, Tuple
 import psycopg2
 
 from dotenv import load_dotenv
 load_dotenv()
-from psycopg2.extras import execute_values
 import logging
 
 # Настройка логирования
@@ -32,8 +35,72 @@ ARCHIVES_DIR = Path("archives")
 
 # Размер чанка для потоковой загрузки: читаем CSV и вставляем в БД пачками
 BATCH_SIZE = 50_000
-# Размер пачки в одном INSERT (execute_values) — больше = меньше круг-трипов к БД
-INSERT_PAGE_SIZE = 15_000
+# Сколько готовых пачек читатель CSV может держать впереди загрузки в БД (память ~ N * BATCH_SIZE).
+PREFETCH_BATCHES = 4
+
+# Регулярки горячего пути разбора строки — компилируются один раз.
+_DIGITS_RE = re.compile(r'\d+')
+_NON_DIGITS_RE = re.compile(r'\D+')
+
+# Колонки warehouse_places, которые заполняет импорт. Запись — кортеж в этом же порядке
+# (он же порядок полей COPY): без dict на строку и перекладывания перед загрузкой.
+PLACE_COLUMNS = (
+    'mx_id', 'mx_code', 'floor', 'row_num', 'section', 'shelf', 'cell',
+    'storage_type',
+    'wh_id', 'warehouse_name', 'box_type', 'current_volume', 'current_occupancy',
+    'mx_status',
+)
+_COLUMNS_SQL = ", ".join(PLACE_COLUMNS)
+
+# Пачка идёт COPY во временную таблицу (без разбора INSERT на каждую строку), затем
+# одним INSERT ... SELECT сливается в warehouse_places. seq — порядок строк в пачке:
+# при повторе mx_id побеждает последняя строка, как при построчной вставке.
+# Неизменившиеся места не переписываются: без новой версии строки, записи в WAL и индексы
+# (повторный импорт того же архива почти ничего не пишет), и updated_at/версия справочника
+# для клиентов сдвигаются только при реальных изменениях.
+_SQL_CREATE_STAGE = f"""
+    CREATE TEMP TABLE IF NOT EXISTS warehouse_places_stage AS
+    SELECT {_COLUMNS_SQL} FROM warehouse_places WITH NO DATA;
+    ALTER TABLE warehouse_places_stage ADD COLUMN IF NOT EXISTS seq BIGINT GENERATED ALWAYS AS IDENTITY
+"""
+_SQL_COPY_STAGE = f"COPY warehouse_places_stage ({_COLUMNS_SQL}) FROM STDIN WITH (FORMAT CSV)"
+# UPSERT из stage готовится один раз на соединение (PREPARE) — пачки его только исполняют.
+_SQL_PREPARE_MERGE = f"""
+    PREPARE merge_stage AS
+    INSERT INTO warehouse_places ({_COLUMNS_SQL})
+    SELECT DISTINCT ON (mx_id) {_COLUMNS_SQL}
+    FROM warehouse_places_stage
+    ORDER BY mx_id, seq DESC
+    ON CONFLICT (mx_id) DO UPDATE SET
+        mx_code = EXCLUDED.mx_code,
+        floor = EXCLUDED.floor,
+        row_num = EXCLUDED.row_num,
+        section = EXCLUDED.section,
+        shelf = EXCLUDED.shelf,
+        cell = EXCLUDED.cell,
+        storage_type = EXCLUDED.storage_type,
+        wh_id = EXCLUDED.wh_id,
+        warehouse_name = EXCLUDED.warehouse_name,
+        box_type = EXCLUDED.box_type,
+        current_volume = EXCLUDED.current_volume,
+        current_occupancy = EXCLUDED.current_occupancy,
+        mx_status = EXCLUDED.mx_status,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE (
+        warehouse_places.mx_code, warehouse_places.floor, warehouse_places.row_num,
+        warehouse_places.section, warehouse_places.shelf, warehouse_places.cell,
+        warehouse_places.storage_type,
+        warehouse_places.wh_id, warehouse_places.warehouse_name, warehouse_places.box_type,
+        warehouse_places.current_volume, warehouse_places.current_occupancy, warehouse_places.mx_status
+    ) IS DISTINCT FROM (
+        EXCLUDED.mx_code, EXCLUDED.floor, EXCLUDED.row_num,
+        EXCLUDED.section, EXCLUDED.shelf, EXCLUDED.cell,
+        EXCLUDED.storage_type,
+        EXCLUDED.wh_id, EXCLUDED.warehouse_name, EXCLUDED.box_type,
+        EXCLUDED.current_volume, EXCLUDED.current_occupancy, EXCLUDED.mx_status
+    )
+"""
+_SQL_MERGE_STAGE = "EXECUTE merge_stage; TRUNCATE warehouse_places_stage"
 
 # Конфигурация БД (из .env или переменных окружения)
 DB_CONFIG = {
@@ -45,44 +112,50 @@ DB_CONFIG = {
 }
 
 
-def extract_zip_files(archives_dir: Optional[Path] = None) -> List[Path]:
+def find_csv_in_archives(archives_dir: Optional[Path] = None) -> List[Tuple[Path, str]]:
     """
-    Распаковать все ZIP-архивы из папки и вернуть список путей к CSV.
-    Каждый архив распаковывается в свою подпапку temp_extracted/<имя_архива>/.
+    Найти CSV во всех ZIP-архивах папки: список (архив, имя файла внутри архива).
+    На диск ничего не распаковывается — CSV потом читается потоком прямо из архива.
     """
     archives_dir = archives_dir or ARCHIVES_DIR
     if not archives_dir.is_dir():
         logger.error("Папка с архивами не найдена: %s. Создайте папку и положите туда ZIP-файлы.", archives_dir.resolve())
         return []
 
-    zip_files = sorted(archives_dir.glob("*.zip"))
+    with os.scandir(archives_dir) as entries:
+        zip_files = sorted(Path(e.path) for e in entries if e.name.endswith(".zip") and e.is_file())
     if not zip_files:
         logger.error("В папке %s нет ZIP-файлов!", archives_dir.resolve())
         return []
 
     logger.info("Найдено архивов: %s", len(zip_files))
-    extract_base = Path("temp_extracted")
-    extract_base.mkdir(exist_ok=True)
-    all_csv: List[Path] = []
+    all_csv: List[Tuple[Path, str]] = []
 
     for zip_path in zip_files:
-        extract_dir = extract_base / zip_path.stem
-        extract_dir.mkdir(exist_ok=True)
-        logger.info("Распаковка %s ...", zip_path.name)
         try:
             with zipfile.ZipFile(zip_path, "r") as zf:
-                zf.extractall(extract_dir)
+                members = [
+                    info.filename for info in zf.infolist()
+                    if not info.is_dir() and info.filename.endswith(".csv")
+                ]
         except zipfile.BadZipFile as e:
             logger.warning("Пропуск архива %s: %s", zip_path.name, e)
             continue
-        csv_in_archive = list(extract_dir.glob("**/*.csv"))
-        all_csv.extend(csv_in_archive)
-        logger.info("  CSV в архиве: %s", len(csv_in_archive))
+        all_csv.extend((zip_path, member) for member in members)
+        logger.info("  CSV в архиве %s: %s", zip_path.name, len(members))
 
     logger.info("Всего CSV файлов для обработки: %s", len(all_csv))
     return all_csv
 
 
+@contextmanager
+def open_csv_in_archive(zip_path: Path, member: str, encoding: str = 'cp1251'):
+    """Текстовый поток CSV из архива: распаковка идёт по ходу чтения, без временного файла."""
+    with zipfile.ZipFile(zip_path, "r") as zf, zf.open(member) as raw:
+        with io.TextIOWrapper(raw, encoding=encoding, newline='') as f:
+            yield f
+
+
 def parse_mx_code(mx_code: str) -> Dict[str, Optional[int]]:
     """
     Парсинг кода МХ формата: Ц6.06.01.02.01.01
@@ -110,10 +183,9 @@ def parse_mx_code(mx_code: str) -> Dict[str, Optional[int]]:
     try:
         # Первая часть может быть "Ц6", "36" и т.д. - оставляем как строку
         if len(parts) >= 1:
-            # Извлекаем только цифры из первой части
+            # Извлекаем только цифры из первой части ("36" — как есть, "Ц6" — без букв)
             code_str = parts[0]
-            # Извлекаем цифры
-            digits = ''.join(filter(str.isdigit, code_str))
+            digits = code_str if code_str.isdecimal() else _NON_DIGITS_RE.sub('', code_str)
             if digits:
                 result['code'] = int(digits)
         
@@ -135,9 +207,75 @@ def parse_mx_code(mx_code: str) -> Dict[str, Optional[int]]:
     return result
 
 
-def process_csv_row(row: Dict) -> Optional[Dict]:
+class CsvColumns(NamedTuple):
+    """Позиции колонок CSV (из заголовка); отсутствующей колонке соответствует _MISSING."""
+    mx_id: int
+    mx_code: int
+    wh_id: int
+    floor: int
+    row_num: int
+    section: int
+    shelf: int
+    cell: int
+    box_type: int
+    current_volume: int
+    current_occupancy: int
+    block: int
+    warehouse: int
+    mx_status: int
+    status: int
+
+
+# Индекс отсутствующей колонки: всегда >= len(row), поэтому значение — ''.
+_MISSING = sys.maxsize
+
+_CSV_COLUMN_NAMES = CsvColumns(
+    mx_id='Id МХ',
+    mx_code='Наименование МХ',
+    wh_id='WH ID',
+    floor='Этаж',
+    row_num='Ряд',
+    section='Секция',
+    shelf='Номер полки',
+    cell='Номер ячейки',
+    box_type='Короба МХ',
+    current_volume='Текущий объем МХ',
+    current_occupancy='Текущая заполненая вместимость МХ МХ ячейки',
+    block='Блок',
+    warehouse='Склад',
+    mx_status='Статус МХ',
+    status='Статус',
+)
+
+
+def csv_columns(header: List[str]) -> CsvColumns:
+    """Один раз на файл: имя колонки -> позиция, чтобы строки читать по индексу, без dict на строку."""
+    idx = {name: i for i, name in enumerate(header)}
+    return CsvColumns(*(idx.get(name, _MISSING) for name in _CSV_COLUMN_NAMES))
+
+
+def _safe_int(value):
+    if value == '' or value is None:
+        return None
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def _safe_float(value):
+    if value == '' or value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def process_csv_row(row: List[str], cols: CsvColumns) -> Optional[tuple]:
     """
-    Обработка строки CSV и преобразование в формат для БД.
+    Обработка строки CSV (csv.reader, позиции колонок — из csv_columns) и преобразование
+    в кортеж значений warehouse_places в порядке PLACE_COLUMNS.
     
     Входные колонки CSV:
     - Id МХ
@@ -155,86 +293,74 @@ def process_csv_row(row: Dict) -> Optional[Dict]:
     - Стат код локации
     - Статус МХ (Активно, есть товары / Активно, нет товаров)
     """
-    try:
-        mx_id = int(row.get('Id МХ', 0))
-        mx_code = row.get('Наименование МХ', '').strip()
-        
-        if not mx_id or not mx_code:
-            return None
-        
-        # Парсим компоненты из mx_code
-        parsed = parse_mx_code(mx_code)
-        
-        # Используем данные из CSV, если они есть
-        wh_id = int(row.get('WH ID', 0)) if row.get('WH ID') else None
-        
-        # Извлекаем floor из столбца, если есть
-        floor_from_csv = None
-        etaj = row.get('Этаж', '')
-        if etaj and isinstance(etaj, str):
-            # Извлекаем число из строки типа "Центртерминал 6"
-            match = re.search(r'\d+', etaj)
-            if match:
-                floor_from_csv = int(match.group())
-        
-        # Преобразуем числовые поля
-        def safe_int(value):
-            if value == '' or value is None:
-                return None
-            try:
-                return int(float(value))
-            except (ValueError, TypeError):
-                return None
-        
-        def safe_float(value):
-            if value == '' or value is None:
-                return None
-            try:
-                return float(value)
-            except (ValueError, TypeError):
-                return None
-        
-        row_num = safe_int(row.get('Ряд'))
-        section = safe_int(row.get('Секция'))
-        shelf = safe_int(row.get('Номер полки'))
-        cell = safe_int(row.get('Номер ячейки'))
-        
-        # Формируем запись
-        record = {
-            'mx_id': mx_id,
-            'mx_code': mx_code,
-            'floor': floor_from_csv or parsed['floor'],
-            'row_num': row_num or parsed['row_num'],
-            'section': section or parsed['section'],
-            'shelf': shelf or parsed['shelf'],
-            'cell': cell or parsed['cell'],
-            'storage_type': row.get('Короба МХ', '').strip() or None,
-            'category': None,  # Нужно извлечь из других данных
-            'dimensions': None,  # Нужно извлечь из других данных
-            'wh_id': wh_id,
-            # Название склада: приоритет «Блок» / «Склад» (например «Электросталь 6»), иначе «Этаж»
-            'warehouse_name': (row.get('Блок', '') or row.get('Склад', '') or row.get('Этаж', '')).strip() or None,
-            'box_type': row.get('Короба МХ', '').strip() or None,
-            'current_volume': safe_float(row.get('Текущий объем МХ')),
-            'current_occupancy': row.get('Текущая заполненая вместимость МХ МХ ячейки', '').strip() or None,
-            'mx_status': (row.get('Статус МХ') or row.get('Статус') or '').strip() or None,
-        }
-        
-        return record
-    
-    except Exception as e:
-        logger.error(f"Ошибка обработки строки: {e}, данные: {row}")
+    # Без try/except на каждую строку: числа проверяем явно, битые значения — через _safe_*.
+    n = len(row)
+    mx_id_raw = (row[cols.mx_id] if cols.mx_id < n else '').strip()
+    mx_code = (row[cols.mx_code] if cols.mx_code < n else '').strip()
+    wh_id_raw = (row[cols.wh_id] if cols.wh_id < n else '').strip()
+    if not mx_id_raw.isdecimal() or (wh_id_raw and not wh_id_raw.isdecimal()):
+        if mx_id_raw or wh_id_raw:
+            logger.error(f"Ошибка обработки строки: некорректный Id МХ/WH ID, данные: {row}")
         return None
+    mx_id = int(mx_id_raw)
+    if not mx_id or not mx_code:
+        return None
+    
+    # Парсим компоненты из mx_code
+    parsed = parse_mx_code(mx_code)
+    
+    # Используем данные из CSV, если они есть
+    wh_id = int(wh_id_raw) if wh_id_raw else None
+    
+    # Извлекаем floor из столбца, если есть
+    floor_from_csv = None
+    etaj = row[cols.floor] if cols.floor < n else ''
+    if etaj:
+        # Извлекаем число из строки типа "Центртерминал 6"
+        match = _DIGITS_RE.search(etaj)
+        if match:
+            floor_from_csv = int(match.group())
+    
+    row_num = _safe_int(row[cols.row_num] if cols.row_num < n else '')
+    section = _safe_int(row[cols.section] if cols.section < n else '')
+    shelf = _safe_int(row[cols.shelf] if cols.shelf < n else '')
+    cell = _safe_int(row[cols.cell] if cols.cell < n else '')
+    box_type = (row[cols.box_type] if cols.box_type < n else '').strip() or None
+    block = row[cols.block] if cols.block < n else ''
+    warehouse = row[cols.warehouse] if cols.warehouse < n else ''
+    mx_status = (row[cols.mx_status] if cols.mx_status < n else '') or (row[cols.status] if cols.status < n else '')
+    
+    # Формируем запись (порядок — PLACE_COLUMNS)
+    return (
+        mx_id,
+        mx_code,
+        floor_from_csv or parsed['floor'],
+        row_num or parsed['row_num'],
+        section or parsed['section'],
+        shelf or parsed['shelf'],
+        cell or parsed['cell'],
+        box_type,  # storage_type
+        wh_id,
+        # Название склада: приоритет «Блок» / «Склад» (например «Электросталь 6»), иначе «Этаж»
+        (block or warehouse or etaj).strip() or None,
+        box_type,
+        _safe_float(row[cols.current_volume] if cols.current_volume < n else ''),
+        (row[cols.current_occupancy] if cols.current_occupancy < n else '').strip() or None,
+        mx_status.strip() or None,
+    )
 
 
-def read_csv_with_encoding(file_path: Path, encoding: str = 'cp1251') -> List[Dict]:
+def read_csv_with_encoding(file_path: Path, encoding: str = 'cp1251') -> List[tuple]:
     """Чтение CSV файла с указанной кодировкой (все записи в память)."""
     records = []
     try:
-        with open(file_path, 'r', encoding=encoding) as f:
-            reader = csv.DictReader(f, delimiter=';')
+        with open(file_path, 'r', encoding=encoding, newline='') as f:
+            reader = csv.reader(f, delimiter=';')
+            cols = csv_columns(next(reader, []))
             for row in reader:
-                record = process_csv_row(row)
+                if not row:
+                    continue
+                record = process_csv_row(row, cols)
                 if record:
                     records.append(record)
         logger.info(f"Обработано {len(records)} записей из {file_path.name}")
@@ -244,86 +370,116 @@ def read_csv_with_encoding(file_path: Path, encoding: str = 'cp1251') -> List[Di
 
 
 def read_csv_stream(
-    file_path: Path,
+    zip_path: Path,
+    member: str,
     batch_size: int = BATCH_SIZE,
     encoding: str = 'cp1251',
-) -> Generator[List[Dict], None, None]:
+) -> Generator[List[tuple], None, None]:
     """
-    Потоковое чтение CSV: выдаёт чанки записей по batch_size.
-    Не держит весь файл в памяти.
+    Потоковое чтение CSV member из архива zip_path: выдаёт чанки записей по batch_size.
+    Не держит весь файл в памяти и не распаковывает его на диск.
     """
-    batch: List[Dict] = []
+    batch: List[tuple] = []
     rows_read = 0
+    name = Path(member).name
     try:
-        with open(file_path, 'r', encoding=encoding) as f:
-            reader = csv.DictReader(f, delimiter=';')
+        with open_csv_in_archive(zip_path, member, encoding) as f:
+            reader = csv.reader(f, delimiter=';')
+            cols = csv_columns(next(reader, []))
             for row in reader:
+                if not row:
+                    continue
                 rows_read += 1
-                record = process_csv_row(row)
+                record = process_csv_row(row, cols)
                 if record:
                     batch.append(record)
                     if len(batch) >= batch_size:
                         if rows_read % 100_000 == 0 or rows_read <= batch_size:
-                            logger.info(f"  {file_path.name}: прочитано {rows_read} строк...")
+                            logger.info(f"  {name}: прочитано {rows_read} строк...")
                         yield batch
                         batch = []
         if batch:
             yield batch
-        logger.info(f"  {file_path.name}: прочитано {rows_read} строк")
+        logger.info(f"  {name}: прочитано {rows_read} строк")
     except Exception as e:
-        logger.error(f"Ошибка чтения файла {file_path.name}: {e}")
+        logger.error(f"Ошибка чтения файла {name}: {e}")
         if batch:
             yield batch
 
 
+def iter_csv_batches(csv_files: List[Tuple[Path, str]]) -> Generator[List[tuple], None, None]:
+    """Пачки записей из всех CSV подряд (в порядке архивов и файлов в них)."""
+    for zip_path, member in csv_files:
+        logger.info("Обработка файла: %s (%s)", member, zip_path.name)
+        yield from read_csv_stream(zip_path, member, batch_size=BATCH_SIZE)
+
+
+def prefetch(iterable, maxsize: int = PREFETCH_BATCHES):
+    """
+    Итерирует iterable в фоновом потоке через очередь на maxsize элементов: следующая пачка
+    разбирается, пока БД принимает предыдущую (psycopg2 отпускает GIL на время запроса).
+    Ошибка потока-читателя пробрасывается потребителю.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                q.put((True, item))
+                if stop.is_set():
+                    return
+        except Exception as e:
+            q.put((False, e))
+            return
+        q.put((False, None))
+
+    thread = threading.Thread(target=produce, name="csv-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        # Потребитель вышел раньше (ошибка БД) — освобождаем очередь, чтобы читатель не завис на put().
+        while thread.is_alive():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def prepare_stage(cur) -> None:
+    """Один раз на соединение: временная warehouse_places_stage и подготовленный UPSERT из неё."""
+    cur.execute(_SQL_CREATE_STAGE + ";" + _SQL_PREPARE_MERGE)
+
+
 def insert_batch(
-    conn,
-    records: List[Dict],
-    page_size: int = INSERT_PAGE_SIZE,
+    cur,
+    records: List[tuple],
     commit_after: bool = False,
 ) -> int:
-    """Вставка одной пачки записей в БД. Если commit_after=False, коммит не делается (одна транзакция на всю загрузку — быстрее)."""
+    """
+    Вставка одной пачки записей в БД: COPY во временную warehouse_places_stage и один UPSERT из неё.
+    cur — общий курсор загрузки, на соединении которого уже вызван prepare_stage.
+    Если commit_after=False, коммит не делается (одна транзакция на всю загрузку — быстрее).
+    """
     if not records:
         return 0
-    insert_query = """
-        INSERT INTO warehouse_places (
-            mx_id, mx_code, floor, row_num, section, shelf, cell,
-            storage_type, category, dimensions,
-            wh_id, warehouse_name, box_type, current_volume, current_occupancy,
-            mx_status
-        ) VALUES %s
-        ON CONFLICT (mx_id) DO UPDATE SET
-            mx_code = EXCLUDED.mx_code,
-            floor = EXCLUDED.floor,
-            row_num = EXCLUDED.row_num,
-            section = EXCLUDED.section,
-            shelf = EXCLUDED.shelf,
-            cell = EXCLUDED.cell,
-            storage_type = EXCLUDED.storage_type,
-            category = EXCLUDED.category,
-            dimensions = EXCLUDED.dimensions,
-            wh_id = EXCLUDED.wh_id,
-            warehouse_name = EXCLUDED.warehouse_name,
-            box_type = EXCLUDED.box_type,
-            current_volume = EXCLUDED.current_volume,
-            current_occupancy = EXCLUDED.current_occupancy,
-            mx_status = EXCLUDED.mx_status,
-            updated_at = CURRENT_TIMESTAMP
-    """
-    values = [
-        (
-            r['mx_id'], r['mx_code'], r['floor'], r['row_num'],
-            r['section'], r['shelf'], r['cell'],
-            r['storage_type'], r['category'], r['dimensions'],
-            r['wh_id'], r['warehouse_name'], r['box_type'], r['current_volume'],
-            r['current_occupancy'], r.get('mx_status'),
-        )
-        for r in records
-    ]
-    with conn.cursor() as cur:
-        execute_values(cur, insert_query, values, page_size=page_size)
+    # CSV для COPY: None пишется пустым полем без кавычек — это NULL в формате CSV.
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(records)
+    buf.seek(0)
+    cur.copy_expert(_SQL_COPY_STAGE, buf)
+    cur.execute(_SQL_MERGE_STAGE)
     if commit_after:
-        conn.commit()
+        cur.connection.commit()
     return len(records)
 
 
@@ -338,8 +494,8 @@ def main():
     logger.info("НАЧАЛО МИГРАЦИИ ДАННЫХ МХ")
     logger.info("="*80)
 
-    # 1. Распаковка всех ZIP из папки и поиск CSV файлов
-    csv_files = extract_zip_files(archives_dir)
+    # 1. Поиск CSV файлов во всех ZIP из папки (читаются потом прямо из архивов)
+    csv_files = find_csv_in_archives(archives_dir)
     if not csv_files:
         logger.error("CSV файлы не найдены!")
         return
@@ -349,16 +505,22 @@ def main():
     conn = psycopg2.connect(**DB_CONFIG)
     
     try:
-        # Колонка «Статус МХ» (Активно, есть/нет товаров) — создаём при отсутствии
+        # Колонка «Статус МХ» (Активно, есть/нет товаров) — создаём при отсутствии.
+        # ALTER берёт ACCESS EXCLUSIVE даже при IF NOT EXISTS — без нужды не блокируем приложение.
         with conn.cursor() as cur:
-            cur.execute("ALTER TABLE warehouse_places ADD COLUMN IF NOT EXISTS mx_status VARCHAR(150)")
+            cur.execute(
+                "SELECT 1 FROM pg_attribute WHERE attrelid = 'warehouse_places'::regclass"
+                " AND attname = 'mx_status' AND NOT attisdropped"
+            )
+            if cur.fetchone() is None:
+                cur.execute("ALTER TABLE warehouse_places ADD COLUMN IF NOT EXISTS mx_status VARCHAR(150)")
         conn.commit()
         # Одна транзакция на всю загрузку (без commit после каждой пачки) — сильно ускоряет.
         total_inserted = 0
-        for csv_file in csv_files:
-            logger.info("Обработка файла: %s", csv_file.name)
-            for batch in read_csv_stream(csv_file, batch_size=BATCH_SIZE):
-                n = insert_batch(conn, batch, commit_after=False)
+        with conn.cursor() as cur:
+            prepare_stage(cur)
+            for batch in prefetch(iter_csv_batches(csv_files)):
+                n = insert_batch(cur, batch, commit_after=False)
                 total_inserted += n
                 if total_inserted % 100_000 == 0 and total_inserted > 0:
                     logger.info("  В БД загружено записей: %s", total_inserted)
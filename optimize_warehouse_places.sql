@@ -44,6 +44,11 @@ CREATE INDEX IF NOT EXISTS idx_mx_code_norm
 CREATE INDEX IF NOT EXISTS idx_warehouse_places_wh_id_mx_id
     ON warehouse_places (wh_id, mx_id);
 
+-- Выбор мест зоны задания (первые 9 символов mx_code) по равенству префикса:
+CREATE INDEX IF NOT EXISTS idx_warehouse_places_zone_prefix
+    ON warehouse_places ((SUBSTRING(mx_code, 1, 9)), mx_code)
+    WHERE mx_code IS NOT NULL AND mx_code != '';
+
 -- Для быстрой сортировки/выборок по обновлённым записям:
 CREATE INDEX IF NOT EXISTS idx_warehouse_places_updated_at
     ON warehouse_places (updated_at DESC);
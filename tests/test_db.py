@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+import psycopg2.extensions
+
+from core import db
+
+
+class _Conn:
+    """Как psycopg2 connection: без __dict__, но поддерживает weakref."""
+    __slots__ = ("__weakref__",)
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+class ExecuteCachedTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db, "_USE_PREPARED_STATEMENTS", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_real_connection_has_no_dict(self):
+        # Если это изменится, проверка ниже перестанет моделировать psycopg2.
+        self.assertEqual(psycopg2.extensions.connection.__dictoffset__, 0)
+        self.assertNotEqual(psycopg2.extensions.connection.__weakrefoffset__, 0)
+
+    def test_prepare_once_then_execute(self):
+        conn = _Conn()
+        cur = _Cursor(conn)
+        sql = "SELECT * FROM t WHERE a = %s AND b LIKE 'x%%'"
+        db.execute_cached(cur, sql, (1,))
+        db.execute_cached(cur, sql, (2,))
+
+        prepares = [s for s, _ in cur.executed if s.startswith("PREPARE")]
+        self.assertEqual(len(prepares), 1)
+        self.assertIn("a = $1", prepares[0])
+        executes = [(s, p) for s, p in cur.executed if s.startswith("EXECUTE")]
+        self.assertEqual([p for _, p in executes], [(1,), (2,)])
+
+    def test_cache_is_per_connection(self):
+        sql = "SELECT 1"
+        first, second = _Cursor(_Conn()), _Cursor(_Conn())
+        db.execute_cached(first, sql)
+        db.execute_cached(second, sql)
+        self.assertTrue(first.executed[0][0].startswith("PREPARE"))
+        self.assertTrue(second.executed[0][0].startswith("PREPARE"))
+
+    def test_evicted_statement_is_deallocated(self):
+        cur = _Cursor(_Conn())
+        with mock.patch.object(db, "DB_STMT_CACHE_SIZE", 1):
+            db.execute_cached(cur, "SELECT 1")
+            db.execute_cached(cur, "SELECT 2")
+        self.assertTrue(any(s.startswith("DEALLOCATE") for s, _ in cur.executed))
+
+
+if __name__ == "__main__":
+    unittest.main()